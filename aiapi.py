@@ -1,11 +1,13 @@
 # aiapi.py
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify, Response, g, after_this_request, send_file
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from setbrowser import *
+import asyncio
 import json
 import time
+import hashlib
 import os
 import re
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -15,9 +17,21 @@ import logging
 import signal
 import traceback
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 import setbrowser
+from scheduler import TabScheduler, QueueRejected, PRIORITIES
+from metrics import Registry, Counter, Gauge, Histogram
+from conversations import ConversationIndex
+from cache import ResponseCache, SingleFlight, FlightFailed, response_key
+from staging import UploadStaging
+from batch import BatchStore, BATCH_ENDPOINTS
+from extraction import extract_answer
+from clients import ClientRegistry, RateLimited
+from cdp import open_cdp_page
+from stream_capture import install_capture, capture_baseline, CapturedAnswer
 
-app = Flask(__name__)
+app = Quart(__name__)
 logging.basicConfig(
     level=logging.INFO, 
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -32,117 +46,410 @@ logging.basicConfig(
 tabs = deque()  # 存储可用标签页
 tab_lock = threading.Lock()  # 标签页管理锁
 tab_counter = 0  # 标签页计数器
+pending_spawns = 0  # 正在后台创建的标签页数量
+SUPPORTED_MODELS = ["hunyuan", "deepseek"]
+tab_executors = {}  # 标签页ID -> 该标签页的浏览器操作线程
+recent_models = deque(maxlen=MODEL_MIX_WINDOW)  # 最近请求的模型，用于空闲标签页预切换
+conversation_index = ConversationIndex(max_size=CONVERSATION_INDEX_SIZE, ttl=CONVERSATION_TTL)  # 多轮对话续接索引
+response_cache = ResponseCache(max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_FILE)  # 回复缓存
+inflight_requests = SingleFlight(idempotency_ttl=IDEMPOTENCY_TTL)  # 相同请求合并执行与Idempotency-Key
+client_registry = ClientRegistry(API_KEYS, DEFAULT_CLIENT_LIMITS, REQUIRE_API_KEY)  # API Key识别与各客户端限额
+upload_staging = UploadStaging(root=UPLOAD_STAGING_DIR, max_bytes=UPLOAD_STAGING_MAX_MB * 1024 * 1024, max_age=UPLOAD_STAGING_MAX_AGE,
+                               instance=PORT_RUNNING)  # 待上传附件暂存
+
+# 监控指标（/metrics）
+metrics_registry = Registry()
+STAGE_SECONDS = metrics_registry.register(Histogram(
+    "yuanbao_stage_seconds", "各处理阶段耗时（session/model/upload/input/wait/extract）", ["stage", "model"]))
+REQUEST_SECONDS = metrics_registry.register(Histogram(
+    "yuanbao_request_seconds", "HTTP请求总耗时（流式请求只统计到开始输出）", ["endpoint", "status"]))
+RESPONSES_TOTAL = metrics_registry.register(Counter(
+    "yuanbao_http_responses_total", "按状态码统计的HTTP响应数（含503/504）", ["endpoint", "status"]))
+QUEUE_WAIT_SECONDS = metrics_registry.register(Histogram(
+    "yuanbao_queue_wait_seconds", "获取标签页前的排队时间", ["priority", "outcome"]))
+TAB_STARTUP_SECONDS = metrics_registry.register(Histogram(
+    "yuanbao_tab_startup_seconds", "标签页冷启动用时（启动浏览器或打开窗口到对话页可用）", ["backend"],
+    buckets=(0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120)))
+TAB_RESTARTS = metrics_registry.register(Counter(
+    "yuanbao_tab_restarts_total", "标签页浏览器重启次数", ["reason"]))
+TAB_REFRESHES = metrics_registry.register(Counter(
+    "yuanbao_tab_refreshes_total", "空闲标签页维护刷新次数（dom/heap/age/unresponsive）", ["reason"]))
+CACHE_LOOKUPS = metrics_registry.register(Counter(
+    "yuanbao_response_cache_total", "回复缓存查询结果（hit/miss/bypass）", ["endpoint", "result"]))
+COALESCED_REQUESTS = metrics_registry.register(Counter(
+    "yuanbao_coalesced_requests_total", "合并到相同进行中请求或按Idempotency-Key重放的请求数", ["endpoint"]))
+metrics_registry.register(Counter(
+    "yuanbao_client_requests_total", "各API Key的请求数（accepted/rate_limited/rejected）", ["client", "outcome"],
+    callback=lambda: {(c.name, outcome): n for c in client_registry.clients() for outcome, n in c.usage.items()}))
+metrics_registry.register(Counter(
+    "yuanbao_client_tab_seconds_total", "各API Key占用标签页的累计时间（秒）", ["client"],
+    callback=lambda: {(c.name,): c.tab_seconds for c in client_registry.clients()}))
+metrics_registry.register(Gauge(
+    "yuanbao_client_tabs", "各API Key占用中与排队中的请求数", ["client", "state"],
+    callback=lambda: client_tab_states()))
+metrics_registry.register(Gauge(
+    "yuanbao_tabs", "标签页池占用情况", ["state"],
+    callback=lambda: tab_pool_states()))
+metrics_registry.register(Gauge(
+    "yuanbao_queue_length", "等待标签页的请求数",
+    callback=lambda: {(): tab_scheduler.queue_length()}))
+
+def tab_pool_states():
+    busy = sum(1 for tab in list(tabs) if tab.lock.locked())
+    return {
+        ("busy",): busy,
+        ("idle",): len(tabs) - busy,
+        ("starting",): pending_spawns
+    }
+
+def client_tab_states():
+    queued = tab_scheduler.queued_by_client()
+    states = {}
+    for client in client_registry.clients():
+        states[(client.name, "active")] = client.active
+        states[(client.name, "queued")] = queued.get(client.name, 0)
+    return states
+
+def model_label(request_data):
+    if isinstance(request_data, dict):
+        return request_data.get('model') or ''
+    return ''
+
+WHITESPACE_RE = re.compile(r'\s+')
+SPACE_BEFORE_PUNCT_RE = re.compile(r'\s+([.，,；;！!？?])')
+
+# 回答生成前的中间状态文本（检索、分析中）
+SKIP_TEXT_RE = re.compile(r'找到\d+相关资料|正在分析|正在处理|正在生成')
+SKIP_TEXT_LOOKBACK = 32  # 增量匹配时向前重叠的字符数，覆盖跨越新旧文本边界的匹配
+
+# 消息气泡的class，轮询时用getElementsByClassName直接取最后一个
+BUBBLE_CLASS = "agent-chat__bubble__content"
+
+def clean_message_text(raw_text):
+    """清理文本：去除多余换行符和空格，保留句子间的合理分隔"""
+    cleaned_text = WHITESPACE_RE.sub(' ', raw_text.strip()).strip()
+    return SPACE_BEFORE_PUNCT_RE.sub(r'\1', cleaned_text)
+
+# 回复生成中的页面信号：发送按钮变为"停止生成"
+GENERATING_SELECTORS = [
+    "#yuanbao-send-btn[class*='stop']",
+    "[class*='send-btn--stop']",
+    "[class*='stop-generate']",
+    "[dt-button-id='stop_generate']"
+]
+
+# 回复生成完成后出现在回答下方的工具栏（复制、重新生成等）
+ANSWER_TOOLBAR_SELECTORS = [
+    ".agent-chat__toolbar",
+    "[class*='agent-chat__toolbar__copy']",
+    "[dt-button-id='copy_answer']"
+]
+
+# 输入区中已上传的附件（图片缩略图、文件卡片）
+UPLOAD_ITEM_SELECTORS = [
+    "[class*='upload-image-item']",
+    "[class*='upload-file-item']",
+    "[class*='file-card']",
+    "[class*='image-preview']"
+]
+
+# 附件仍在上传中的标志
+UPLOADING_SELECTORS = [
+    "[class*='uploading']",
+    "[class*='upload-progress']",
+    "[class*='file-item'] [class*='loading']"
+]
+
+UPLOAD_ERROR_SELECTORS = [
+    ".upload-error-message",
+    ".error-message",
+    ".alert-danger"
+]
+
+# 新会话页面的欢迎语
+GREETING_SELECTORS = [
+    ".agent-chat__conv--agent-homepage-v2__greeting",
+    ".welcome-message",
+    ".empty-state"
+]
+
+ACTIVE_SESSION_SELECTORS = [
+    ".yb-recent-conv-list__item.active",
+    ".active-conversation",
+    "[data-active='true']"
+]
+
+# 一次性写入输入框：优先用Quill编辑器API，其次合成粘贴事件，textarea直接设置value；返回写入后编辑器中的文本
+SET_INPUT_SCRIPT = """
+const el = arguments[0], text = arguments[1];
+el.focus();
+if (el.tagName === 'TEXTAREA' || el.tagName === 'INPUT') {
+    const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value').set;
+    setter.call(el, text);
+    el.dispatchEvent(new Event('input', {bubbles: true}));
+    return el.value;
+}
+const container = el.closest('.ql-container');
+const quill = container && (container.__quill || (window.Quill && window.Quill.find && window.Quill.find(container)));
+if (quill && quill.setText) {
+    quill.setText(text, 'user');
+    quill.setSelection(quill.getLength(), 0, 'user');
+    return quill.getText();
+}
+const data = new DataTransfer();
+data.setData('text/plain', text);
+el.dispatchEvent(new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true}));
+el.dispatchEvent(new InputEvent('input', {bubbles: true}));
+// Quill每行一个<p>，空行为<p><br></p>，按行拼接比innerText更准确
+const lines = Array.from(el.children);
+if (lines.length && lines.every(line => line.tagName === 'P')) {
+    return lines.map(line => line.textContent).join('\\n');
+}
+return el.innerText;
+"""
+
+# 页面健康状况：DOM节点数与JS堆占用（MB，performance.memory仅Chromium内核支持，其他浏览器为null）
+PAGE_HEALTH_SCRIPT = """
+const memory = performance.memory;
+return {
+    nodes: document.getElementsByTagName('*').length,
+    heap_mb: memory ? memory.usedJSHeapSize / 1048576 : null
+};
+"""
+
+# 回复轮询：一次调用取得气泡数量、生成状态、工具栏数量，以及最后一个气泡相对上次的新增文本
+# 传入上次的文本长度和FNV-1a哈希；前缀未变时只返回新增部分（append=true），否则返回全文
+POLL_SCRIPT = """
+const [bubbleClass, minCount, knownLength, knownHash, generatingSelector, toolbarSelector] = arguments;
+const bubbles = document.getElementsByClassName(bubbleClass);
+const result = {count: bubbles.length};
+if (generatingSelector !== null) {
+    result.generating = document.querySelector(generatingSelector) !== null;
+    result.toolbars = document.querySelectorAll(toolbarSelector).length;
+}
+if (bubbles.length <= minCount) {
+    return result;
+}
+const text = bubbles[bubbles.length - 1].innerText;
+const fnv = (hash, s, start, end) => {
+    for (let i = start; i < end; i++) {
+        hash = Math.imul(hash ^ s.charCodeAt(i), 16777619);
+    }
+    return hash >>> 0;
+};
+const prefixHash = knownLength <= text.length ? fnv(2166136261, text, 0, knownLength) : null;
+result.append = prefixHash === knownHash;
+const start = result.append ? knownLength : 0;
+result.suffix = text.slice(start);
+result.length = text.length;
+result.hash = fnv(result.append ? prefixHash : 2166136261, text, start, text.length);
+return result;
+"""
+FNV_OFFSET_BASIS = 2166136261  # 空字符串的哈希
+
+MODEL_SWITCH_XPATH = "//div[@dt-button-id='model_switch' and @dt-mod-id='main_mod']"
+MODEL_OPTION_XPATH = "//*[@class='ybc-model-select-dropdown-item-name']"
+
+class TextChecker:
+    """WebDriverWait条件：最后一个消息气泡的文本保持wait_time秒不变时返回该文本
+    
+    传入toolbar_baseline时优先使用页面自身的生成结束信号（停止按钮变回发送按钮、
+    回答工具栏出现），文本稳定只在没有观察到生成状态时作为兜底
+    
+    每次轮询只执行一次POLL_SCRIPT，页面只回传新增的文本，清理和中间状态匹配也只处理新增部分，
+    轮询开销不随会话轮数和回答长度增长"""
+    def __init__(self, driver, wait_time, tab_id, min_count=0, ignore_text=None, toolbar_baseline=None):
+        self.driver = driver
+        self.wait_time = wait_time
+        self.last_text = None
+        self.stable_time = None
+        self.tab_id = tab_id
+        # 发送前已有的气泡数量，以及需要忽略的文本（用户自己的提问气泡）
+        self.min_count = min_count
+        self.ignore_text = ignore_text
+        # 发送前已有的回答工具栏数量，None表示不使用页面信号
+        self.toolbar_baseline = toolbar_baseline
+        self.saw_generating = False
+        # 最后一个气泡的增量状态：页面中文本的长度和哈希、已清理的稳定前缀、其后尚未清理的原始文本
+        self.raw_length = 0
+        self.raw_hash = FNV_OFFSET_BASIS
+        self.clean_prefix = ""
+        self.raw_tail = ""
+        self.cleaned = ""
+        self.skip_hit = False
+    
+    def poll(self):
+        signals = self.toolbar_baseline is not None
+        return self.driver.execute_script(
+            POLL_SCRIPT, BUBBLE_CLASS, self.min_count, self.raw_length, self.raw_hash,
+            ", ".join(GENERATING_SELECTORS) if signals else None,
+            ", ".join(ANSWER_TOOLBAR_SELECTORS) if signals else None)
+    
+    def update_text(self, state):
+        """合并页面回传的新增文本，返回清理后的全文（与clean_message_text结果相同）"""
+        suffix = state["suffix"]
+        if state["append"]:
+            if not suffix:
+                return self.cleaned
+            skip_from = max(len(self.clean_prefix) - SKIP_TEXT_LOOKBACK, 0)
+            self.raw_tail += suffix
+        else:
+            # 换了气泡或文本被改写，从头开始
+            skip_from = 0
+            self.clean_prefix = ""
+            self.raw_tail = suffix
+            self.skip_hit = False
+        self.raw_length = state["length"]
+        self.raw_hash = state["hash"]
+        
+        # 稳定前缀以非空白字符结尾，新增部分单独清理后直接拼接即可
+        tail = self.raw_tail if self.clean_prefix else self.raw_tail.lstrip()
+        tail = SPACE_BEFORE_PUNCT_RE.sub(r'\1', WHITESPACE_RE.sub(' ', tail).rstrip())
+        self.cleaned = self.clean_prefix + tail
+        stripped = self.raw_tail.rstrip()
+        if stripped:
+            self.clean_prefix = self.cleaned
+            self.raw_tail = self.raw_tail[len(stripped):]
+        if not self.skip_hit:
+            self.skip_hit = SKIP_TEXT_RE.search(self.cleaned, skip_from) is not None
+        return self.cleaned
+    
+    def __call__(self, driver):
+        try:
+            state = self.poll()
+            if state["count"] <= self.min_count:
+                logging.debug(f"标签页 {self.tab_id}: 未找到消息元素，继续等待...")
+                return False
+            
+            cleaned_text = self.update_text(state)
+            
+            logging.debug(f"标签页 {self.tab_id}: 当前最后消息文本: {cleaned_text[:100]}...")
+            
+            if self.ignore_text and cleaned_text == self.ignore_text:
+                logging.debug(f"标签页 {self.tab_id}: 最后消息仍是提问文本，继续等待...")
+                return False
+            
+            # 先记录最新文本，之后任何提前返回（包括超时后调用方读取last_text）都不会停在旧片段上；
+            # "正在分析"等中间状态文本不记录，流式输出也就不会把它当作回答推给客户端
+            changed = cleaned_text != self.last_text
+            if self.skip_hit:
+                self.stable_time = None
+            elif changed:
+                self.last_text = cleaned_text
+                self.stable_time = time.time()
+            
+            if self.toolbar_baseline is not None:
+                if state["generating"]:
+                    # 生成中（可能在思考或检索）不按文本稳定判断结束
+                    self.saw_generating = True
+                    self.stable_time = None
+                    return False
+                if self.saw_generating or state["toolbars"] > self.toolbar_baseline:
+                    logging.debug(f"标签页 {self.tab_id}: 页面信号显示生成结束: {cleaned_text[:100]}...")
+                    return cleaned_text
+            
+            # 没有页面结束信号时按文本稳定判断，此时"正在分析"等中间状态文本不算稳定
+            if self.skip_hit:
+                logging.debug(f"标签页 {self.tab_id}: 检测到中间状态文本，继续等待...")
+                return False
+            if changed:
+                return False
+            elif self.stable_time and (time.time() - self.stable_time) >= self.wait_time:
+                logging.debug(f"标签页 {self.tab_id}: 文本已稳定: {cleaned_text[:100]}...")
+                return cleaned_text
+            return False
+        except Exception as e:
+            logging.warning(f"标签页 {self.tab_id}: 文本检查出错: {str(e)}")
+            return False
 
 class YuanbaoAutomation:
     def __init__(self, tab_id, max_retries=3):
         self.tab_id = tab_id
         self.driver = None
+        self.current_model = None  # 页面当前选中的模型，None表示未知
+        self.capture_network = False  # 是否已注入聊天流捕获脚本（ANSWER_SOURCE = "network"）
+        self.startup_seconds = None  # 最近一次浏览器初始化（冷启动）用时
         self.max_retries = max_retries
         self.initialize_driver()
         
         self.lock = threading.Lock()
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.add_job(self.refresh_page, 'interval', seconds=600)
-        self.scheduler.start()
+        self.last_used = time.time()  # 最近一次处理完请求的时间，维护任务据此跳过刚用过的标签页
     
     def initialize_driver(self):
         for attempt in range(1, self.max_retries + 1):
                 logging.info(f"标签页 {self.tab_id}: 尝试初始化浏览器 ({attempt}/{self.max_retries})")
-                self.driver = autoh('https://yuanbao.tencent.com/login')
-                self.driver.refresh()
-                logging.info(f"标签页 {self.tab_id}: 浏览器初始化完成")
+                start_time = time.perf_counter()
+                if AUTOMATION_BACKEND == "cdp":
+                    # 页面操作直接通过DevTools协议发给浏览器，共享浏览器时各标签页复用一条连接、无需切换窗口
+                    self.driver = open_cdp_page(f"{YUANBAO_URL}/login", shared=SHARED_BROWSER, prepare=self.prepare_page)
+                elif SHARED_BROWSER:
+                    # 共享浏览器模式：在同一个浏览器进程中打开一个新窗口
+                    self.driver = open_shared_window(f"{YUANBAO_URL}/login", prepare=self.prepare_page)
+                else:
+                    self.driver = autoh(f"{YUANBAO_URL}/login", prepare=self.prepare_page)
+                # 登录状态在打开页面前已恢复时第一次加载即是对话页，不再刷新；停在其他页面（如刚手动登录）时刷新一次
+                if self.wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ql-editor")), 10, "对话页加载"):
+                    self.current_model = self.detect_model()
+                    self.last_refresh = time.time()
+                else:
+                    self.refresh_page()
+                self.startup_seconds = time.perf_counter() - start_time
+                TAB_STARTUP_SECONDS.observe(self.startup_seconds, backend=AUTOMATION_BACKEND)
+                logging.info(f"标签页 {self.tab_id}: 浏览器初始化完成，用时 {self.startup_seconds:.2f} 秒")
                 return
     
-    def refresh_page(self):
-        if not self.lock.acquire(blocking=False):
-            logging.info(f"标签页 {self.tab_id}: 已有任务运行，跳过刷新")
-            return
-        
-        try:
-            logging.info(f"标签页 {self.tab_id}: 执行页面刷新")
-            self.driver.refresh()
-            time.sleep(0.5)
-        except Exception as e:
-            logging.error(f"标签页 {self.tab_id}: 页面刷新失败: {str(e)}")
-            try:
-                self.driver.quit()
-            except:
-                pass
-            self.initialize_driver()
-        finally:
-            self.lock.release()
+    def prepare_page(self, driver):
+        """浏览器打开第一个页面之前调用：network模式下先注入聊天流捕获脚本，第一次加载的页面即可捕获"""
+        if ANSWER_SOURCE == "network":
+            self.install_network_capture(driver)
     
-    def wait_for_stable_text(self, wait_time=0.5, timeout=60):
-        class TextChecker:
-            def __init__(self, driver, wait_time, tab_id):
-                self.driver = driver
-                self.wait_time = wait_time
-                self.last_text = None
-                self.stable_time = None
-                self.skip_patterns = [
-                    r'找到\d+相关资料',
-                    r'正在分析',
-                    r'正在处理',
-                    r'正在生成'
-                ]
-                self.tab_id = tab_id
-            
-            def should_skip(self, text):
-                for pattern in self.skip_patterns:
-                    if re.search(pattern, text):
-                        return True
-                return False
-            
-            def __call__(self, driver):
-                try:
-                    # 获取所有agent-chat__bubble__content元素
-                    messages = self.driver.find_elements(By.CSS_SELECTOR, '.agent-chat__bubble__content')
-                    if not messages:
-                        logging.debug(f"标签页 {self.tab_id}: 未找到消息元素，继续等待...")
-                        return False
-                    
-                    # 获取最后一个元素的纯文本
-                    last_message = messages[-1]
-                    current_text = last_message.text.strip()
-                    
-                    # 清理文本：去除多余换行符和空格，保留正常换行
-                    cleaned_text = re.sub(r'\s+', ' ', current_text).strip()
-                    # 将连续空格替换为单个空格，保留句子间的合理分隔
-                    cleaned_text = re.sub(r'\s+([.，,；;！!？?])', r'\1', cleaned_text)
-                    
-                    logging.debug(f"标签页 {self.tab_id}: 当前最后消息文本: {cleaned_text[:100]}...")
-                    
-                    if self.should_skip(cleaned_text):
-                        logging.debug(f"标签页 {self.tab_id}: 检测到中间状态文本，继续等待...")
-                        return False
-                        
-                    if cleaned_text != self.last_text:
-                        self.last_text = cleaned_text
-                        self.stable_time = time.time()
-                        return False
-                    elif self.stable_time and (time.time() - self.stable_time) >= self.wait_time:
-                        logging.debug(f"标签页 {self.tab_id}: 文本已稳定: {cleaned_text[:100]}...")
-                        return cleaned_text
-                    return False
-                except Exception as e:
-                    logging.warning(f"标签页 {self.tab_id}: 文本检查出错: {str(e)}")
-                    return False
-        
+    def install_network_capture(self, driver):
         try:
-            return WebDriverWait(self.driver, timeout).until(
-                TextChecker(self.driver, wait_time, self.tab_id)
-            )
+            install_capture(driver, CHAT_STREAM_PATTERNS)
+            self.capture_network = True
         except Exception as e:
-            logging.error(f"标签页 {self.tab_id}: 等待文本超时: {str(e)}")
-            # 直接获取最后一个元素的文本并清理
-            messages = self.driver.find_elements(By.CSS_SELECTOR, '.agent-chat__bubble__content')
-            if messages:
-                raw_text = messages[-1].text.strip()
-                # 应用相同的文本清理逻辑
-                cleaned_text = re.sub(r'\s+', ' ', raw_text).strip()
-                cleaned_text = re.sub(r'\s+([.，,；;！!？?])', r'\1', cleaned_text)
-                return cleaned_text
-            raise TimeoutError(f"等待文本超时（{timeout}秒）")
+            logging.warning(f"标签页 {self.tab_id}: 无法注入聊天流捕获脚本，回答改从页面读取: {str(e)}")
+            self.capture_network = False
+    
+    def refresh_page(self):
+        """刷新页面，调用方需持有标签页锁；失败时抛出异常"""
+        logging.info(f"标签页 {self.tab_id}: 执行页面刷新")
+        self.driver.refresh()
+        self.wait_until(EC.presence_of_element_located((By.CSS_SELECTOR, ".ql-editor")), 10, "页面加载")
+        self.current_model = self.detect_model()
+        self.last_refresh = time.time()
+    
+    def page_health(self):
+        """返回 {"nodes": DOM节点数, "heap_mb": JS堆占用或None}"""
+        return self.driver.execute_script(PAGE_HEALTH_SCRIPT)
+    
+    def stream_response(self, original_text, min_count=0, toolbar_baseline=None, wait_time=1, timeout=180, poll_interval=0.1):
+        """逐步产出最后一个消息气泡新增的文本，完成判定与wait_for_response一致；超时抛出TimeoutError，已输出的部分不算完整回答"""
+        checker = TextChecker(self.driver, wait_time, self.tab_id, min_count=min_count,
+                              ignore_text=clean_message_text(original_text), toolbar_baseline=toolbar_baseline)
+        sent = ""
+        end_time = time.time() + timeout
+        while True:
+            result = checker(self.driver)
+            current = result or checker.last_text or ""
+            if current.startswith(sent):
+                delta = current[len(sent):]
+                if delta:
+                    sent += delta
+                    yield delta
+            elif result:
+                # 已发送的内容无法撤回，最终文本与之不一致时按出错结束，不把拼接出的文本当作回答
+                raise RuntimeError("页面上的回答被改写，与已输出的内容不一致")
+            else:
+                # 页面文本暂时回退或被改写，等它重新接上已发送的内容再继续输出
+                logging.debug(f"标签页 {self.tab_id}: 流式文本与已发送内容不一致，等待")
+            if result:
+                logging.info(f"标签页 {self.tab_id}: 流式输出完成，文本长度: {len(sent)}")
+                return
+            if time.time() >= end_time:
+                logging.error(f"标签页 {self.tab_id}: 流式输出等待超时（{timeout}秒），已输出 {len(sent)} 字")
+                raise TimeoutError(f"流式输出等待超时（{timeout}秒）")
+            time.sleep(poll_interval)
     
     def get_new_message(self, timeout=60):
         logging.info(f"标签页 {self.tab_id}: 等待新消息...")
@@ -174,10 +481,7 @@ class YuanbaoAutomation:
     
     def upload_image(self, image_data):
         logging.info(f"标签页 {self.tab_id}: 开始上传图片...")
-        temp_file = None
         try:
-            temp_file = f"temp_img_{int(time.time()*1000)}.png"
-            
             # 尝试多种方式定位上传按钮
             selectors = [
                 "span[class*='upload-icon']",
@@ -197,7 +501,6 @@ class YuanbaoAutomation:
                 raise Exception("无法定位上传按钮")
                 
             upload_btn.click()
-            time.sleep(0.5)
 
             # 定位文件输入框
             
@@ -218,38 +521,25 @@ class YuanbaoAutomation:
             if not file_input:
                 raise Exception("无法定位文件输入框")
             
-            # 创建临时文件
-            with open(temp_file, "wb") as f:
-                # 确保正确处理base64编码
-                if image_data.startswith('data:image'):
-                    # 移除base64前缀
-                    header, encoded = image_data.split(",", 1)
-                    image_bytes = base64.b64decode(encoded)
-                else:
-                    image_bytes = base64.b64decode(image_data)
-                    
-                f.write(image_bytes)
-            
-            # 上传文件
-            file_input.send_keys(os.path.abspath(temp_file))
-            time.sleep(2)
+            # data URL按MIME类型确定扩展名，纯base64默认为png
+            filename = None if image_data.startswith('data:image') else "image.png"
+            with upload_staging.staged(image_data, filename) as image_path:
+                items_before = self.count_elements(UPLOAD_ITEM_SELECTORS)
+                file_input.send_keys(image_path)
+                self.wait_for_upload(items_before)
             
             logging.info(f"标签页 {self.tab_id}: 图片上传完成")
             return True
         except Exception as e:
             logging.error(f"标签页 {self.tab_id}: 图片上传出错: {str(e)}")
             return False
-        finally:
-            # 清理临时文件
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
     
     def upload_files(self, files, request_data):
         logging.info(f"标签页 {self.tab_id}: 准备上传 {len(files)} 个文件")
-        temp_files = []
+        with ExitStack() as staged_files:
+            return self._upload_files(files, request_data, staged_files)
+    
+    def _upload_files(self, files, request_data, staged_files):
         try:
             image_types = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
             
@@ -272,7 +562,6 @@ class YuanbaoAutomation:
                 raise Exception("无法定位上传按钮")
                 
             upload_btn.click()
-            time.sleep(0.5)
             
             # 点击本地文件上传
             local_btn_selectors = [
@@ -293,7 +582,6 @@ class YuanbaoAutomation:
                 raise Exception("无法定位本地上传按钮")
                 
             local_btn.click()
-            time.sleep(0.5)
             
             # 定位文件输入框
             file_input_selectors = [
@@ -344,28 +632,19 @@ class YuanbaoAutomation:
                     logging.info(f"标签页 {self.tab_id}: 跳过图片文件: {filename}")
                     continue
                 
-                # 使用原始文件名（来自request_data）作为临时文件名
-                temp_file = filename  # 直接使用request_data中的文件名
-                temp_files.append(temp_file)
-                
-                logging.info(f"标签页 {self.tab_id}: 创建临时文件 {temp_file}")
-                with open(temp_file, "wb") as f:
-                    f.write(base64.b64decode(file_data))
-                file_paths.append(os.path.abspath(temp_file))
+                # 保留原始文件名（去除路径与不安全字符），页面上显示的附件名不变
+                path = staged_files.enter_context(upload_staging.staged(file_data, filename))
+                logging.info(f"标签页 {self.tab_id}: 暂存文件 {path}")
+                file_paths.append(path)
             
             if file_paths:
                 logging.info(f"标签页 {self.tab_id}: 开始上传文件")
+                items_before = self.count_elements(UPLOAD_ITEM_SELECTORS)
                 file_input.send_keys("\n".join(file_paths))
-                time.sleep(2)
+                self.wait_for_upload(items_before)
                 
                 # 检查上传错误
-                error_selectors = [
-                    ".upload-error-message",
-                    ".error-message",
-                    ".alert-danger"
-                ]
-                
-                for selector in error_selectors:
+                for selector in UPLOAD_ERROR_SELECTORS:
                     try:
                         errors = self.driver.find_elements(By.CSS_SELECTOR, selector)
                         if errors:
@@ -380,32 +659,39 @@ class YuanbaoAutomation:
                 self.driver.find_element(By.TAG_NAME, 'body').click()
             except:
                 pass
-            time.sleep(0.5)
             
             logging.info(f"标签页 {self.tab_id}: 文件上传完成")
             return True
         except Exception as e:
             logging.error(f"标签页 {self.tab_id}: 文件上传失败: {str(e)}")
             return False
-        finally:
-            # 清理临时文件
-            for path in temp_files:
-                if os.path.exists(path):
-                    try:
-                        print(f"删除临时文件: {path}")
-                    except:
-                        pass
+    
+    def detect_model(self):
+        """从模型切换按钮的文字读取当前模型，无法判断时返回None"""
+        try:
+            label = self.driver.find_element(By.XPATH, MODEL_SWITCH_XPATH).text
+        except Exception:
+            return None
+        if "DeepSeek" in label:
+            return "deepseek"
+        if "Hunyuan" in label or "混元" in label:
+            return "hunyuan"
+        return None
     
     def change_model(self, model):
+        if self.current_model == model.lower():
+            logging.info(f"标签页 {self.tab_id}: 已是 {model} 模型，跳过切换")
+            return True
         logging.info(f"标签页 {self.tab_id}: 准备切换到 {model} 模型")
+        self.current_model = None
         try:
             # 修复：使用正确的元素定位方法
-            selectors = self.driver.find_element(By.XPATH, "//div[@dt-button-id='model_switch' and @dt-mod-id='main_mod']")
+            selectors = self.driver.find_element(By.XPATH, MODEL_SWITCH_XPATH)
             selectors.click()
-            time.sleep(0.5)
+            self.wait_until(EC.visibility_of_any_elements_located((By.XPATH, MODEL_OPTION_XPATH)), 3, "模型下拉框展开")
             
             # 选择模型
-            model_options = elements = self.driver.find_elements(By.XPATH, "//*[@class='ybc-model-select-dropdown-item-name']")
+            model_options = self.driver.find_elements(By.XPATH, MODEL_OPTION_XPATH)
 
             found = False
             for option in model_options:
@@ -426,7 +712,8 @@ class YuanbaoAutomation:
                 logging.error(f"标签页 {self.tab_id}: 未找到匹配的模型选项: {model}")
                 return False
                 
-            time.sleep(0.5)
+            self.wait_until(EC.invisibility_of_element_located((By.XPATH, MODEL_OPTION_XPATH)), 3, "模型下拉框关闭")
+            self.current_model = model.lower()
             logging.info(f"标签页 {self.tab_id}: 模型切换完成")
             return True
         except Exception as e:
@@ -439,14 +726,8 @@ class YuanbaoAutomation:
             logging.info(f"标签页 {self.tab_id}: 处理会话: {session_id}")
             
             # 检查当前会话
-            current_selectors = [
-                ".yb-recent-conv-list__item.active",
-                ".active-conversation",
-                "[data-active='true']"
-            ]
-            
             current = None
-            for selector in current_selectors:
+            for selector in ACTIVE_SESSION_SELECTORS:
                 try:
                     logging.debug(f"标签页 {self.tab_id}: 检查当前会话选择器: {selector}")
                     elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
@@ -489,22 +770,10 @@ class YuanbaoAutomation:
                     
                 logging.info(f"标签页 {self.tab_id}: 点击新建会话按钮")
                 new_btn.click()
-                logging.info(f"标签页 {self.tab_id}: 等待2秒让页面响应")
-                time.sleep(0.5)
-                
-                # 等待新会话加载 - 优化：缩短等待时间，添加详细日志
-                greeting_selectors = [
-                    ".agent-chat__bubble__content",  # 更通用的聊天内容选择器
-                    ".agent-chat__conv--agent-homepage-v2__greeting",
-                    ".welcome-message",
-                    ".empty-state"
-                ]
                 
                 logging.info(f"标签页 {self.tab_id}: 等待新会话加载")
-                # 等待10秒后直接跳过
-                time.sleep(2)
-                logging.warning(f"标签页 {self.tab_id}: 新会话加载超时，跳过等待")
-                # 不抛出异常，继续执行
+                # 超时不抛出异常，继续执行
+                self.wait_until(self.new_conversation_ready, 5, "新会话加载")
             else:
                 logging.info(f"标签页 {self.tab_id}: 切换到会话 {session_id}")
                 # 尝试多种方式定位会话
@@ -531,245 +800,503 @@ class YuanbaoAutomation:
                     raise Exception(f"无法定位会话: {session_id}")
                     
                 session.click()
-                time.sleep(0.5)
+                self.wait_until(
+                    lambda driver: any(el.get_attribute("dt-cid") == session_id
+                                       for el in driver.find_elements(By.CSS_SELECTOR, ", ".join(ACTIVE_SESSION_SELECTORS))),
+                    5, "会话切换"
+                )
             return True
         except Exception as e:
             logging.error(f"标签页 {self.tab_id}: 会话操作失败: {str(e)}")
             logging.error(f"标签页 {self.tab_id}: 错误详情: {traceback.format_exc()}")
             return False
     
-    def contains_keywords(self, text, query, min_keywords=2):
-        """检查文本是否包含查询中的关键词"""
-        if not text or not query:
+    def count_elements(self, selectors):
+        # 在页面中直接计数：一次往返，不为每个匹配的元素创建引用
+        return self.driver.execute_script("return document.querySelectorAll(arguments[0]).length;", ", ".join(selectors))
+    
+    def wait_until(self, condition, timeout, description):
+        """等待页面条件成立，超时只记录警告不抛异常"""
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(condition)
+            return True
+        except Exception:
+            logging.warning(f"标签页 {self.tab_id}: 等待{description}超时（{timeout}秒），继续执行")
+            return False
+    
+    def wait_for_upload(self, items_before, timeout=15):
+        """等待附件出现在输入区且没有仍在上传的项"""
+        def finished(driver):
+            if self.count_elements(UPLOADING_SELECTORS):
+                return False
+            return self.count_elements(UPLOAD_ITEM_SELECTORS) > items_before or self.count_elements(UPLOAD_ERROR_SELECTORS) > 0
+        return self.wait_until(finished, timeout, "附件上传")
+    
+    def new_conversation_ready(self, driver):
+        """输入框可用，且出现欢迎语或左侧不再有选中的会话"""
+        if not self.count_elements([".ql-editor"]):
             return False
+        return self.count_elements(GREETING_SELECTORS) > 0 or self.count_elements(ACTIVE_SESSION_SELECTORS) == 0
+    
+    def wait_for_response(self, original_text, min_count=0, toolbar_baseline=0, wait_time=1, timeout=180):
+        """等待回复生成结束：优先使用页面的结束信号，文本稳定作为兜底；超时抛出TimeoutError，不把未完成的文本当作回答"""
+        checker = TextChecker(self.driver, wait_time, self.tab_id, min_count=min_count,
+                              ignore_text=clean_message_text(original_text), toolbar_baseline=toolbar_baseline)
+        try:
+            final_text = WebDriverWait(self.driver, timeout, poll_frequency=0.1).until(checker)
+            logging.info(f"标签页 {self.tab_id}: 回复完成，最终文本长度: {len(final_text)}")
+            return final_text
+        except Exception as e:
+            logging.error(f"标签页 {self.tab_id}: 等待回复超时: {str(e)}，已生成 {len(checker.last_text or '')} 字")
+            raise TimeoutError(f"等待回复超时（{timeout}秒）")
+    
+    def network_baseline(self):
+        """发送前的聊天流序号；未启用或页面中没有捕获脚本时返回None，回答从DOM读取"""
+        if not self.capture_network:
+            return None
+        try:
+            return capture_baseline(self.driver)
+        except Exception as e:
+            logging.warning(f"标签页 {self.tab_id}: 读取聊天流状态失败: {str(e)}")
+            return None
+    
+    def wait_for_network_answer(self, stream_baseline, timeout=180):
+        """等待发送后的聊天流结束，返回与extract_answer相同格式的回答；没有完整收到时返回None，由调用方改从DOM读取"""
+        captured = CapturedAnswer(self.driver, stream_baseline)
+        for _ in captured.deltas(NETWORK_STREAM_START_TIMEOUT, timeout):
+            pass
+        if not (captured.complete and captured.text):
+            logging.warning(f"标签页 {self.tab_id}: 聊天流不可用（{captured.error or '内容为空'}），改从页面读取")
+            return None
+        logging.info(f"标签页 {self.tab_id}: 从聊天流收到回复，文本长度: {len(captured.text)}")
+        if not ANSWER_MARKDOWN:
+            return {"text": clean_message_text(captured.text), "thinking": None, "citations": []}
+        return {"text": captured.text, "thinking": captured.thinking or None, "citations": []}
+    
+    def extract_answer(self, fallback):
+        """一次调用取得最后一个回答气泡的Markdown、思考过程和引用；提取失败或为空时返回fallback"""
+        try:
+            answer = extract_answer(self.driver, BUBBLE_CLASS)
+        except Exception as e:
+            logging.warning(f"标签页 {self.tab_id}: Markdown提取失败，使用纯文本: {str(e)}")
+            return fallback
+        if not answer or not answer.get("text"):
+            return fallback
+        return answer
+    
+    def stream_answer(self, streamed_text):
+        """流式输出结束后取得与send_message格式相同的完整回答：流式输出的是页面纯文本，
+        写入缓存、交给合并到本请求的非流式请求前按ANSWER_MARKDOWN重新提取一次"""
+        answer = {"text": streamed_text, "thinking": None, "citations": []}
+        if not ANSWER_MARKDOWN:
+            answer["text"] = clean_message_text(streamed_text)
+            return answer
+        with STAGE_SECONDS.time(stage="extract", model=self.current_model or ""):
+            return self.extract_answer(answer)
+    
+    def submit_message(self, request_data):
+        """输入文本并点击发送，返回实际发送的文本"""
+        logging.info(f"标签页 {self.tab_id}: 输入文本")
+        # 尝试多种方式定位输入框
+        input_selectors = [
+            ".ql-editor.ql-blank",
+            ".message-input",
+            "textarea[placeholder='输入你的问题']",
+            "[contenteditable='true']"
+        ]
         
-        # 分词比较（简单实现）
-        text_words = set(re.findall(r'\b\w+\b', text.lower()))
-        query_words = set(re.findall(r'\b\w+\b', query.lower()))
+        input_box = None
+        for selector in input_selectors:
+            try:
+                input_box = WebDriverWait(self.driver, 8).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, selector))
+                )
+                break
+            except:
+                continue
+        
+        if not input_box:
+            raise Exception("无法定位输入框")
+            
+        # 安全获取文本内容
+        text_content = ""
+        if isinstance(request_data, dict):
+            text_content = request_data.get('text', '')
+        elif hasattr(request_data, 'get'):
+            text_content = request_data.get('text', '')
+        else:
+            text_content = str(request_data)
+        
+        input_box.clear()
+        self.fill_input(input_box, text_content)
+        
+        logging.info(f"标签页 {self.tab_id}: 发送消息")
+        # 尝试多种方式定位发送按钮
+        send_btn_selectors = [
+            "#yuanbao-send-btn"
+        ]
         
-        # 计算交集
-        common_words = text_words.intersection(query_words)
+        send_btn = None
+        for selector in send_btn_selectors:
+            try:
+                send_btn = WebDriverWait(self.driver, 8).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
+                )
+                break
+            except:
+                continue
         
-        # 如果共同词汇达到一定数量，认为包含关键词
-        return len(common_words) >= min(min_keywords, len(query_words))
+        if not send_btn:
+            raise Exception("无法定位发送按钮")
+            
+        send_btn.click()
+        return text_content
     
-    def validate_and_wait_for_response(self, original_text, request_data, timeout=180):
-        """验证响应文本并与原始文本对比，如果相同则继续检测未稳定文本"""
+    def fill_input(self, input_box, text):
+        """一次性写入输入框内容，写入结果与原文不一致（换行或字符丢失）时退回send_keys逐字输入"""
+        def normalize(value):
+            return (value or "").replace('\r\n', '\n').rstrip('\n')
+        
         try:
-            logging.info(f"标签页 {self.tab_id}: 开始验证响应文本")
-            
-            # 安全获取文本内容用于对比
-            if isinstance(request_data, dict):
-                original_query = request_data.get('text', '')
-            elif hasattr(request_data, 'get'):
-                original_query = request_data.get('text', '')
-            else:
-                original_query = str(request_data)
-            
-            logging.info(f"标签页 {self.tab_id}: 原始查询文本: {original_query[:100]}...")
-            
-            # 初始等待文本稳定 - 直接获取最后一个消息的稳定文本
-            initial_text = self.wait_for_stable_text(wait_time=0.5, timeout=60)
-            logging.info(f"标签页 {self.tab_id}: 初始稳定文本: {initial_text[:100]}...")
-            
-            # 文本验证逻辑
-            validation_count = 0
-            max_validations = 3
-            current_text = initial_text
-            
-            while validation_count < max_validations:
-                validation_count += 1
-                logging.info(f"标签页 {self.tab_id}: 执行第 {validation_count} 次文本验证")
-                time.sleep(0.5)
-                
-                # 检查条件1：响应文本与原始查询完全相同
-                # 检查条件2：响应文本包含原始查询的关键词（防止误判）
-                is_identical = (current_text.strip() == original_query.strip())
-                contains_keywords = self.contains_keywords(current_text, original_query)
-                
-                logging.info(f"标签页 {self.tab_id}: 文本验证 - 相同: {is_identical}, 包含关键词: {contains_keywords}")
-                
-                # 如果文本完全相同，说明可能是卡顿或未生成完成
-                if is_identical and len(current_text.strip()) > 0:
-                    logging.warning(f"标签页 {self.tab_id}: 检测到响应文本与查询文本完全相同 (第{validation_count}次)，可能存在异常")
-                    
-                    # 额外等待更长时间
-                    extra_wait_time = 1  # 减少等待时间
-                    logging.info(f"标签页 {self.tab_id}: 额外等待 {extra_wait_time} 秒后重新检查...")
-                    time.sleep(extra_wait_time)
-                    
-                    # 重新获取文本
-                    try:
-                        current_text = self.wait_for_stable_text(wait_time=1, timeout=60)
-                        logging.info(f"标签页 {self.tab_id}: 重新获取文本: {current_text[:100]}...")
-                        
-                        # 再次验证
-                        is_still_identical = (current_text.strip() == original_query.strip())
-                        if not is_still_identical:
-                            logging.info(f"标签页 {self.tab_id}: 文本已更新，退出验证循环")
-                            break
-                            
-                    except Exception as e:
-                        logging.error(f"标签页 {self.tab_id}: 重新获取文本失败: {str(e)}")
-                        break
-                        
-                # 如果文本包含关键词但不完全相同，可能是正常响应
-                elif contains_keywords and not is_identical:
-                    logging.info(f"标签页 {self.tab_id}: 响应文本包含查询关键词，判断为正常响应")
-                    break
-                    
-                # 如果文本完全不同，说明是正常的新响应
-                elif not is_identical and not contains_keywords:
-                    logging.info(f"标签页 {self.tab_id}: 响应文本与查询文本不同，判断为正常响应")
-                    break
-                    
-                # 如果达到最大验证次数仍相同，强制返回当前文本
-                if validation_count >= max_validations:
-                    logging.warning(f"标签页 {self.tab_id}: 达到最大验证次数，强制返回当前文本")
-                    break
-            
-            # 最终等待确保文本完全稳定
-            final_text = self.wait_for_stable_text(wait_time=1, timeout=60)
-            logging.info(f"标签页 {self.tab_id}: 最终稳定文本: {final_text[:100]}...")
-            
-            logging.info(f"标签页 {self.tab_id}: 文本验证完成，最终文本长度: {len(final_text)}")
-            return final_text
-            
+            written = self.driver.execute_script(SET_INPUT_SCRIPT, input_box, text)
+            if normalize(written) == normalize(text):
+                return
+            logging.warning(f"标签页 {self.tab_id}: 快速输入结果不一致（{len(normalize(written))}/{len(normalize(text))}字符），改用逐字输入")
         except Exception as e:
-            logging.error(f"标签页 {self.tab_id}: 文本验证过程出错: {str(e)}")
-            # 出错时尝试直接获取最后一个消息的文本并清理
+            logging.warning(f"标签页 {self.tab_id}: 快速输入失败，改用逐字输入: {str(e)}")
+        
+        try:
+            self.driver.execute_script(SET_INPUT_SCRIPT, input_box, "")
+        except Exception:
+            pass
+        input_box.clear()
+        input_box.send_keys(text)
+    
+    def get_current_session_id(self):
+        logging.info(f"标签页 {self.tab_id}: 获取会话ID")
+        # 尝试多种方式定位活动会话
+        active = None
+        for selector in ACTIVE_SESSION_SELECTORS:
             try:
-                messages = self.driver.find_elements(By.CSS_SELECTOR, '.agent-chat__bubble__content')
-                if messages:
-                    raw_text = messages[-1].text.strip()
-                    # 应用相同的文本清理逻辑
-                    cleaned_text = re.sub(r'\s+', ' ', raw_text).strip()
-                    cleaned_text = re.sub(r'\s+([.，,；;！!？?])', r'\1', cleaned_text)
-                    return cleaned_text
-                return initial_text
+                active = WebDriverWait(self.driver, 8).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, selector))
+                )
+                break
             except:
-                return ""
+                continue
+        
+        if not active:
+            raise Exception("无法定位活动会话")
+            
+        return active.get_attribute("dt-cid")
     
     def send_message(self, request_data):
         try:
-            logging.info(f"标签页 {self.tab_id}: 输入文本")
-            # 尝试多种方式定位输入框
-            input_selectors = [
-                ".ql-editor.ql-blank",
-                ".message-input",
-                "textarea[placeholder='输入你的问题']",
-                "[contenteditable='true']"
-            ]
-            
-            input_box = None
-            for selector in input_selectors:
-                try:
-                    input_box = WebDriverWait(self.driver, 8).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                    )
-                    break
-                except:
-                    continue
-            
-            if not input_box:
-                raise Exception("无法定位输入框")
-                
-            # 安全获取文本内容
-            text_content = ""
-            if isinstance(request_data, dict):
-                text_content = request_data.get('text', '')
-            elif hasattr(request_data, 'get'):
-                text_content = request_data.get('text', '')
-            else:
-                text_content = str(request_data)
-            
-            input_box.clear()
-            input_box.send_keys(text_content)
-            
-            logging.info(f"标签页 {self.tab_id}: 发送消息")
-            # 尝试多种方式定位发送按钮
-            send_btn_selectors = [
-                "#yuanbao-send-btn"
-            ]
-            
-            send_btn = None
-            for selector in send_btn_selectors:
-                try:
-                    send_btn = WebDriverWait(self.driver, 8).until(
-                        EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
-                    )
-                    break
-                except:
-                    continue
-            
-            if not send_btn:
-                raise Exception("无法定位发送按钮")
-                
-            send_btn.click()
+            baseline = self.count_elements(['.agent-chat__bubble__content'])
+            toolbars = self.count_elements(ANSWER_TOOLBAR_SELECTORS)
+            stream_baseline = self.network_baseline()
+            with STAGE_SECONDS.time(stage="input", model=model_label(request_data)):
+                text_content = self.submit_message(request_data)
             
             logging.info(f"标签页 {self.tab_id}: 等待回复")
-            # 使用新的验证方法替代原来的简单等待
-            final_text = self.validate_and_wait_for_response(text_content, request_data)
-            
-            logging.info(f"标签页 {self.tab_id}: 获取会话ID")
-            # 尝试多种方式定位活动会话
-            active_selectors = [
-                ".yb-recent-conv-list__item.active",
-                ".active-conversation",
-                "[data-active='true']"
-            ]
-            
-            active = None
-            for selector in active_selectors:
-                try:
-                    active = WebDriverWait(self.driver, 8).until(
-                        EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                    )
-                    break
-                except:
-                    continue
+            answer = None
+            if stream_baseline is not None:
+                with STAGE_SECONDS.time(stage="wait", model=model_label(request_data)):
+                    answer = self.wait_for_network_answer(stream_baseline)
             
-            if not active:
-                raise Exception("无法定位活动会话")
+            if answer is None:
+                with STAGE_SECONDS.time(stage="wait", model=model_label(request_data)):
+                    final_text = self.wait_for_response(text_content, min_count=baseline, toolbar_baseline=toolbars)
                 
-            current_id = active.get_attribute("dt-cid")
+                answer = {"text": final_text, "thinking": None, "citations": []}
+                if ANSWER_MARKDOWN:
+                    with STAGE_SECONDS.time(stage="extract", model=model_label(request_data)):
+                        answer = self.extract_answer(answer)
             
-            return {"id": current_id, "text": final_text}
+            current_id = self.get_current_session_id()
+            
+            return {"id": current_id, **answer}
         except Exception as e:
             logging.error(f"标签页 {self.tab_id}: 消息发送失败: {str(e)}")
             raise
+    
+    def send_message_stream(self, request_data, timeout=180):
+        """发送消息并以生成器形式逐段返回回复文本"""
+        try:
+            baseline = self.count_elements(['.agent-chat__bubble__content'])
+            toolbars = self.count_elements(ANSWER_TOOLBAR_SELECTORS)
+            stream_baseline = self.network_baseline()
+            with STAGE_SECONDS.time(stage="input", model=model_label(request_data)):
+                text_content = self.submit_message(request_data)
+            
+            logging.info(f"标签页 {self.tab_id}: 流式等待回复")
+            with STAGE_SECONDS.time(stage="wait", model=model_label(request_data)):
+                if stream_baseline is not None:
+                    captured = CapturedAnswer(self.driver, stream_baseline)
+                    yield from captured.deltas(NETWORK_STREAM_START_TIMEOUT, timeout)
+                    if captured.text:
+                        # 已输出的是聊天流原文，无法与页面文本衔接，中途失败时按出错结束，不当作完整回答
+                        if not captured.complete:
+                            logging.warning(f"标签页 {self.tab_id}: 聊天流中断（{captured.error}），已输出 {len(captured.text)} 字")
+                            if captured.timed_out:
+                                raise TimeoutError(captured.error)
+                            raise RuntimeError(f"聊天流中断: {captured.error}")
+                        return
+                    logging.warning(f"标签页 {self.tab_id}: 聊天流不可用（{captured.error or '内容为空'}），改从页面读取")
+                yield from self.stream_response(text_content, min_count=baseline, toolbar_baseline=toolbars, timeout=timeout)
+        except Exception as e:
+            logging.error(f"标签页 {self.tab_id}: 流式消息发送失败: {str(e)}")
+            raise
 
 # 初始化标签页管理器
 def initialize_tabs():
-    global tabs, tab_counter
+    """启动时并行预热MIN_TABS个标签页"""
+    warm = max(1, min(MIN_TABS, MAX_TABS))
+    tab_ids = [reserve_tab_id() for _ in range(warm)]
+    
+    # 还没有保存的cookies时需要手动登录，先单独启动一个标签页
+    if not os.path.exists("cookies.json"):
+        spawn_tab(tab_ids.pop(0))
+    
+    with ThreadPoolExecutor(max_workers=max(len(tab_ids), 1), thread_name_prefix="tab-warmup") as executor:
+        list(executor.map(spawn_tab, tab_ids))
+    logging.info(f"标签页预热完成，可用标签页数量: {len(tabs)}")
+
+# 获取可用标签页（返回时已加锁）
+def get_available_tab(model=None):
     with tab_lock:
-        # 创建初始标签页
-        main_tab = YuanbaoAutomation(tab_id=tab_counter)
-        tabs.append(main_tab)
+        # 优先选择已处于所需模型的空闲标签页，省去模型切换
+        candidates = sorted(tabs, key=lambda tab: tab.current_model != model) if model else tabs
+        for tab in candidates:
+            if tab.lock.acquire(blocking=False):
+                return tab
+        return None
+
+def reserve_tab_id():
+    """预留一个标签页编号并计入正在创建的数量，达到MAX_TABS时返回None"""
+    global tab_counter, pending_spawns
+    with tab_lock:
+        if len(tabs) + pending_spawns >= MAX_TABS:
+            return None
+        tab_id = tab_counter
         tab_counter += 1
-        logging.info(f"初始化主标签页 {main_tab.tab_id}")
+        pending_spawns += 1
+        return tab_id
 
-# 获取可用标签页
-def get_available_tab():
-    global tabs, tab_counter
+def spawn_tab(tab_id):
+    """在锁外创建标签页，就绪后加入标签页池并交给调度器"""
+    global pending_spawns
+    try:
+        new_tab = YuanbaoAutomation(tab_id=tab_id)
+    except Exception as e:
+        logging.error(f"标签页 {tab_id}: 创建失败: {str(e)}")
+        with tab_lock:
+            pending_spawns -= 1
+        return None
     
+    new_tab.lock.acquire()
     with tab_lock:
-        # 检查是否有可用标签页
-        available_tabs = [tab for tab in tabs if not tab.lock.locked()]
-        if available_tabs:
-            return available_tabs[0]
-        
-        # 没有可用标签页，检查是否可以创建新标签页
-        if len(tabs) < MAX_TABS:
-            new_tab = YuanbaoAutomation(tab_id=tab_counter)
-            tabs.append(new_tab)
-            tab_counter += 1
-            logging.info(f"创建新标签页 {new_tab.tab_id}")
-            return new_tab
-        
-        # 所有标签页都忙且达到最大数量
+        tabs.append(new_tab)
+        pending_spawns -= 1
+    logging.info(f"创建新标签页 {new_tab.tab_id}")
+    tab_scheduler.offer(new_tab)
+    return new_tab
+
+def request_spawn():
+    """所有标签页都忙时在后台新建标签页，不阻塞当前请求"""
+    tab_id = reserve_tab_id()
+    if tab_id is None:
         logging.warning(f"所有标签页都忙且达到最大数量 {MAX_TABS}")
-        return None
+        return False
+    logging.info(f"后台创建标签页 {tab_id}")
+    spawn_executor.submit(spawn_tab, tab_id)
+    return True
+
+pool_scheduler = BackgroundScheduler()  # 标签页池级别的后台任务
+
+spawn_executor = ThreadPoolExecutor(max_workers=SPAWN_WORKERS, thread_name_prefix="tab-spawn")
+
+tab_scheduler = TabScheduler(
+    try_acquire=get_available_tab,
+    spawn=request_spawn,
+    capacity=lambda: len(tabs),
+    max_queue=MAX_QUEUE,
+    default_timeout=DEFAULT_REQUEST_TIMEOUT
+)
+
+def release_tab(tab, used=True):
+    """释放标签页，若有排队请求则直接移交；used=False表示只是后台维护，不算作处理过请求"""
+    if used:
+        tab.last_used = time.time()
+    tab_scheduler.release(tab)
+    logging.info(f"标签页 {tab.tab_id}: 释放锁")
+
+def get_admission_params(body):
+    """从请求头或请求体读取优先级(interactive/bulk)与超时（秒）"""
+    if not isinstance(body, dict):
+        body = {}
+    priority = str(request.headers.get('X-Priority') or body.get('priority') or 'interactive').lower()
+    if priority not in PRIORITIES:
+        priority = 'interactive'
+    timeout = request.headers.get('X-Request-Timeout') or body.get('timeout')
+    try:
+        timeout = float(timeout) if timeout else None
+    except (TypeError, ValueError):
+        timeout = None
+    # OpenAI格式用model，原有格式用mode
+    model = body.get('model') or body.get('mode') or 'hunyuan'
+    if model not in SUPPORTED_MODELS:
+        model = 'hunyuan'
+    return priority, timeout, model
+
+async def acquire_tab(priority, timeout, model=None, client=None):
+    """通过调度器获取标签页，并记录排队时间；排队期间不占用线程"""
+    if model:
+        recent_models.append(model)
+    start = time.time()
+    try:
+        tab = await tab_scheduler.acquire_async(priority, timeout, model=model, client=client)
+    except QueueRejected:
+        QUEUE_WAIT_SECONDS.observe(time.time() - start, priority=priority, outcome="rejected")
+        if client:
+            client_registry.record(client, "rejected")
+        raise
+    QUEUE_WAIT_SECONDS.observe(time.time() - start, priority=priority, outcome="acquired")
+    return tab
+
+def tab_executor(tab):
+    """每个标签页固定一个工作线程，请求中的浏览器操作都在该线程上按顺序执行"""
+    executor = tab_executors.get(tab.tab_id)
+    if executor is None:
+        executor = tab_executors.setdefault(
+            tab.tab_id, ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"tab-{tab.tab_id}"))
+    return executor
+
+def run_on_tab(tab, func, *args):
+    """在标签页的工作线程上执行浏览器操作，返回可await的结果"""
+    return asyncio.get_running_loop().run_in_executor(tab_executor(tab), func, *args)
+
+def preswitch_idle_tabs():
+    """按最近请求的模型比例，把空闲标签页预先切换到数量不足的模型"""
+    window = list(recent_models)
+    if not window:
+        return
+    with tab_lock:
+        snapshot = list(tabs)
+    
+    target = {m: round(window.count(m) / len(window) * len(snapshot)) for m in SUPPORTED_MODELS}
+    current = {m: sum(1 for tab in snapshot if tab.current_model == m) for m in SUPPORTED_MODELS}
+    
+    for tab in snapshot:
+        lacking = [m for m in SUPPORTED_MODELS if current[m] < target[m]]
+        if not lacking:
+            return
+        # 只动多余模型或模型未知的标签页
+        if tab.current_model in SUPPORTED_MODELS and current[tab.current_model] <= target[tab.current_model]:
+            continue
+        if not tab.lock.acquire(blocking=False):
+            continue
+        try:
+            old_model = tab.current_model
+            logging.info(f"标签页 {tab.tab_id}: 空闲预切换模型 {old_model} -> {lacking[0]}")
+            if tab.change_model(lacking[0]):
+                if old_model in current:
+                    current[old_model] -= 1
+                current[lacking[0]] += 1
+        finally:
+            release_tab(tab, used=False)
+
+def refresh_reason(tab):
+    """根据页面健康状况判断是否需要刷新，返回原因或None"""
+    try:
+        health = tab.page_health() or {}
+    except Exception as e:
+        logging.warning(f"标签页 {tab.tab_id}: 页面无响应: {str(e)}")
+        return "unresponsive"
+    if health.get("nodes", 0) > REFRESH_MAX_DOM_NODES:
+        return "dom"
+    if (health.get("heap_mb") or 0) > REFRESH_MAX_HEAP_MB:
+        return "heap"
+    if time.time() - getattr(tab, "last_refresh", 0) > REFRESH_MAX_AGE:
+        return "age"
+    return None
+
+def retire_tab(tab, reason):
+    """把无法恢复的标签页移出池并在后台新建替代，不在持有标签页锁时重启浏览器"""
+    with tab_lock:
+        if tab in tabs:
+            tabs.remove(tab)
+    TAB_RESTARTS.inc(reason=reason)
+    executor = tab_executors.pop(tab.tab_id, None)
+    if executor:
+        executor.shutdown(wait=False)
+    try:
+        tab.driver.quit()
+    except Exception:
+        pass
+    logging.warning(f"标签页 {tab.tab_id}: 已移出标签页池，后台新建替代标签页")
+    request_spawn()
+
+def maintain_tabs():
+    """池级维护：只检查空闲且最近未处理请求的标签页，按页面健康状况每轮最多刷新一个"""
+    now = time.time()
+    with tab_lock:
+        snapshot = list(tabs)
+    
+    # 最久没用过的排在前面，轮流检查
+    for tab in sorted(snapshot, key=lambda t: t.last_used):
+        if now - tab.last_used < MAINTENANCE_IDLE_SECONDS:
+            continue
+        if not tab.lock.acquire(blocking=False):
+            continue
+        refreshed = False
+        try:
+            reason = refresh_reason(tab)
+            if not reason:
+                continue
+            TAB_REFRESHES.inc(reason=reason)
+            logging.info(f"标签页 {tab.tab_id}: 维护刷新，原因={reason}")
+            try:
+                tab.refresh_page()
+            except Exception as e:
+                logging.error(f"标签页 {tab.tab_id}: 页面刷新失败: {str(e)}")
+                # 移出池后不再释放锁，替代标签页就绪后由调度器接手
+                retire_tab(tab, "refresh_failed")
+                return
+            refreshed = True
+        finally:
+            if tab in tabs:
+                release_tab(tab, used=False)
+        if refreshed:
+            # 每轮只刷新一个，错开各标签页的刷新时间
+            return
+
+def busy_response(e):
+    """排队失败时返回带Retry-After与队列位置的503"""
+    response = jsonify({
+        "error": {
+            "message": str(e),
+            "type": "server_error",
+            "code": "server_error"
+        }
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    response.headers['X-Queue-Position'] = str(e.position)
+    return response
+
+def rate_limited_response(e):
+    """超出API Key速率限制时返回带Retry-After的429"""
+    response = jsonify({
+        "error": {
+            "message": str(e),
+            "type": "requests",
+            "code": "rate_limit_exceeded"
+        }
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
 def messages_to_text(messages):
     """将OpenAI messages格式转换为简单文本"""
@@ -814,37 +1341,293 @@ def extract_images_from_messages(messages):
                         images.append(url)
     return images
 
-@app.route('/v1/chat/completions', methods=['POST'])
-def openai_chat_completions():
-    """OpenAI API格式兼容端点"""
-    logging.info("收到OpenAI格式请求")
-    
-    tab = get_available_tab()
-    if not tab:
-        logging.warning("系统繁忙，所有标签页都忙")
-        return jsonify({
-            "error": {
-                "message": "系统繁忙，请稍后再试",
-                "type": "server_error",
-                "code": "server_error"
+def sse_event(data):
+    """格式化一条SSE事件"""
+    if isinstance(data, str):
+        return f"data: {data}\n\n"
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def completion_chunk(completion_id, created, model, delta, finish_reason=None):
+    return sse_event({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": delta,
+                "finish_reason": finish_reason
             }
-        }), 503
+        ]
+    })
+
+def stream_chat_completion(tab, internal_request_data, model, on_complete=None, on_abort=None):
+    """以OpenAI chat.completion.chunk格式流式输出回复，结束后释放标签页锁
     
-    if not tab.lock.acquire(blocking=False):
-        logging.warning(f"标签页 {tab.tab_id} 忙")
-        tab = get_available_tab()
-        if not tab or not tab.lock.acquire(blocking=False):
-            logging.warning("系统繁忙，无法获取可用标签页")
-            return jsonify({
+    on_complete(回复, 会话ID, 思考过程, 引用, sent_text=已输出文本)在回复完整结束后调用，回复为stream_answer提取的完整格式；出错、收尾失败、客户端断开或任务被取消时调用on_abort()，
+    两者之一必定执行，合并到本请求的等待者不会一直挂起"""
+    completion_id = f"chatcmpl-{tab.tab_id}-{int(time.time()*1000)}"
+    created = int(time.time())
+    
+    def chunk(delta, finish_reason=None):
+        return completion_chunk(completion_id, created, model, delta, finish_reason)
+    
+    async def generate():
+        parts = []
+        completed = False
+        # 浏览器端的逐段读取在标签页线程上进行，每取一段交回事件循环
+        deltas = tab.send_message_stream(internal_request_data)
+        try:
+            yield chunk({"role": "assistant", "content": ""})
+            while True:
+                delta = await run_on_tab(tab, next, deltas, None)
+                if delta is None:
+                    break
+                parts.append(delta)
+                yield chunk({"content": delta})
+            yield chunk({}, finish_reason="stop")
+            response_text = "".join(parts)
+            logging.info(f"标签页 {tab.tab_id}: OpenAI流式请求处理完成: 文本长度={len(response_text)}")
+            try:
+                if on_complete:
+                    answer = await run_on_tab(tab, tab.stream_answer, response_text)
+                    on_complete(answer["text"], await run_on_tab(tab, tab.get_current_session_id),
+                                answer.get("thinking"), answer.get("citations"), sent_text=response_text)
+                # on_complete结算后才算完成，否则由finally中的on_abort结算
+                completed = True
+            except Exception as e:
+                logging.warning(f"标签页 {tab.tab_id}: 流式请求收尾失败: {str(e)}")
+        except TimeoutError as e:
+            # 回答未完整生成：不发送finish_reason，也不写入缓存与续接索引（由on_abort结算）
+            logging.error(f"标签页 {tab.tab_id}: 流式处理超时: {str(e)}")
+            yield sse_event({
+                "error": {
+                    "message": str(e),
+                    "type": "timeout_error",
+                    "code": "timeout"
+                }
+            })
+        except Exception as e:
+            logging.exception(f"标签页 {tab.tab_id}: 流式处理出错: {str(e)}")
+            yield sse_event({
                 "error": {
-                    "message": "系统繁忙，请稍后再试",
+                    "message": f"服务器错误: {str(e)}",
                     "type": "server_error",
                     "code": "server_error"
                 }
-            }), 503
+            })
+        finally:
+            if not completed:
+                # 在标签页线程上关闭生成器，不与下一个请求的浏览器操作交错
+                tab_executor(tab).submit(deltas.close)
+                if on_abort:
+                    on_abort()
+            release_tab(tab)
+        yield sse_event("[DONE]")
     
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def cache_bypassed(body):
+    """请求头Cache-Control: no-cache或请求体"cache": false时不使用缓存"""
+    if 'no-cache' in request.headers.get('Cache-Control', '').lower():
+        return True
+    return isinstance(body, dict) and body.get('cache') is False
+
+def file_attachments(body):
+    """请求体中的file1、file2...附件内容"""
+    return [body[key] for key in sorted(body) if re.fullmatch(r'file\d+', key)]
+
+def lookup_cache(endpoint, body, model, text, attachments):
+    """查询回复缓存，返回(缓存键, 缓存内容)；请求要求跳过缓存时缓存键为None
+    
+    缓存键同时用于合并相同的进行中请求，所以关闭缓存时仍会计算"""
+    if cache_bypassed(body):
+        CACHE_LOOKUPS.inc(endpoint=endpoint, result="bypass")
+        return None, None
+    key = response_key(model, text, attachments)
+    if not response_cache.enabled:
+        CACHE_LOOKUPS.inc(endpoint=endpoint, result="bypass")
+        return key, None
+    cached = response_cache.get(key)
+    CACHE_LOOKUPS.inc(endpoint=endpoint, result="hit" if cached else "miss")
+    return key, cached
+
+def completion_response(session_id, model, prompt_text, response_text, thinking=None, citations=None):
+    """thinking按DeepSeek API放在message.reasoning_content，引用来源放在顶层citations"""
+    response = {
+        "id": f"chatcmpl-{session_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": response_text
+                },
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": len(prompt_text),
+            "completion_tokens": len(response_text),
+            "total_tokens": len(prompt_text) + len(response_text)
+        }
+    }
+    if thinking:
+        response["choices"][0]["message"]["reasoning_content"] = thinking
+    if citations:
+        response["citations"] = citations
+    return response
+
+def cached_response(cached, model, prompt_text, stream=False):
+    """用缓存内容直接构造响应，不占用标签页"""
+    if stream:
+        completion_id = f"chatcmpl-{cached['id']}"
+        created = int(time.time())
+        
+        def generate():
+            yield completion_chunk(completion_id, created, model, {"role": "assistant", "content": ""})
+            yield completion_chunk(completion_id, created, model, {"content": cached['text']})
+            yield completion_chunk(completion_id, created, model, {}, finish_reason="stop")
+            yield sse_event("[DONE]")
+        
+        response = Response(generate(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    else:
+        response = jsonify(completion_response(cached['id'], model, prompt_text, cached['text'],
+                                               cached.get('thinking'), cached.get('citations')))
+    response.headers['X-Cache'] = 'HIT'
+    return response
+
+async def begin_flight(endpoint, flight_key):
+    """合并相同的进行中请求并处理Idempotency-Key，返回(flight, 是否由本请求执行)
+    
+    由本请求执行时，成功结果由处理函数结算，错误响应在请求结束时分发给等待者；
+    Idempotency-Key已用于内容不同的请求时抛出ValueError"""
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        # 各API Key的Idempotency-Key互不相干，不同客户端用了相同的键也不会拿到对方的结果
+        client = g.get('client')
+        idempotency_key = f"{client.name if client else ''}:{endpoint}:{idempotency_key}"
+    fingerprint = hashlib.sha256(await request.get_data()).hexdigest()
+    flight, leader = inflight_requests.begin(flight_key, idempotency_key, fingerprint)
+    if flight and leader:
+        @after_this_request
+        async def settle(response):
+            return await settle_flight(flight, response)
+    elif flight:
+        COALESCED_REQUESTS.inc(endpoint=endpoint)
+    return flight, leader
+
+def stream_aborted():
+    return FlightFailed(500, {
+        "error": {
+            "message": "相同请求的流式输出中断",
+            "type": "server_error",
+            "code": "server_error"
+        }
+    })
+
+def abandon_flight(flight):
+    """本请求被取消（客户端断开）时调用：after_this_request不会执行，在这里以失败结算，
+    否则合并到它的请求和相同Idempotency-Key的重试会一直等待这次不会结束的执行"""
+    inflight_requests.finish(flight, error=FlightFailed(503, {
+        "error": {
+            "message": "相同请求的执行已取消，请重试",
+            "type": "server_error",
+            "code": "server_error"
+        }
+    }, {"Retry-After": "1"}))
+
+async def settle_flight(flight, response):
+    if response.mimetype == 'text/event-stream':
+        # 流式响应在输出结束时由on_complete/on_abort结算
+        return response
+    headers = {name: response.headers[name] for name in ('Retry-After', 'X-Queue-Position') if name in response.headers}
+    inflight_requests.finish(flight, error=FlightFailed(response.status_code, await response.get_json(silent=True), headers))
+    return response
+
+async def join_flight(flight, model, prompt_text, stream=False, timeout=None):
+    """等待相同请求的执行结果，不占用标签页"""
     try:
-        request_data = request.get_json()
+        result = await flight.wait_async(timeout or DEFAULT_REQUEST_TIMEOUT)
+    except FlightFailed as e:
+        response = jsonify(e.body or {
+            "error": {
+                "message": "服务器错误",
+                "type": "server_error",
+                "code": "server_error"
+            }
+        })
+        response.status_code = e.status
+        response.headers.extend(e.headers)
+        return response
+    except TimeoutError as e:
+        return jsonify({
+            "error": {
+                "message": str(e),
+                "type": "timeout_error",
+                "code": "timeout"
+            }
+        }), 504
+    response = cached_response(result, model, prompt_text, stream)
+    response.headers['X-Cache'] = 'COALESCED'
+    return response
+
+def idempotency_conflict(e):
+    return jsonify({
+        "error": {
+            "message": str(e),
+            "type": "invalid_request_error",
+            "code": "idempotency_key_reused"
+        }
+    }), 422
+
+@app.route('/v1/chat/completions', methods=['POST'])
+async def openai_chat_completions():
+    """OpenAI API格式兼容端点"""
+    logging.info("收到OpenAI格式请求")
+    
+    body = await request.get_json(silent=True)
+    cache_key = None
+    cache_model, cache_text, cache_stream = 'hunyuan', '', False
+    if isinstance(body, dict) and body.get('messages'):
+        cache_model = body.get('model') if body.get('model') in SUPPORTED_MODELS else 'hunyuan'
+        cache_text = messages_to_text(body['messages'])
+        cache_stream = body.get('stream', False)
+        cache_key, cached = lookup_cache("openai", body, cache_model,
+                                         cache_text, extract_images_from_messages(body['messages']) + file_attachments(body))
+        if cached:
+            logging.info("OpenAI请求命中回复缓存")
+            return cached_response(cached, cache_model, cache_text, stream=cache_stream)
+    
+    priority, timeout, wanted_model = get_admission_params(body)
+    try:
+        flight, leader = await begin_flight("openai", cache_key)
+    except ValueError as e:
+        return idempotency_conflict(e)
+    if not leader:
+        logging.info("OpenAI请求与进行中的相同请求合并")
+        return await join_flight(flight, cache_model, cache_text, stream=cache_stream, timeout=timeout)
+    
+    try:
+        tab = await acquire_tab(priority, timeout, wanted_model, g.get('client'))
+    except QueueRejected as e:
+        logging.warning(f"系统繁忙，无法获取可用标签页: {str(e)}")
+        return busy_response(e)
+    except BaseException:
+        abandon_flight(flight)
+        raise
+    
+    # 流式响应时由生成器负责释放锁
+    lock_handed_off = False
+    try:
+        request_data = body
         if request_data is None:
             return jsonify({
                 "error": {
@@ -873,7 +1656,28 @@ def openai_chat_completions():
         
         session_id = "new"
         
-        if not tab.handle_session(session_id):
+        if model and model not in SUPPORTED_MODELS:
+            logging.warning(f"标签页 {tab.tab_id}: 不支持的模型 {model}, 使用默认模型")
+            model = "hunyuan"
+        
+        # 历史消息与之前某次回复后的对话一致时，只把最后一条用户消息发到该会话
+        continued_id = None
+        if len(messages) > 1 and messages[-1].get('role') == 'user':
+            continued_id = conversation_index.pop(model, messages[:-1])
+        
+        with STAGE_SECONDS.time(stage="session", model=model):
+            session_ok = False
+            if continued_id:
+                logging.info(f"标签页 {tab.tab_id}: 续接会话 {continued_id}，只发送新消息")
+                session_ok = await run_on_tab(tab, tab.handle_session, continued_id)
+                if session_ok:
+                    text = messages_to_text(messages[-1:])
+                    images = extract_images_from_messages(messages[-1:])
+                else:
+                    logging.warning(f"标签页 {tab.tab_id}: 续接会话失败，发送完整历史")
+            if not session_ok:
+                session_ok = await run_on_tab(tab, tab.handle_session, session_id)
+        if not session_ok:
             return jsonify({
                 "error": {
                     "message": "会话操作失败",
@@ -882,18 +1686,18 @@ def openai_chat_completions():
                 }
             }), 500
         
-        if model and model not in ["hunyuan", "deepseek"]:
-            logging.warning(f"标签页 {tab.tab_id}: 不支持的模型 {model}, 使用默认模型")
-            model = "hunyuan"
-        
         if model:
             logging.info(f"标签页 {tab.tab_id}: 切换模型到 {model}")
-            if not tab.change_model(model):
+            with STAGE_SECONDS.time(stage="model", model=model):
+                model_ok = await run_on_tab(tab, tab.change_model, model)
+            if not model_ok:
                 logging.warning(f"标签页 {tab.tab_id}: 模型切换失败，使用默认模型")
         
         for image in images:
             logging.info(f"标签页 {tab.tab_id}: 上传图片")
-            if not tab.upload_image(image):
+            with STAGE_SECONDS.time(stage="upload", model=model):
+                upload_ok = await run_on_tab(tab, tab.upload_image, image)
+            if not upload_ok:
                 return jsonify({
                     "error": {
                         "message": "图片上传失败",
@@ -902,35 +1706,33 @@ def openai_chat_completions():
                     }
                 }), 500
         
-        internal_request_data = {"text": text}
-        response = tab.send_message(internal_request_data)
+        internal_request_data = {"text": text, "model": model}
+        
+        def remember_conversation(response_text, session_id, thinking=None, citations=None, sent_text=None):
+            # 续接索引按客户端实际收到的文本记录，缓存和合并到本请求的请求使用完整格式的回答
+            history_text = response_text if sent_text is None else sent_text
+            conversation_index.put(model, messages + [{"role": "assistant", "content": history_text}], session_id)
+            result = {"id": session_id, "text": response_text, "thinking": thinking, "citations": citations}
+            inflight_requests.finish(flight, result=result)
+            if cache_key and response_text:
+                response_cache.put(cache_key, result)
+        
+        if stream:
+            response = stream_chat_completion(tab, internal_request_data, model, on_complete=remember_conversation,
+                                              on_abort=lambda: inflight_requests.finish(flight, error=stream_aborted()))
+            lock_handed_off = True
+            return response
+        
+        response = await run_on_tab(tab, tab.send_message, internal_request_data)
         
         response_text = response.get('text', '')
         session_id = response.get('id', 'new')
+        remember_conversation(response_text, session_id, response.get('thinking'), response.get('citations'))
         
         logging.info(f"标签页 {tab.tab_id}: OpenAI请求处理完成: ID={session_id}, 文本长度={len(response_text)}")
         
-        openai_response = {
-            "id": f"chatcmpl-{session_id}",
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": model,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_text
-                    },
-                    "finish_reason": "stop"
-                }
-            ],
-            "usage": {
-                "prompt_tokens": len(text),
-                "completion_tokens": len(response_text),
-                "total_tokens": len(text) + len(response_text)
-            }
-        }
+        openai_response = completion_response(session_id, model, text, response_text,
+                                              response.get('thinking'), response.get('citations'))
         
         return jsonify(openai_response)
         
@@ -952,9 +1754,12 @@ def openai_chat_completions():
                 "code": "server_error"
             }
         }), 500
+    except BaseException:
+        abandon_flight(flight)
+        raise
     finally:
-        tab.lock.release()
-        logging.info(f"标签页 {tab.tab_id}: 释放锁")
+        if not lock_handed_off:
+            release_tab(tab)
 
 @app.route('/v1/models', methods=['GET'])
 def list_models():
@@ -978,38 +1783,44 @@ def list_models():
     })
 
 @app.route('/hunyuan', methods=['POST'])
-def handle_request():
+async def handle_request():
     logging.info("收到原有格式请求，转换为OpenAI格式")
     
-    tab = get_available_tab()
-    if not tab:
-        logging.warning("系统繁忙，所有标签页都忙")
-        return jsonify({
-            "error": {
-                "message": "系统繁忙，请稍后再试",
-                "type": "server_error",
-                "code": "server_error"
-            }
-        }), 503
+    # 只缓存新会话的请求，续接已有会话的回复依赖会话上下文
+    body = await request.get_json(silent=True)
+    cache_key = None
+    if isinstance(body, dict) and body.get('text') and body.get('sequence', 'new') == 'new':
+        cache_model = body.get('mode') if body.get('mode') in SUPPORTED_MODELS else 'hunyuan'
+        cache_key, cached = lookup_cache("hunyuan", body, cache_model, body['text'], file_attachments(body))
+        if cached:
+            logging.info("请求命中回复缓存")
+            return cached_response(cached, cache_model, body['text'])
     
-    if not tab.lock.acquire(blocking=False):
-        logging.warning(f"标签页 {tab.tab_id} 忙，尝试获取其他标签页")
-        tab = get_available_tab()
-        if not tab or not tab.lock.acquire(blocking=False):
-            logging.warning("系统繁忙，无法获取可用标签页")
-            return jsonify({
-                "error": {
-                    "message": "系统繁忙，请稍后再试",
-                    "type": "server_error",
-                    "code": "server_error"
-                }
-            }), 503
+    priority, timeout, wanted_model = get_admission_params(body)
+    try:
+        flight, leader = await begin_flight("hunyuan", cache_key)
+    except ValueError as e:
+        return idempotency_conflict(e)
+    if not leader:
+        logging.info("请求与进行中的相同请求合并")
+        if isinstance(body, dict):
+            return await join_flight(flight, wanted_model, body.get('text', ''), timeout=timeout)
+        return await join_flight(flight, wanted_model, await request.get_data(as_text=True), timeout=timeout)
+    
+    try:
+        tab = await acquire_tab(priority, timeout, wanted_model, g.get('client'))
+    except QueueRejected as e:
+        logging.warning(f"系统繁忙，无法获取可用标签页: {str(e)}")
+        return busy_response(e)
+    except BaseException:
+        abandon_flight(flight)
+        raise
     
     try:
         try:
-            request_data = request.get_json()
+            request_data = await request.get_json()
             if request_data is None:
-                data = request.data.decode('utf-8')
+                data = (await request.get_data()).decode('utf-8')
                 if not data:
                     return jsonify({
                         "error": {
@@ -1020,7 +1831,7 @@ def handle_request():
                     }), 400
                 request_data = json.loads(data)
         except Exception as e:
-            data = request.data.decode('utf-8')
+            data = (await request.get_data()).decode('utf-8')
             if not data:
                 return jsonify({
                     "error": {
@@ -1064,7 +1875,13 @@ def handle_request():
                 }
             }), 400
         
-        if not tab.handle_session(session_id):
+        if model and model not in SUPPORTED_MODELS:
+            logging.warning(f"标签页 {tab.tab_id}: 不支持的模型 {model}, 使用默认模型")
+            model = "hunyuan"
+        
+        with STAGE_SECONDS.time(stage="session", model=model):
+            session_ok = await run_on_tab(tab, tab.handle_session, session_id)
+        if not session_ok:
             return jsonify({
                 "error": {
                     "message": "会话操作失败",
@@ -1073,44 +1890,28 @@ def handle_request():
                 }
             }), 500
         
-        if model and model not in ["hunyuan", "deepseek"]:
-            logging.warning(f"标签页 {tab.tab_id}: 不支持的模型 {model}, 使用默认模型")
-            model = "hunyuan"
-        
         if model:
             logging.info(f"标签页 {tab.tab_id}: 切换模型到 {model}")
-            if not tab.change_model(model):
+            with STAGE_SECONDS.time(stage="model", model=model):
+                model_ok = await run_on_tab(tab, tab.change_model, model)
+            if not model_ok:
                 logging.warning(f"标签页 {tab.tab_id}: 模型切换失败，使用默认模型")
         
-        internal_request_data = {"text": text}
-        response = tab.send_message(internal_request_data)
+        internal_request_data = {"text": text, "model": model}
+        response = await run_on_tab(tab, tab.send_message, internal_request_data)
         
         response_text = response.get('text', '')
         session_id = response.get('id', 'new')
         
         logging.info(f"标签页 {tab.tab_id}: 请求处理完成: ID={session_id}, 文本长度={len(response_text)}")
+        result = {"id": session_id, "text": response_text, "thinking": response.get('thinking'),
+                  "citations": response.get('citations')}
+        inflight_requests.finish(flight, result=result)
+        if cache_key and response_text:
+            response_cache.put(cache_key, result)
         
-        openai_response = {
-            "id": f"chatcmpl-{session_id}",
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": model,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_text
-                    },
-                    "finish_reason": "stop"
-                }
-            ],
-            "usage": {
-                "prompt_tokens": len(text),
-                "completion_tokens": len(response_text),
-                "total_tokens": len(text) + len(response_text)
-            }
-        }
+        openai_response = completion_response(session_id, model, text, response_text,
+                                              result['thinking'], result['citations'])
         
         return jsonify(openai_response)
         
@@ -1132,33 +1933,192 @@ def handle_request():
                 "code": "server_error"
             }
         }), 500
+    except BaseException:
+        abandon_flight(flight)
+        raise
     finally:
-        tab.lock.release()
-        logging.info(f"标签页 {tab.tab_id}: 释放锁")
+        release_tab(tab)
+
+@app.before_request
+async def start_timer():
+    g.request_start = time.time()
+
+# 需要识别API Key的端点；对话端点同时检查速率限制
+CLIENT_ENDPOINTS = ('/v1/chat/completions', '/hunyuan')
+CLIENT_PATH_PREFIXES = ('/v1/files', '/v1/batches')
+
+def request_api_key():
+    """Authorization: Bearer <key>（OpenAI客户端），或X-API-Key"""
+    authorization = request.headers.get('Authorization', '')
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip() or None
+    return request.headers.get('X-API-Key') or None
+
+@app.before_request
+async def identify_client():
+    if request.path not in CLIENT_ENDPOINTS and not request.path.startswith(CLIENT_PATH_PREFIXES):
+        return None
+    client = client_registry.identify(request_api_key())
+    if client is None:
+        return jsonify({
+            "error": {
+                "message": "无效的API Key",
+                "type": "invalid_request_error",
+                "code": "invalid_api_key"
+            }
+        }), 401
+    g.client = client
+    if request.path in CLIENT_ENDPOINTS:
+        try:
+            client_registry.admit(client)
+        except RateLimited as e:
+            logging.warning(f"客户端 {client.name} 超出速率限制")
+            return rate_limited_response(e)
+    return None
+
+@app.after_request
+async def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unknown"
+    status = str(response.status_code)
+    RESPONSES_TOTAL.inc(endpoint=endpoint, status=status)
+    if hasattr(g, "request_start"):
+        REQUEST_SECONDS.observe(time.time() - g.request_start, endpoint=endpoint, status=status)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus格式监控指标"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+async def post_internal(url, body, owner=None):
+    headers = {"X-Priority": "bulk"}
+    api_key = client_registry.key_for(owner)
+    if api_key:
+        # 按创建任务的客户端计入其限额与公平份额
+        headers["Authorization"] = f"Bearer {api_key}"
+    response = await app.test_client().post(url, json=body, headers=headers)
+    return response.status_code, await response.get_json(silent=True), response.headers
+
+def dispatch_internal(url, body, owner=None):
+    """批量任务在进程内调用自身端点，与HTTP请求走相同的缓存、合并与排队逻辑；在服务的事件循环上执行"""
+    if serving_loop:
+        return asyncio.run_coroutine_threadsafe(post_internal(url, body, owner), serving_loop).result()
+    return asyncio.run(post_internal(url, body, owner))
+
+batch_store = BatchStore(BATCH_DIR, send=dispatch_internal, concurrency=MAX_TABS)  # 批量任务
+serving_loop = None  # 服务运行所在的事件循环，后台线程通过它提交请求
+
+def batch_error(message, status):
+    return jsonify({
+        "error": {
+            "message": message,
+            "type": "invalid_request_error",
+            "code": "invalid_request_error"
+        }
+    }), status
+
+def owned_by_caller(owner):
+    """文件和批量任务只对创建它的客户端可见，其他客户端一律按不存在处理；没有记录owner的按anonymous"""
+    return (owner or client_registry.anonymous.name) == g.client.name
+
+@app.route('/v1/files', methods=['POST'])
+async def upload_batch_file():
+    """上传批量任务的输入JSONL（OpenAI Files API）"""
+    uploaded = (await request.files).get('file')
+    if not uploaded:
+        return batch_error("缺少file字段", 400)
+    purpose = (await request.form).get('purpose', 'batch')
+    return jsonify(batch_store.save_file(uploaded.stream, uploaded.filename, purpose, owner=g.client.name))
+
+@app.route('/v1/files/<file_id>/content', methods=['GET'])
+async def batch_file_content(file_id):
+    """下载输入文件或批量任务的结果、错误文件"""
+    path = batch_store.file_path(file_id)
+    if not path or not owned_by_caller(batch_store.file_owner(file_id)):
+        return batch_error("文件不存在", 404)
+    return await send_file(os.path.abspath(path), mimetype='application/jsonl')
+
+@app.route('/v1/batches', methods=['POST'])
+async def create_batch():
+    """创建批量任务（OpenAI Batch API），以bulk优先级在后台用满所有标签页处理"""
+    body = await request.get_json(silent=True) or {}
+    endpoint = body.get('endpoint', '/v1/chat/completions')
+    if endpoint not in BATCH_ENDPOINTS:
+        return batch_error(f"不支持的端点: {endpoint}", 400)
+    input_file_id = body.get('input_file_id')
+    if not batch_store.file_path(input_file_id) or not owned_by_caller(batch_store.file_owner(input_file_id)):
+        return batch_error("输入文件不存在", 400)
+    batch = batch_store.create(body['input_file_id'], endpoint, body.get('completion_window', '24h'), body.get('metadata'),
+                               owner=g.client.name)
+    logging.info(f"创建批量任务 {batch['id']}")
+    return jsonify(batch)
+
+@app.route('/v1/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = batch_store.get(batch_id)
+    if not batch or not owned_by_caller(batch.get("owner")):
+        return batch_error("批量任务不存在", 404)
+    return jsonify(batch)
+
+@app.route('/v1/batches/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    batch = batch_store.get(batch_id)
+    if not batch or not owned_by_caller(batch.get("owner")):
+        return batch_error("批量任务不存在", 404)
+    return jsonify(batch_store.cancel(batch_id))
 
 @app.route('/health', methods=['GET'])
 def health_check():
+    """标签页池状态；?brief=1 时不逐个访问浏览器，供路由器频繁轮询"""
     try:
+        brief = request.args.get('brief') in ('1', 'true')
         status_list = []
         with tab_lock:
-            for tab in tabs:
+            for tab in ([] if brief else tabs):
                 try:
                     if tab.driver:
                         title = tab.driver.title
-                        status_list.append({"id": tab.tab_id, "status": "ok", "title": title})
+                        status_list.append({"id": tab.tab_id, "status": "ok", "title": title,
+                                            "startup_seconds": round(tab.startup_seconds, 2) if tab.startup_seconds else None})
                     else:
                         status_list.append({"id": tab.tab_id, "status": "degraded", "message": "浏览器未初始化"})
                 except:
                     status_list.append({"id": tab.tab_id, "status": "error", "message": "浏览器状态未知"})
         
+        states = tab_pool_states()
+        queued = tab_scheduler.queued_by_client()
         return jsonify({
             "total_tabs": len(tabs),
+            "idle_tabs": states[("idle",)],
+            "busy_tabs": states[("busy",)],
+            "starting_tabs": pending_spawns,
+            "queue_length": tab_scheduler.queue_length(),
+            "avg_service_seconds": tab_scheduler.estimate_service(),
+            "response_cache": response_cache.stats(),
+            "inflight_requests": inflight_requests.stats(),
+            "upload_staging": upload_staging.stats(),
+            "clients": {c.name: dict(c.summary(), queued=queued.get(c.name, 0)) for c in client_registry.clients()},
             "max_tabs": MAX_TABS,
             "tabs": status_list
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.before_serving
+async def start_pool():
+    """开始服务前初始化标签页池和后台任务；用hypercorn直接加载aiapi:app时同样执行"""
+    global serving_loop
+    serving_loop = asyncio.get_running_loop()
+    
+    # 初始化标签页
+    await serving_loop.run_in_executor(None, initialize_tabs)
+    
+    pool_scheduler.add_job(preswitch_idle_tabs, 'interval', seconds=MODEL_PRESWITCH_INTERVAL)
+    pool_scheduler.add_job(maintain_tabs, 'interval', seconds=MAINTENANCE_INTERVAL)
+    pool_scheduler.start()
+    batch_store.resume()
+    logging.info(f"启动服务，最大标签页数量: {MAX_TABS}")
+
 def shutdown_handler(signum, frame):
     logging.info("接收到终止信号，关闭服务...")
     exit(0)
@@ -1168,9 +2128,11 @@ if __name__ == '__main__':
     signal.signal(signal.SIGINT, shutdown_handler)
     signal.signal(signal.SIGTERM, shutdown_handler)
     
-    # 初始化标签页
-    initialize_tabs()
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
     
-    logging.info(f"启动服务，最大标签页数量: {MAX_TABS}")
-    app.run(host='0.0.0.0', port=PORT_RUNNING, threaded=True)
+    # 异步服务器：排队和流式输出中的连接只占用协程，浏览器操作在各标签页自己的线程上执行
+    config = Config()
+    config.bind = [f"0.0.0.0:{PORT_RUNNING}"]
+    asyncio.run(serve(app, config))
 
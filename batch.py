@@ -0,0 +1,358 @@
+# batch.py
+"""批量处理JSONL请求文件（OpenAI Batch格式），结果逐行写入输出JSONL，中断后重新运行会跳过已完成的请求
+
+输入每行: {"custom_id": "req-1", "method": "POST", "url": "/v1/chat/completions", "body": {...}}
+用法: python batch.py 输入.jsonl 输出.jsonl [--server http://127.0.0.1:8000] [--concurrency 5]
+失败的请求写入 输出.jsonl 同名的 .errors.jsonl，下次运行时会重新尝试
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 批量任务可调用的端点
+BATCH_ENDPOINTS = ("/v1/chat/completions", "/hunyuan")
+
+def read_requests(path):
+    """读取输入JSONL；缺少custom_id时用行号编号，格式错误的行作为失败结果返回"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("每行应为JSON对象")
+            except ValueError as e:
+                items.append({"custom_id": f"line-{line_no}", "invalid": f"第{line_no}行格式错误: {str(e)}"})
+                continue
+            item.setdefault("custom_id", f"line-{line_no}")
+            items.append(item)
+    return items
+
+def completed_ids(path):
+    """输出文件中已有结果的custom_id（即检查点）"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["custom_id"])
+            except (ValueError, KeyError, TypeError):
+                # 崩溃时可能留下写了一半的最后一行
+                continue
+    return done
+
+def error_path_for(output_path):
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.errors{ext or '.jsonl'}"
+
+class BatchRunner:
+    """用固定数量的并发请求处理整个文件，使所有标签页保持忙碌"""
+    def __init__(self, send, concurrency=5, max_retries=3, busy_timeout=600):
+        # send(url, body): 返回(状态码, 响应体, 响应头)；503、429时按Retry-After等待后重试，不计入重试次数，
+        # 但单个请求累计等待超过busy_timeout秒后按失败处理，避免服务持续繁忙时任务永远无法结束
+        self.send = send
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.busy_timeout = busy_timeout
+        self.write_lock = threading.Lock()
+
+    def run(self, input_path, output_path, error_path=None, stop_event=None, on_progress=None):
+        """返回 {"total", "completed", "failed"}；completed包含之前运行已完成的请求"""
+        error_path = error_path or error_path_for(output_path)
+        items = read_requests(input_path)
+        done = completed_ids(output_path)
+        pending = [item for item in items if item["custom_id"] not in done]
+        counts = {"total": len(items), "completed": len(items) - len(pending), "failed": 0}
+        if done:
+            logging.info(f"批量任务从检查点继续: 已完成 {len(done)} 个，剩余 {len(pending)} 个")
+        # 上次失败的请求会重新执行，错误文件只保留本次的结果
+        open(error_path, "w", encoding="utf-8").close()
+
+        def process(item):
+            if stop_event and stop_event.is_set():
+                return
+            result = self.execute(item, stop_event)
+            if result is None:
+                # 重试等待中被取消，不写结果，之后继续运行时重新执行
+                return
+            line, ok = result
+            with self.write_lock:
+                self.append(output_path if ok else error_path, line)
+                counts["completed" if ok else "failed"] += 1
+                if on_progress:
+                    on_progress(dict(counts))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(process, pending))
+        return counts
+
+    def execute(self, item, stop_event=None):
+        """执行一个请求，返回(输出行, 是否成功)；重试等待期间stop_event被设置时返回None"""
+        custom_id = item["custom_id"]
+        if "invalid" in item:
+            return self.result_line(custom_id, None, None, "invalid_request", item["invalid"]), False
+        url = item.get("url", "/v1/chat/completions")
+        body = item.get("body")
+        if url not in BATCH_ENDPOINTS or not isinstance(body, dict):
+            return self.result_line(custom_id, None, None, "invalid_request", f"不支持的请求: {url}"), False
+        # 批量结果按整段写入，不使用流式
+        body = dict(body, stream=False)
+
+        attempt = 0
+        deadline = time.time() + self.busy_timeout
+        while True:
+            try:
+                status, response_body, headers = self.send(url, body)
+            except Exception as e:
+                status, response_body, headers = None, None, {}
+                error = str(e)
+            else:
+                error = None
+            if status == 200:
+                return self.result_line(custom_id, status, response_body), True
+            if status in (429, 503):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    error = error or f"服务持续繁忙（HTTP {status}），{self.busy_timeout}秒内未能执行"
+                    break
+                if self.wait(min(float(headers.get("Retry-After", 1)), remaining), stop_event):
+                    return None
+                continue
+            if status is not None and 400 <= status < 500:
+                break
+            attempt += 1
+            if attempt > self.max_retries:
+                break
+            if self.wait(min(2 ** attempt, 30), stop_event):
+                return None
+        message = error or (response_body or {}).get("error", {}).get("message", f"HTTP {status}")
+        logging.warning(f"批量请求 {custom_id} 失败: {message}")
+        return self.result_line(custom_id, status, response_body, "request_failed", message), False
+
+    @staticmethod
+    def wait(seconds, stop_event):
+        """等待重试间隔，任务被取消时立即返回True"""
+        if stop_event:
+            return stop_event.wait(seconds)
+        time.sleep(seconds)
+        return False
+
+    @staticmethod
+    def result_line(custom_id, status, body, code=None, message=None):
+        return {
+            "id": f"batch_req_{uuid.uuid4().hex}",
+            "custom_id": custom_id,
+            "response": {"status_code": status, "body": body} if status is not None else None,
+            "error": {"code": code, "message": message} if code else None
+        }
+
+    @staticmethod
+    def append(path, line):
+        # 每行写完立即落盘，崩溃后输出文件就是检查点
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+class BatchStore:
+    """/v1/files 与 /v1/batches 的文件和任务状态，保存在目录中，服务重启后继续未完成的任务"""
+    def __init__(self, root, send, concurrency=5):
+        # send(url, body, owner): 同BatchRunner的send，owner为创建任务的客户端名称
+        self.root = root
+        self.send = send
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.stops = {}
+        os.makedirs(root, exist_ok=True)
+
+    def file_path(self, file_id):
+        if not re.fullmatch(r'file-[\w-]+', file_id or ""):
+            return None
+        path = os.path.join(self.root, f"{file_id}.jsonl")
+        return path if os.path.exists(path) else None
+
+    def file_owner(self, file_id):
+        """文件所属的客户端名称：结果和错误文件属于对应的批量任务，上传的文件按保存时记录的owner"""
+        match = re.fullmatch(r'file-(batch_\w+)-(?:output|errors)', file_id or "")
+        if match:
+            batch = self.get(match.group(1))
+            return batch.get("owner") if batch else None
+        try:
+            with open(os.path.join(self.root, f"{file_id}.json"), encoding="utf-8") as f:
+                return json.load(f).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def save_file(self, stream, filename, purpose="batch", owner=None):
+        file_id = f"file-{uuid.uuid4().hex}"
+        path = os.path.join(self.root, f"{file_id}.jsonl")
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        info = {
+            "id": file_id,
+            "object": "file",
+            "bytes": os.path.getsize(path),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "owner": owner
+        }
+        self._write_json(os.path.join(self.root, f"{file_id}.json"), info)
+        return info
+
+    def create(self, input_file_id, endpoint, completion_window="24h", metadata=None, owner=None):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "errors": None,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "in_progress",
+            "output_file_id": f"file-{batch_id}-output",
+            "error_file_id": f"file-{batch_id}-errors",
+            "created_at": int(time.time()),
+            "in_progress_at": int(time.time()),
+            "completed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": metadata,
+            "owner": owner
+        }
+        self._save(batch)
+        self._start(batch)
+        return batch
+
+    def get(self, batch_id):
+        if not re.fullmatch(r'batch_\w+', batch_id or ""):
+            return None
+        path = os.path.join(self.root, f"{batch_id}.json")
+        if not os.path.exists(path):
+            return None
+        with self.lock:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+
+    def cancel(self, batch_id):
+        batch = self.get(batch_id)
+        if batch and batch["status"] == "in_progress":
+            with self.lock:
+                stop = self.stops.get(batch_id)
+            if stop:
+                stop.set()
+            batch["status"] = "cancelling"
+            self._save(batch)
+        return batch
+
+    def resume(self):
+        """服务启动时继续上次未完成的任务"""
+        for name in os.listdir(self.root):
+            if not name.startswith("batch_") or not name.endswith(".json"):
+                continue
+            batch = self.get(name[:-len(".json")])
+            if batch and batch["status"] in ("in_progress", "cancelling"):
+                logging.info(f"继续未完成的批量任务 {batch['id']}")
+                self._start(batch)
+
+    def _start(self, batch):
+        stop = threading.Event()
+        if batch["status"] == "cancelling":
+            stop.set()
+        with self.lock:
+            self.stops[batch["id"]] = stop
+        threading.Thread(target=self._run, args=(batch, stop), daemon=True).start()
+
+    def _run(self, batch, stop):
+        batch_id = batch["id"]
+
+        def update(counts):
+            current = self.get(batch_id)
+            current["request_counts"] = counts
+            self._save(current)
+
+        try:
+            input_path = self.file_path(batch["input_file_id"])
+            if not input_path:
+                raise FileNotFoundError(f"输入文件不存在: {batch['input_file_id']}")
+            owner = batch.get("owner")
+            runner = BatchRunner(lambda url, body: self.send(url, body, owner), self.concurrency)
+            counts = runner.run(
+                input_path,
+                os.path.join(self.root, f"{batch['output_file_id']}.jsonl"),
+                os.path.join(self.root, f"{batch['error_file_id']}.jsonl"),
+                stop_event=stop, on_progress=update)
+            batch = self.get(batch_id)
+            batch["request_counts"] = counts
+            if stop.is_set():
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+            else:
+                batch["status"] = "completed"
+                batch["completed_at"] = int(time.time())
+            logging.info(f"批量任务 {batch_id} 结束: {counts}")
+        except Exception as e:
+            logging.exception(f"批量任务 {batch_id} 失败: {str(e)}")
+            batch = self.get(batch_id)
+            batch["status"] = "failed"
+            batch["errors"] = {"object": "list", "data": [{"code": "batch_failed", "message": str(e)}]}
+        finally:
+            with self.lock:
+                self.stops.pop(batch_id, None)
+        self._save(batch)
+
+    def _save(self, batch):
+        with self.lock:
+            self._write_json(os.path.join(self.root, f"{batch['id']}.json"), batch)
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+def http_sender(server, timeout=600, api_key=None):
+    import requests
+
+    headers = {"X-Priority": "bulk"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    def send(url, body):
+        response = requests.post(server.rstrip("/") + url, json=body, headers=headers, timeout=timeout)
+        try:
+            response_body = response.json()
+        except ValueError:
+            response_body = {"error": {"message": response.text[:200]}}
+        return response.status_code, response_body, response.headers
+    return send
+
+if __name__ == '__main__':
+    from setbrowser import MAX_TABS, PORT_RUNNING
+
+    parser = argparse.ArgumentParser(description="批量处理JSONL请求文件")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--server", default=f"http://127.0.0.1:{PORT_RUNNING}")
+    parser.add_argument("--concurrency", type=int, default=MAX_TABS, help="并发请求数，默认等于最大标签页数量")
+    parser.add_argument("--api-key", help="按该API Key的限额与公平份额处理")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    start = time.time()
+    runner = BatchRunner(http_sender(args.server, api_key=args.api_key), args.concurrency)
+    counts = runner.run(args.input, args.output,
+                        on_progress=lambda c: print(f"\r完成 {c['completed']}/{c['total']}，失败 {c['failed']}", end="", flush=True))
+    print(f"\n结束: 完成 {counts['completed']}/{counts['total']}，失败 {counts['failed']}，用时 {time.time() - start:.1f}秒")
@@ -0,0 +1,198 @@
+# cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+def response_key(model, text, attachments=()):
+    """模型 + 规范化后的提示文本 + 附件内容哈希"""
+    normalized_text = " ".join((text or "").split())
+    attachment_hashes = []
+    for data in attachments:
+        if isinstance(data, str) and data.startswith('data:') and ',' in data:
+            # data URL只对内容部分取哈希
+            data = data.split(',', 1)[1]
+        attachment_hashes.append(hashlib.sha256(str(data).encode('utf-8')).hexdigest())
+    payload = json.dumps([model, normalized_text, attachment_hashes], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """回复缓存：内存LRU + TTL，可选SQLite磁盘存储以在重启后保留"""
+    def __init__(self, max_size=1000, ttl=3600, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+            self.db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+            self.db.commit()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[1] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None and self.db:
+                entry = self._load(key, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        entry = (value, time.time())
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self._evict()
+            if self.db:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                                    (key, json.dumps(value, ensure_ascii=False), entry[1]))
+                    self.puts += 1
+                    if self.puts % 100 == 0:
+                        # 定期清理磁盘上过期的条目
+                        self.db.execute("DELETE FROM responses WHERE stored_at < ?", (entry[1] - self.ttl,))
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"回复缓存写入磁盘失败: {str(e)}")
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+    def _load(self, key, now):
+        try:
+            row = self.db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"回复缓存读取磁盘失败: {str(e)}")
+            return None
+        if not row or now - row[1] > self.ttl:
+            return None
+        return (json.loads(row[0]), row[1])
+
+    def _evict(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+class FlightFailed(Exception):
+    """被合并的那次执行失败，等待者收到相同的错误响应"""
+    def __init__(self, status, body, headers=None):
+        super().__init__(f"合并执行失败: {status}")
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+class Flight:
+    def __init__(self, key, idempotency_key=None, fingerprint=None):
+        self.key = key
+        self.idempotency_key = idempotency_key
+        self.fingerprint = fingerprint
+        self.future = Future()
+        self.finished_at = None
+
+    def wait(self, timeout=None):
+        """等待执行结果 {"id", "text"}；失败时抛出FlightFailed，超时抛出TimeoutError"""
+        try:
+            return self.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError("等待相同请求的执行结果超时")
+
+    async def wait_async(self, timeout=None):
+        """同wait，但在事件循环中等待"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("等待相同请求的执行结果超时")
+
+class SingleFlight:
+    """相同的进行中请求只执行一次，结果分发给所有等待者；Idempotency-Key还可在执行完成后一段时间内重放结果"""
+    def __init__(self, idempotency_ttl=600, max_size=1000):
+        self.idempotency_ttl = idempotency_ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.by_idempotency_key = OrderedDict()
+
+    def begin(self, key, idempotency_key=None, fingerprint=None):
+        """返回(flight, 是否由调用方执行)；调用方执行时必须在结束后调用finish。无可合并依据时flight为None"""
+        if not key and not idempotency_key:
+            return None, True
+        with self.lock:
+            self._expire()
+            if idempotency_key:
+                flight = self.by_idempotency_key.get(idempotency_key)
+                if flight:
+                    if fingerprint and flight.fingerprint and fingerprint != flight.fingerprint:
+                        raise ValueError("Idempotency-Key已用于内容不同的请求")
+                    return flight, False
+            if key and key in self.inflight:
+                flight = self.inflight[key]
+                if idempotency_key:
+                    self.by_idempotency_key[idempotency_key] = flight
+                return flight, False
+            flight = Flight(key, idempotency_key, fingerprint)
+            if key:
+                self.inflight[key] = flight
+            if idempotency_key:
+                self.by_idempotency_key[idempotency_key] = flight
+            return flight, True
+
+    def finish(self, flight, result=None, error=None):
+        """结算一次执行；重复调用时忽略。失败的执行不保留幂等记录，之后的重试会重新执行"""
+        if flight is None:
+            return
+        with self.lock:
+            if flight.future.done():
+                return
+            if self.inflight.get(flight.key) is flight:
+                del self.inflight[flight.key]
+            flight.finished_at = time.time()
+            for idempotency_key in [k for k, f in self.by_idempotency_key.items() if f is flight]:
+                if error is None:
+                    self.by_idempotency_key.move_to_end(idempotency_key)
+                else:
+                    del self.by_idempotency_key[idempotency_key]
+            if error is None:
+                flight.future.set_result(result)
+            else:
+                flight.future.set_exception(error)
+
+    def stats(self):
+        with self.lock:
+            return {"inflight": len(self.inflight), "idempotency_keys": len(self.by_idempotency_key)}
+
+    def _expire(self):
+        now = time.time()
+        for idempotency_key, flight in list(self.by_idempotency_key.items()):
+            if flight.finished_at and now - flight.finished_at > self.idempotency_ttl:
+                del self.by_idempotency_key[idempotency_key]
+        # 超出数量上限时丢弃最早完成的记录，进行中的不丢弃
+        excess = len(self.by_idempotency_key) - self.max_size
+        for idempotency_key, flight in list(self.by_idempotency_key.items()):
+            if excess <= 0:
+                break
+            if flight.finished_at:
+                del self.by_idempotency_key[idempotency_key]
+                excess -= 1
@@ -0,0 +1,423 @@
+# cdp.py
+"""直接通过Chrome DevTools协议（CDP）操作页面的自动化后端（setbrowser.py中 AUTOMATION_BACKEND = "cdp"）
+
+浏览器仍由Selenium启动（autoh负责cookies和首次登录），之后每个标签页的查找、读取文本、点击、输入和执行脚本
+都通过WebSocket直接发给浏览器，不再经过WebDriver的HTTP接口和驱动进程转发。每个浏览器一条连接，由一个后台线程
+收取所有返回；共享浏览器时各标签页以flat session复用这条连接，命令可以并发执行，不需要像WindowDriver那样切换窗口并串行。
+
+CDPDriver/CDPElement实现了YuanbaoAutomation、TextChecker和extraction用到的WebDriver接口：
+驱动的find_element(s)、execute_script、execute_cdp_cmd、get、refresh、title、current_url、quit，
+元素的text、click、get_attribute、send_keys、clear、is_displayed、is_enabled，
+因此WebDriverWait和expected_conditions可以照常使用
+
+这里没有另外抽出一套按会话、模型、上传、发送、等待划分的页面操作接口，而是在WebDriver接口这一层替换传输：
+YuanbaoAutomation的轮询、计数和回答提取本来就各是一次execute_script，两种后端共用同一套页面逻辑。
+selenium后端每条命令先经一次HTTP到驱动进程，驱动再向浏览器发出CDP命令；这里每条命令只有一次WebSocket往返
+（find_elements有匹配时为两次：查找并取回元素引用）。各标签页的命令仍在自己的线程上执行，连接上的收发由一个后台线程完成
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.request import urlopen
+import websocket
+from selenium.common.exceptions import (WebDriverException, NoSuchElementException, StaleElementReferenceException,
+                                        JavascriptException, TimeoutException)
+import setbrowser
+
+COMMAND_TIMEOUT = 30  # 单条CDP命令的超时（秒）
+PAGE_LOAD_TIMEOUT = 60  # get/refresh等待页面加载完成的超时（秒）
+OBJECT_GROUP_SIZE = 200  # 每查找这么多次换一个对象组，并释放再早一组的元素引用，避免长期运行时页面节点无法回收
+
+# 参数: 定位方式（与selenium的By取值相同）, 定位值；返回元素数组
+FIND_FUNCTION = """function(by, value) {
+    if (by === 'xpath') {
+        const result = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        return Array.from({length: result.snapshotLength}, (_, i) => result.snapshotItem(i));
+    }
+    if (by === 'tag name') {
+        return Array.from(document.getElementsByTagName(value));
+    }
+    if (by === 'class name') {
+        return Array.from(document.getElementsByClassName(value));
+    }
+    if (by === 'id') {
+        return Array.from(document.querySelectorAll('#' + CSS.escape(value)));
+    }
+    if (by === 'name') {
+        return Array.from(document.getElementsByName(value));
+    }
+    return Array.from(document.querySelectorAll(value));
+}"""
+
+# 把元素滚动到可见区域中央，返回其中心点坐标；元素已不在页面中时返回null，没有尺寸时坐标为null
+CLICK_POINT_FUNCTION = """function() {
+    if (!this.isConnected) {
+        return null;
+    }
+    this.scrollIntoView({block: 'center', inline: 'center'});
+    const rect = this.getBoundingClientRect();
+    if (!rect.width || !rect.height) {
+        return {x: null, y: null};
+    }
+    return {x: rect.left + rect.width / 2, y: rect.top + rect.height / 2};
+}"""
+
+DISPLAYED_FUNCTION = """function() {
+    if (!this.isConnected) {
+        return null;
+    }
+    const style = getComputedStyle(this);
+    return style.visibility !== 'hidden' && style.display !== 'none' && this.getClientRects().length > 0;
+}"""
+
+CLEAR_FUNCTION = """function() {
+    if (this.tagName === 'INPUT' || this.tagName === 'TEXTAREA') {
+        this.value = '';
+        this.dispatchEvent(new Event('input', {bubbles: true}));
+        this.dispatchEvent(new Event('change', {bubbles: true}));
+    } else if (this.isContentEditable) {
+        this.focus();
+        document.execCommand('selectAll', false);
+        document.execCommand('delete', false);
+    }
+}"""
+
+class CDPError(WebDriverException):
+    """CDP命令返回错误或连接已断开"""
+
+class CDPConnection:
+    """到浏览器DevTools WebSocket的一条连接：后台线程读取消息，按id把结果交给等待的调用方"""
+    def __init__(self, ws_url):
+        # 不发送Origin头，新版浏览器才不要求--remote-allow-origins
+        self.ws = websocket.create_connection(ws_url, suppress_origin=True, enable_multithread=True)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.pending = {}
+        self.closed = False
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, method, params=None, session_id=None, timeout=COMMAND_TIMEOUT):
+        """发送一条命令并等待结果，可在任意线程中调用"""
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise CDPError("CDP连接已断开")
+            self.next_id += 1
+            message_id = self.next_id
+            self.pending[message_id] = future
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        try:
+            self.ws.send(json.dumps(message))
+            return future.result(timeout)
+        except FutureTimeout:
+            raise CDPError(f"CDP命令超时（{timeout}秒）: {method}")
+        except websocket.WebSocketException as e:
+            raise CDPError(f"CDP连接已断开: {str(e)}")
+        finally:
+            with self.lock:
+                self.pending.pop(message_id, None)
+
+    def _read(self):
+        try:
+            while True:
+                message = json.loads(self.ws.recv())
+                if "id" not in message:
+                    continue  # 事件，目前不需要
+                with self.lock:
+                    future = self.pending.get(message["id"])
+                if not future:
+                    continue
+                if "error" in message:
+                    future.set_exception(CDPError(message["error"].get("message", str(message["error"]))))
+                else:
+                    future.set_result(message.get("result", {}))
+        except Exception:
+            pass
+        with self.lock:
+            self.closed = True
+            pending = list(self.pending.values())
+        for future in pending:
+            if not future.done():
+                future.set_exception(CDPError("CDP连接已断开"))
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+def check_result(result):
+    """Runtime.evaluate/callFunctionOn中的脚本异常转为JavascriptException"""
+    details = result.get("exceptionDetails")
+    if details:
+        exception = details.get("exception") or {}
+        raise JavascriptException(exception.get("description") or details.get("text", "脚本执行出错"))
+    return result["result"]
+
+class CDPElement:
+    """页面中的一个元素，对应CDP的远程对象"""
+    def __init__(self, driver, object_id):
+        self.driver = driver
+        self.object_id = object_id
+
+    def _call(self, function, *args):
+        try:
+            result = self.driver.send("Runtime.callFunctionOn", {
+                "functionDeclaration": function,
+                "objectId": self.object_id,
+                "arguments": [{"value": arg} for arg in args],
+                "returnByValue": True
+            })
+        except CDPError as e:
+            # 页面刷新或跳转后远程对象失效
+            raise StaleElementReferenceException(str(e))
+        return check_result(result).get("value")
+
+    @property
+    def text(self):
+        text = self._call("function() { return this.isConnected ? this.innerText : null; }")
+        if text is None:
+            raise StaleElementReferenceException("元素已不在页面中")
+        return text
+
+    def get_attribute(self, name):
+        return self._call("function(name) { return this.getAttribute(name); }", name)
+
+    def is_displayed(self):
+        displayed = self._call(DISPLAYED_FUNCTION)
+        if displayed is None:
+            raise StaleElementReferenceException("元素已不在页面中")
+        return displayed
+
+    def is_enabled(self):
+        return not self._call("function() { return !!this.disabled; }")
+
+    def click(self):
+        """在元素中心点发送真实的鼠标事件；元素没有尺寸时退回element.click()"""
+        point = self._call(CLICK_POINT_FUNCTION)
+        if point is None:
+            raise StaleElementReferenceException("元素已不在页面中")
+        if point["x"] is None:
+            self._call("function() { this.click(); }")
+            return
+        for event in ("mouseMoved", "mousePressed", "mouseReleased"):
+            self.driver.send("Input.dispatchMouseEvent", {
+                "type": event, "x": point["x"], "y": point["y"],
+                "button": "none" if event == "mouseMoved" else "left", "clickCount": 1
+            })
+
+    def send_keys(self, *values):
+        """文件输入框设置文件（多个路径以换行分隔，与selenium相同），其他元素聚焦后插入文本"""
+        text = "".join(str(value) for value in values)
+        if self._call("function() { return this.tagName === 'INPUT' && this.type === 'file'; }"):
+            self.driver.send("DOM.setFileInputFiles", {"files": text.split("\n"), "objectId": self.object_id})
+            return
+        self._call("function() { this.focus(); }")
+        self.driver.send("Input.insertText", {"text": text})
+
+    def clear(self):
+        self._call(CLEAR_FUNCTION)
+
+class CDPDriver:
+    """一个标签页（CDP target）的驱动，接口与WebDriver一致"""
+    def __init__(self, browser, target_id, session_id):
+        self.browser = browser
+        self.target_id = target_id
+        self.session_id = session_id
+        self.finds = 0
+
+    def send(self, method, params=None, timeout=COMMAND_TIMEOUT):
+        return self.browser.connection.send(method, params, self.session_id, timeout)
+
+    def prepare(self):
+        """新接入的页面：始终视为获得焦点（后台标签页也正常运行），server模式下屏蔽与apply_profile相同的资源"""
+        self.send("Emulation.setFocusEmulationEnabled", {"enabled": True})
+        if setbrowser.BROWSER_PROFILE == "server":
+            self.send("Network.enable")
+            self.send("Network.setBlockedURLs", {"urls": setbrowser.SERVER_BLOCKED_URLS})
+
+    def _object_group(self):
+        self.finds += 1
+        generation = self.finds // OBJECT_GROUP_SIZE
+        if self.finds % OBJECT_GROUP_SIZE == 0 and generation >= 2:
+            try:
+                self.send("Runtime.releaseObjectGroup", {"objectGroup": f"find-{generation - 2}"})
+            except CDPError:
+                pass
+        return f"find-{generation}"
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self.send(cmd, cmd_args)
+
+    def find_elements(self, by="css selector", value=None):
+        result = check_result(self.send("Runtime.evaluate", {
+            "expression": f"({FIND_FUNCTION})({json.dumps(by)}, {json.dumps(value)})",
+            "objectGroup": self._object_group()
+        }))
+        if result.get("description") == "Array(0)":
+            return []
+        properties = self.send("Runtime.getProperties", {"objectId": result["objectId"], "ownProperties": True})["result"]
+        return [CDPElement(self, p["value"]["objectId"]) for p in properties
+                if p["name"].isdigit() and "objectId" in p.get("value", {})]
+
+    def find_element(self, by="css selector", value=None):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"未找到元素: {by}={value}")
+        return elements[0]
+
+    def execute_script(self, script, *args):
+        """与WebDriver相同：script为函数体，通过arguments取参数，返回可JSON序列化的值"""
+        function = "function() {\n" + script + "\n}"
+        elements = [arg for arg in args if isinstance(arg, CDPElement)]
+        if elements:
+            result = self.send("Runtime.callFunctionOn", {
+                "functionDeclaration": function,
+                "objectId": elements[0].object_id,
+                "arguments": [{"objectId": arg.object_id} if isinstance(arg, CDPElement) else {"value": arg} for arg in args],
+                "returnByValue": True
+            })
+        else:
+            result = self.send("Runtime.evaluate", {
+                "expression": f"({function}).apply(null, {json.dumps(list(args))})",
+                "returnByValue": True
+            })
+        return check_result(result).get("value")
+
+    def _evaluate(self, expression):
+        return check_result(self.send("Runtime.evaluate", {"expression": expression, "returnByValue": True})).get("value")
+
+    def _navigate(self, method, params):
+        """在旧文档上做标记，发出导航后等待标记消失且新文档加载完成"""
+        self._evaluate("window.__cdpPreviousDocument = true")
+        self.send(method, params)
+        end_time = time.time() + PAGE_LOAD_TIMEOUT
+        while time.time() < end_time:
+            try:
+                if self._evaluate("!window.__cdpPreviousDocument && document.readyState === 'complete'"):
+                    return
+            except (CDPError, JavascriptException):
+                pass  # 导航过程中执行上下文可能暂时不存在
+            time.sleep(0.05)
+        raise TimeoutException(f"页面加载超时（{PAGE_LOAD_TIMEOUT}秒）")
+
+    def get(self, url):
+        self._navigate("Page.navigate", {"url": url})
+
+    def refresh(self):
+        self._navigate("Page.reload", {})
+
+    @property
+    def title(self):
+        return self._evaluate("document.title")
+
+    @property
+    def current_url(self):
+        return self._evaluate("location.href")
+
+    def quit(self):
+        """关闭本标签页，浏览器中最后一个标签页关闭时结束整个浏览器"""
+        self.browser.close_page(self)
+
+class CDPBrowser:
+    """由Selenium启动的一个浏览器及到它的CDP连接，新页面通过Target.createTarget打开并以flat session接入"""
+    def __init__(self, url, prepare=None):
+        self.driver = setbrowser.autoh(url, prepare)
+        try:
+            with urlopen(f"http://{debugger_address(self.driver)}/json/version", timeout=10) as response:
+                self.connection = CDPConnection(json.load(response)["webSocketDebuggerUrl"])
+        except Exception:
+            self.driver.quit()
+            raise
+        self.lock = threading.Lock()
+        self.pages = 0
+        # autoh打开的第一个页面留给第一个标签页使用
+        initial = self.initial_target()
+        self.free_targets = [initial] if initial else []
+
+    def initial_target(self):
+        """WebDriver的窗口句柄就是CDP的targetId，取不到时用第一个page类型的target"""
+        targets = [t["targetId"] for t in self.connection.send("Target.getTargets")["targetInfos"] if t["type"] == "page"]
+        try:
+            handle = self.driver.current_window_handle
+        except Exception:
+            handle = None
+        return handle if handle in targets else (targets[0] if targets else None)
+
+    def is_alive(self):
+        return not self.connection.closed
+
+    def open_page(self, url, prepare=None):
+        """prepare(page)在新页面打开url之前调用；复用autoh打开的第一个页面时它已在启动浏览器时调用过"""
+        with self.lock:
+            target_id = self.free_targets.pop() if self.free_targets else None
+            self.pages += 1
+        try:
+            if target_id is None:
+                target_id = self.connection.send("Target.createTarget", {"url": "about:blank"})["targetId"]
+                loaded = False
+            else:
+                loaded = True
+            session_id = self.connection.send("Target.attachToTarget", {"targetId": target_id, "flatten": True})["sessionId"]
+            page = CDPDriver(self, target_id, session_id)
+            page.prepare()
+            if not loaded:
+                if prepare:
+                    prepare(page)
+                page.get(url)
+            return page
+        except Exception:
+            with self.lock:
+                self.pages -= 1
+            raise
+
+    def close_page(self, page):
+        with self.lock:
+            self.pages -= 1
+            last = self.pages <= 0
+        if last:
+            self.quit()
+            return
+        try:
+            self.connection.send("Target.closeTarget", {"targetId": page.target_id})
+        except CDPError:
+            pass
+
+    def quit(self):
+        self.connection.close()
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+def debugger_address(driver):
+    """chromedriver/msedgedriver在capabilities中给出浏览器的调试地址"""
+    for key in ("goog:chromeOptions", "ms:edgeOptions"):
+        address = driver.capabilities.get(key, {}).get("debuggerAddress")
+        if address:
+            return address
+    raise CDPError("浏览器未提供调试地址（debuggerAddress），无法使用CDP后端")
+
+_shared_browser = None
+_shared_browser_lock = threading.Lock()
+
+def open_cdp_page(url, shared=False, prepare=None):
+    """返回一个标签页的CDPDriver；shared为True时所有标签页共用一个浏览器进程和一条CDP连接；prepare见autoh"""
+    global _shared_browser
+    if not shared:
+        browser = CDPBrowser(url, prepare)
+        try:
+            return browser.open_page(url, prepare)
+        except Exception:
+            browser.quit()
+            raise
+    with _shared_browser_lock:
+        if _shared_browser is None or not _shared_browser.is_alive():
+            _shared_browser = CDPBrowser(url, prepare)
+        browser = _shared_browser
+    return browser.open_page(url, prepare)
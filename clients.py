@@ -0,0 +1,96 @@
+# clients.py
+import hashlib
+import math
+import threading
+import time
+
+class RateLimited(Exception):
+    """超出该API Key的请求速率（对应429）"""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个，最多积累burst个"""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """取一个令牌；不足时返回需等待的秒数，成功返回0"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class Client:
+    """一个API Key对应的客户端：限额与用量"""
+    def __init__(self, name, weight=1, rate=None, burst=None, max_concurrency=None):
+        self.name = name
+        self.weight = max(float(weight or 1), 0.01)
+        self.max_concurrency = max_concurrency
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        # 用量：accepted/rate_limited/rejected由ClientRegistry记录，active/tab_seconds由TabScheduler在其锁内维护
+        self.usage = {"accepted": 0, "rate_limited": 0, "rejected": 0}
+        self.active = 0
+        self.tab_seconds = 0.0
+
+    def at_capacity(self):
+        return bool(self.max_concurrency) and self.active >= self.max_concurrency
+
+    def summary(self):
+        return {
+            "weight": self.weight,
+            "rate": self.bucket.rate if self.bucket else None,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "tab_seconds": round(self.tab_seconds, 3),
+            **self.usage
+        }
+
+class ClientRegistry:
+    """按请求头中的API Key识别客户端；未配置的Key和没有Key的请求归为anonymous"""
+    def __init__(self, api_keys=None, default_limits=None, require_key=False):
+        self.lock = threading.Lock()
+        self.require_key = require_key
+        self.by_key = {}
+        self.keys_by_name = {}
+        for key, limits in (api_keys or {}).items():
+            limits = dict(limits)
+            # 没有指定名称时用Key的哈希前缀，避免在指标和日志中出现Key本身
+            name = limits.pop("name", None) or "key-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+            self.by_key[key] = Client(name, **limits)
+            self.keys_by_name[name] = key
+        self.anonymous = Client("anonymous", **(default_limits or {}))
+
+    def identify(self, api_key):
+        """返回对应的Client；要求Key而Key无效时返回None"""
+        client = self.by_key.get(api_key) if api_key else None
+        if client:
+            return client
+        return None if self.require_key else self.anonymous
+
+    def admit(self, client):
+        """计入一次请求并检查速率，超出时抛出RateLimited"""
+        with self.lock:
+            wait = client.bucket.take() if client.bucket else 0
+            if wait:
+                client.usage["rate_limited"] += 1
+                raise RateLimited(f"请求过于频繁（{client.name}），请稍后再试", math.ceil(wait))
+            client.usage["accepted"] += 1
+
+    def record(self, client, outcome):
+        with self.lock:
+            client.usage[outcome] += 1
+
+    def key_for(self, name):
+        """按客户端名称查回API Key，供进程内转发（批量任务）使用"""
+        return self.keys_by_name.get(name)
+
+    def clients(self):
+        return list(self.by_key.values()) + [self.anonymous]
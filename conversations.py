@@ -0,0 +1,64 @@
+# conversations.py
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+def normalize_content(content):
+    """统一消息内容：合并空白，图片只保留URL的哈希"""
+    if isinstance(content, str):
+        return " ".join(content.split())
+    if isinstance(content, list):
+        parts = []
+        for item in content:
+            if not isinstance(item, dict):
+                continue
+            if item.get('type') == 'text':
+                parts.append(["text", " ".join(item.get('text', '').split())])
+            elif item.get('type') == 'image_url':
+                url = item.get('image_url', {}).get('url', '')
+                parts.append(["image", hashlib.sha256(url.encode('utf-8')).hexdigest()])
+        return parts
+    return ""
+
+def messages_key(model, messages):
+    """模型+消息列表的哈希，作为会话前缀的索引键"""
+    normalized = [[msg.get('role', 'user'), normalize_content(msg.get('content', ''))] for msg in messages]
+    payload = json.dumps([model, normalized], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ConversationIndex:
+    """消息前缀哈希 -> 元宝会话ID(dt-cid)，用于多轮对话只发送新增的用户消息"""
+    def __init__(self, max_size=1000, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def pop(self, model, messages):
+        """取出并删除前缀对应的会话ID：续接后该会话里已多了新的一轮，同一前缀再来（重新生成、编辑分支）
+        只能发送完整历史，新的前缀在回复成功后再由put记录"""
+        key = messages_key(model, messages)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if not entry:
+                return None
+            session_id, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                return None
+            return session_id
+
+    def put(self, model, messages, session_id):
+        if not session_id or session_id == "new":
+            return
+        key = messages_key(model, messages)
+        with self.lock:
+            self.entries[key] = (session_id, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, model, messages):
+        with self.lock:
+            self.entries.pop(messages_key(model, messages), None)
@@ -0,0 +1,89 @@
+# extract_benchmark.py
+"""对比两种回答提取方式在长回答上的耗时：
+原方式 find_elements + WebElement.text + 合并空白；新方式 一次execute_script转换为Markdown
+
+用法: python extract_benchmark.py [每种长度的重复次数]
+使用本地生成的模拟回答页面，不需要登录；浏览器按setbrowser.py中的BROWSER与BROWSER_PROFILE启动
+"""
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+import setbrowser
+from extraction import extract_answer
+
+BUBBLE_CLASS = "agent-chat__bubble__content"
+SECTION_COUNTS = (10, 100, 500)  # 模拟回答的段落数，500段约为十几万字符
+
+SECTION_HTML = """
+<h3>第{i}节</h3>
+<p>这是第{i}段说明文字，包含<strong>加粗</strong>、<code>inline_code()</code>和<a href="https://example.com/{i}">链接</a>。</p>
+<ul><li>要点一</li><li>要点二<ol><li>子项</li></ol></li></ul>
+<div class="hyc-common-markdown__code"><div class="hyc-common-markdown__code__hd">python<span class="copy">复制</span></div>
+<pre><code class="language-python">def section_{i}(x):
+    if x &gt; {i}:
+        return x * 2
+    return x
+</code></pre></div>
+<table><tr><th>名称</th><th>数值</th></tr><tr><td>a{i}</td><td>{i}</td></tr></table>
+"""
+
+def answer_page(sections):
+    body = "".join(SECTION_HTML.format(i=i) for i in range(sections))
+    return f"""<html><head><meta charset="utf-8"></head><body>
+<div class="{BUBBLE_CLASS}">请写一篇长文档</div>
+<div class="{BUBBLE_CLASS}"><div class="hyc-component-reasoner__think"><p>先列出提纲。</p></div>
+<div class="hyc-common-markdown">{body}</div>
+<div class="hyc-common-markdown__ref-list"><a href="https://example.com/ref">参考资料</a></div></div>
+</body></html>"""
+
+def legacy_extract(driver):
+    """原来的提取方式"""
+    messages = driver.find_elements(By.CSS_SELECTOR, f".{BUBBLE_CLASS}")
+    cleaned_text = re.sub(r'\s+', ' ', messages[-1].text.strip()).strip()
+    return re.sub(r'\s+([.，,；;！!？?])', r'\1', cleaned_text)
+
+def markdown_extract(driver):
+    return extract_answer(driver, BUBBLE_CLASS)["text"]
+
+def start_driver():
+    options = setbrowser.build_options()
+    if setbrowser.BROWSER == "chrome":
+        return webdriver.Chrome(options=options)
+    return webdriver.Edge(service=setbrowser.Service(), options=options)
+
+def timed(func, driver, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(driver)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000, len(result)
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    driver = start_driver()
+    results = []
+    try:
+        for sections in SECTION_COUNTS:
+            with tempfile.NamedTemporaryFile("w", suffix=".html", encoding="utf-8", delete=False) as f:
+                f.write(answer_page(sections))
+            try:
+                driver.get("file://" + f.name)
+                legacy_ms, legacy_chars = timed(legacy_extract, driver, repeats)
+                markdown_ms, markdown_chars = timed(markdown_extract, driver, repeats)
+            finally:
+                os.remove(f.name)
+            results.append((sections, legacy_ms, legacy_chars, markdown_ms, markdown_chars))
+    finally:
+        driver.quit()
+
+    print(f"\n每项重复 {repeats} 次，取中位数")
+    print(f"{'段落数':<8}{'原方式(ms)':>12}{'原方式字符数':>14}{'Markdown(ms)':>14}{'Markdown字符数':>16}")
+    for sections, legacy_ms, legacy_chars, markdown_ms, markdown_chars in results:
+        print(f"{sections:<8}{legacy_ms:>12.1f}{legacy_chars:>14}{markdown_ms:>14.1f}{markdown_chars:>16}")
@@ -0,0 +1,174 @@
+# extraction.py
+"""回答提取：一次execute_script把最后一个回答气泡的DOM转换为Markdown，同时取出思考过程和搜索引用"""
+
+# 深度思考（DeepSeek R1等）的思考过程区域
+THINKING_SELECTORS = [
+    "[class*='reasoner__think']",
+    "[class*='deep-think']",
+    "[class*='thinking-content']"
+]
+
+# 联网搜索的引用来源列表
+CITATION_SELECTORS = [
+    "[class*='ref-list']",
+    "[class*='search-result']",
+    "[class*='reference-list']"
+]
+
+# 回答中不属于正文的界面元素（代码块标题栏、复制按钮等）
+ANSWER_CHROME_SELECTORS = [
+    "[class*='code__hd']",
+    "[class*='code-header']",
+    "[class*='copy']",
+    "button",
+    "svg",
+    "style",
+    "script"
+]
+
+# 参数: 气泡class, 思考区域选择器, 引用列表选择器, 忽略元素选择器
+# 返回 {"text": Markdown正文, "thinking": 思考过程Markdown或null, "citations": [{"title", "url"}]}，没有气泡时返回null
+ANSWER_SCRIPT = r"""
+const [bubbleClass, thinkingSelector, citationSelector, chromeSelector] = arguments;
+const bubbles = document.getElementsByClassName(bubbleClass);
+if (!bubbles.length) {
+    return null;
+}
+const root = bubbles[bubbles.length - 1];
+const codeBlocks = [];
+
+const inlineText = el => children(el, {}).replace(/\s+/g, ' ').trim();
+const children = (el, ctx) => {
+    let out = '';
+    for (const child of el.childNodes) {
+        out += convert(child, ctx);
+    }
+    return out;
+};
+const wrap = (mark, text) => text.trim() ? mark + text.trim() + mark : '';
+const block = text => '\n\n' + text.trim() + '\n\n';
+
+function list(el, ctx, ordered) {
+    let index = Number(el.getAttribute('start')) || 1;
+    const items = [];
+    for (const item of el.children) {
+        if (item.nodeName.toLowerCase() !== 'li') {
+            continue;
+        }
+        const marker = ordered ? (index++) + '. ' : '- ';
+        const content = children(item, ctx).trim().replace(/\n{2,}/g, '\n');
+        items.push(marker + content.split('\n').join('\n' + ' '.repeat(marker.length)));
+    }
+    return block(items.join('\n'));
+}
+
+function table(el) {
+    const rows = [];
+    for (const row of el.querySelectorAll('tr')) {
+        const cells = [];
+        for (const cell of row.children) {
+            if (/^t[hd]$/i.test(cell.nodeName)) {
+                cells.push(inlineText(cell).replace(/\|/g, '\\|'));
+            }
+        }
+        if (cells.length) {
+            rows.push(cells);
+        }
+    }
+    if (!rows.length) {
+        return '';
+    }
+    const width = Math.max(...rows.map(cells => cells.length));
+    const line = cells => '| ' + Array.from({length: width}, (_, i) => cells[i] || '').join(' | ') + ' |';
+    return block([line(rows[0]), line(rows[0].map(() => '---')), ...rows.slice(1).map(line)].join('\n'));
+}
+
+function convert(node, ctx) {
+    if (node.nodeType === 3) {
+        return node.nodeValue.replace(/\s+/g, ' ');
+    }
+    if (node.nodeType !== 1 || node.matches(chromeSelector)) {
+        return '';
+    }
+    if (ctx.top && (node.matches(thinkingSelector) || node.matches(citationSelector))) {
+        return '';
+    }
+    const tag = node.nodeName.toLowerCase();
+    switch (tag) {
+        case 'br':
+            return '\n';
+        case 'hr':
+            return block('---');
+        case 'h1': case 'h2': case 'h3': case 'h4': case 'h5': case 'h6':
+            return block('#'.repeat(Number(tag[1])) + ' ' + inlineText(node));
+        case 'p':
+            return block(children(node, ctx).replace(/ *\n */g, '\n'));
+        case 'strong': case 'b':
+            return wrap('**', children(node, ctx));
+        case 'em': case 'i':
+            return wrap('*', children(node, ctx));
+        case 'del': case 's':
+            return wrap('~~', children(node, ctx));
+        case 'code':
+            return node.textContent ? '`' + node.textContent + '`' : '';
+        case 'pre': {
+            const code = node.querySelector('code') || node;
+            const language = (/(?:language|lang)-([\w+#-]+)/.exec(code.className || '') || [])[1] || '';
+            // 代码块原样保留，最后统一整理空行时不受影响
+            codeBlocks.push('```' + language + '\n' + code.textContent.replace(/\n$/, '') + '\n```');
+            return block('\u0000' + (codeBlocks.length - 1) + '\u0000');
+        }
+        case 'a': {
+            const text = children(node, ctx).trim();
+            const href = node.getAttribute('href') || '';
+            return /^https?:/.test(href) && text ? '[' + text + '](' + href + ')' : text;
+        }
+        case 'img': {
+            const src = node.getAttribute('src') || '';
+            return /^https?:/.test(src) ? '![' + (node.getAttribute('alt') || '') + '](' + src + ')' : '';
+        }
+        case 'ul':
+            return list(node, ctx, false);
+        case 'ol':
+            return list(node, ctx, true);
+        case 'table':
+            return table(node);
+        case 'blockquote':
+            return block(children(node, ctx).trim().replace(/\n{3,}/g, '\n\n').split('\n').map(line => '> ' + line).join('\n'));
+        case 'div': case 'section': case 'article': case 'li':
+            return '\n' + children(node, ctx) + '\n';
+        default:
+            return children(node, ctx);
+    }
+}
+
+const markdown = el => children(el, {top: el === root})
+    .replace(/[ \t]+\n/g, '\n')
+    .replace(/\n{3,}/g, '\n\n')
+    .trim()
+    .replace(/\u0000(\d+)\u0000/g, (_, i) => codeBlocks[Number(i)]);
+
+const thinkingNode = root.querySelector(thinkingSelector);
+const citations = [];
+const seen = new Set();
+for (const container of root.querySelectorAll(citationSelector)) {
+    for (const link of container.querySelectorAll('a[href]')) {
+        const url = link.getAttribute('href');
+        if (/^https?:/.test(url) && !seen.has(url)) {
+            seen.add(url);
+            citations.push({title: link.textContent.replace(/\s+/g, ' ').trim(), url: url});
+        }
+    }
+}
+return {
+    text: markdown(root),
+    thinking: thinkingNode ? markdown(thinkingNode) : null,
+    citations: citations
+};
+"""
+
+def extract_answer(driver, bubble_class):
+    """返回最后一个气泡的 {"text", "thinking", "citations"}，页面上没有气泡时返回None"""
+    return driver.execute_script(
+        ANSWER_SCRIPT, bubble_class, ", ".join(THINKING_SELECTORS),
+        ", ".join(CITATION_SELECTORS), ", ".join(ANSWER_CHROME_SELECTORS))
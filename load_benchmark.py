@@ -0,0 +1,231 @@
+# load_benchmark.py
+"""端到端压测：启动本地模拟页面（standin.py）和使用它的aiapi实例，按不同MAX_TABS发送并发请求，
+统计延迟p50/p95/p99、首字时间（TTFT）和吞吐量，作为调度、轮询、提取等改动前后对比的基线
+
+用法: python load_benchmark.py [--tabs 1 2 4] [--requests 40] [--concurrency 8] [--no-stream] [--answer-source dom|network] [--output 结果.json]
+浏览器按setbrowser.py中的BROWSER与BROWSER_PROFILE启动，不需要登录和网络；每组标签页数单独启动一个aiapi子进程
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import standin
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = (len(values) - 1) * p / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+def serve(site, tabs, port, max_queue, answer_source):
+    """子进程：覆盖setbrowser中的配置后加载aiapi并运行，标准输入关闭时退出并关闭浏览器"""
+    import asyncio
+    import setbrowser
+    setbrowser.YUANBAO_URL = site
+    setbrowser.MAX_TABS = setbrowser.MIN_TABS = tabs
+    setbrowser.PORT_RUNNING = port
+    setbrowser.MAX_QUEUE = max_queue
+    setbrowser.ANSWER_SOURCE = answer_source
+    setbrowser.RESPONSE_CACHE_SIZE = 0  # 每个请求都要经过浏览器
+    setbrowser.RESPONSE_CACHE_FILE = None
+    import aiapi
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def wait_stdin():
+            sys.stdin.read()
+            loop.call_soon_threadsafe(stop.set)
+        threading.Thread(target=wait_stdin, daemon=True).start()
+
+        config = Config()
+        config.bind = [f"127.0.0.1:{port}"]
+        config.accesslog = None
+        await hypercorn_serve(aiapi.app, config, shutdown_trigger=stop.wait)
+
+    try:
+        asyncio.run(main())
+    finally:
+        for tab in list(aiapi.tabs):
+            try:
+                tab.driver.quit()
+            except Exception:
+                pass
+
+def start_instance(site, tabs, port, max_queue, answer_source, workdir):
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--site", site, "--tabs", str(tabs),
+               "--port", str(port), "--max-queue", str(max_queue), "--answer-source", answer_source]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                                     os.environ.get("PYTHONPATH")])))
+    return subprocess.Popen(command, cwd=workdir, env=env, stdin=subprocess.PIPE)
+
+def stop_instance(process):
+    try:
+        process.stdin.close()
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def wait_ready(process, base_url, tabs, timeout):
+    """等待所有标签页启动完成，返回用时（秒）"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"aiapi子进程已退出（返回码 {process.returncode}）")
+        try:
+            health = requests.get(f"{base_url}/health", params={"brief": "1"}, timeout=2).json()
+            if health.get("total_tabs", 0) >= tabs:
+                return time.perf_counter() - start
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{timeout}秒内标签页未全部启动")
+
+def send_request(base_url, tag, stream, timeout):
+    """发送一个请求，返回 {"ok", "latency", "ttft", "chars", "error"}"""
+    body = {
+        "model": "hunyuan",
+        "messages": [{"role": "user", "content": f"{tag} 请简单介绍一下压力测试"}],
+        "stream": stream,
+        "cache": False
+    }
+    start = time.perf_counter()
+    ttft = None
+    text = ""
+    try:
+        with requests.post(f"{base_url}/v1/chat/completions", json=body, stream=stream, timeout=timeout) as response:
+            if response.status_code != 200:
+                return {"ok": False, "error": f"HTTP {response.status_code}"}
+            if stream:
+                # iter_lines会先攒满chunk_size再返回，按到达的数据块自行分行才能测准首字时间
+                buffer = b""
+                for chunk in response.iter_content(chunk_size=None):
+                    buffer += chunk
+                    lines = buffer.split(b"\n")
+                    buffer = lines.pop()
+                    for line in lines:
+                        line = line.decode("utf-8").strip()
+                        if not line.startswith("data: ") or line == "data: [DONE]":
+                            continue
+                        content = json.loads(line[6:])["choices"][0].get("delta", {}).get("content") or ""
+                        if content and ttft is None:
+                            ttft = time.perf_counter() - start
+                        text += content
+            else:
+                text = response.json()["choices"][0]["message"]["content"]
+    except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+        return {"ok": False, "error": type(e).__name__}
+    latency = time.perf_counter() - start
+    # 模拟页面的回答以复述问题开头，据此确认回答没有串到别的请求
+    if tag not in text:
+        return {"ok": False, "error": "回答与请求不对应"}
+    return {"ok": True, "latency": latency, "ttft": ttft if ttft is not None else latency, "chars": len(text)}
+
+def run_load(base_url, count, concurrency, stream, timeout):
+    run_id = uuid.uuid4().hex[:6]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda i: send_request(base_url, f"#{run_id}-{i}", stream, timeout), range(count)))
+    return results, time.perf_counter() - start
+
+def summarize(tabs, results, elapsed, startup):
+    ok = [r for r in results if r["ok"]]
+    errors = {}
+    for r in results:
+        if not r["ok"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok]
+    return {
+        "tabs": tabs,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "startup_seconds": round(startup, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0,
+        "chars_per_second": round(sum(r["chars"] for r in ok) / elapsed, 1) if elapsed else 0,
+        **{f"latency_p{p}": percentile(latencies, p) for p in (50, 95, 99)},
+        **{f"ttft_p{p}": percentile(ttfts, p) for p in (50, 95)},
+        "latency_mean": statistics.mean(latencies) if latencies else None
+    }
+
+def print_table(summaries):
+    seconds = lambda value: f"{value:.2f}" if value is not None else "-"
+    print(f"\n{'标签页':<6}{'成功/总数':>10}{'启动(s)':>9}{'请求/秒':>9}{'字符/秒':>9}"
+          f"{'p50(s)':>9}{'p95(s)':>9}{'p99(s)':>9}{'首字p50':>9}{'首字p95':>9}")
+    for s in summaries:
+        print(f"{s['tabs']:<6}{str(s['ok']) + '/' + str(s['requests']):>10}{s['startup_seconds']:>9.1f}"
+              f"{s['throughput_rps']:>9.2f}{s['chars_per_second']:>9.0f}"
+              f"{seconds(s['latency_p50']):>9}{seconds(s['latency_p95']):>9}{seconds(s['latency_p99']):>9}"
+              f"{seconds(s['ttft_p50']):>9}{seconds(s['ttft_p95']):>9}")
+        if s["errors"]:
+            print(f"      失败: {s['errors']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="基于本地模拟页面的端到端压测")
+    parser.add_argument("--tabs", type=int, nargs="+", default=[1, 2, 4], help="依次测试的MAX_TABS")
+    parser.add_argument("--requests", type=int, default=40, help="每组发送的请求数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时在途的请求数")
+    parser.add_argument("--no-stream", action="store_true", help="使用非流式请求（首字时间即总延迟）")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时（秒）")
+    parser.add_argument("--port", type=int, default=8090, help="aiapi子进程使用的端口")
+    parser.add_argument("--token-rate", type=float, default=standin.DEFAULT_CONFIG["token_rate"], help="模拟页面每秒输出的词数")
+    parser.add_argument("--answer-tokens", type=int, default=standin.DEFAULT_CONFIG["answer_tokens"], help="模拟回答的词数")
+    parser.add_argument("--first-token-delay", type=float, default=standin.DEFAULT_CONFIG["first_token_delay"], help="模拟首字延迟（秒）")
+    parser.add_argument("--answer-source", choices=["dom", "network"], default="dom",
+                        help="回答读取方式，与setbrowser.py中的ANSWER_SOURCE相同")
+    parser.add_argument("--output", help="把结果另存为JSON，便于与之后的运行对比")
+    # 以下为子进程参数
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--site", help=argparse.SUPPRESS)
+    parser.add_argument("--max-queue", type=int, default=50, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.site, args.tabs[0], args.port, args.max_queue, args.answer_source)
+        sys.exit(0)
+
+    server, site = standin.serve_in_thread(token_rate=args.token_rate, answer_tokens=args.answer_tokens,
+                                           first_token_delay=args.first_token_delay)
+    print(f"模拟页面: {site}/chat")
+    base_url = f"http://127.0.0.1:{args.port}"
+    summaries = []
+    try:
+        for tabs in args.tabs:
+            with tempfile.TemporaryDirectory() as workdir:
+                print(f"\n启动aiapi（MAX_TABS={tabs}）...")
+                process = start_instance(site, tabs, args.port, max(args.concurrency, 50), args.answer_source, workdir)
+                try:
+                    startup = wait_ready(process, base_url, tabs, timeout=120 + 30 * tabs)
+                    print(f"标签页就绪，用时 {startup:.1f}s；发送 {args.requests} 个请求（并发 {args.concurrency}）")
+                    results, elapsed = run_load(base_url, args.requests, args.concurrency, not args.no_stream, args.timeout)
+                finally:
+                    stop_instance(process)
+            summaries.append(summarize(tabs, results, elapsed, startup))
+    finally:
+        server.shutdown()
+
+    print(f"\n模拟页面: 每秒 {args.token_rate} 词，每个回答 {args.answer_tokens} 词，首字延迟 {args.first_token_delay}s；"
+          f"{'非流式' if args.no_stream else '流式'}请求，回答读取方式 {args.answer_source}")
+    print_table(summaries)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("serve", "site", "max_queue")},
+                       "results": summaries}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
@@ -0,0 +1,82 @@
+# profile_benchmark.py
+"""对比desktop与server浏览器配置下每个标签页的内存(RSS)与CPU占用
+
+用法: python profile_benchmark.py [标签页数量] [空闲采样秒数]
+需要额外安装psutil（pip install psutil），并已有可用的cookies.json
+"""
+import sys
+import time
+import setbrowser
+
+try:
+    import psutil
+except ImportError:
+    print("需要先安装psutil: pip install psutil")
+    sys.exit(1)
+
+URL = f"{setbrowser.YUANBAO_URL}/login"
+
+def process_tree(driver):
+    """驱动进程及其启动的浏览器、渲染进程"""
+    root = psutil.Process(driver.service.process.pid)
+    return [root] + root.children(recursive=True)
+
+def tree_rss(processes):
+    total = 0
+    for p in processes:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def tree_cpu_time(processes):
+    total = 0
+    for p in processes:
+        try:
+            times = p.cpu_times()
+            total += times.user + times.system
+        except psutil.Error:
+            pass
+    return total
+
+def measure(profile, tabs, idle_seconds):
+    setbrowser.BROWSER_PROFILE = profile
+    drivers = []
+    try:
+        start = time.time()
+        for _ in range(tabs):
+            drivers.append(setbrowser.autoh(URL))
+        startup = time.time() - start
+
+        processes = [p for d in drivers for p in process_tree(d)]
+        cpu_before = tree_cpu_time(processes)
+        time.sleep(idle_seconds)
+        cpu_after = tree_cpu_time(processes)
+
+        return {
+            "profile": profile,
+            "rss_mb_per_tab": tree_rss(processes) / tabs / 1024 / 1024,
+            "idle_cpu_percent_per_tab": (cpu_after - cpu_before) / idle_seconds / tabs * 100,
+            "startup_seconds_per_tab": startup / tabs
+        }
+    finally:
+        for d in drivers:
+            try:
+                d.quit()
+            except Exception:
+                pass
+
+if __name__ == '__main__':
+    tabs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    idle_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    results = [measure(profile, tabs, idle_seconds) for profile in ("desktop", "server")]
+
+    print(f"\n标签页数量: {tabs}, 空闲采样: {idle_seconds}秒")
+    print(f"{'配置':<10}{'RSS/标签页(MB)':>16}{'空闲CPU/标签页(%)':>20}{'启动/标签页(秒)':>18}")
+    for r in results:
+        print(f"{r['profile']:<10}{r['rss_mb_per_tab']:>16.1f}{r['idle_cpu_percent_per_tab']:>20.2f}{r['startup_seconds_per_tab']:>18.2f}")
+    desktop, server = results
+    if desktop["rss_mb_per_tab"]:
+        print(f"\nserver配置节省内存: {(1 - server['rss_mb_per_tab'] / desktop['rss_mb_per_tab']) * 100:.1f}%")
@@ -0,0 +1,300 @@
+# router.py
+"""多个aiapi实例前的路由器：对外提供相同的OpenAI兼容接口，按各实例/health中的空闲标签页和排队长度分配请求
+
+用法: python router.py [后端地址 ...]，未指定时使用setbrowser.py中的ROUTER_BACKENDS
+例如本机三个实例: python router.py http://127.0.0.1:8001 http://127.0.0.1:8002 http://127.0.0.1:8003
+需要额外安装httpx（pip install httpx）
+"""
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import OrderedDict
+from quart import Quart, request, jsonify, Response
+from setbrowser import ROUTER_BACKENDS, ROUTER_PORT, ROUTER_HEALTH_INTERVAL, CONVERSATION_INDEX_SIZE, CONVERSATION_TTL
+from conversations import messages_key
+
+try:
+    import httpx
+except ImportError as e:
+    # 抛出而不是退出进程，导入本模块的程序（如测试）可以自行处理
+    raise ImportError("router.py需要先安装httpx: pip install httpx") from e
+
+# 转发给后端的请求头与返回给客户端的响应头
+FORWARD_REQUEST_HEADERS = ("Content-Type", "Authorization", "X-API-Key", "X-Priority", "X-Request-Timeout",
+                           "Idempotency-Key", "Cache-Control")
+FORWARD_RESPONSE_HEADERS = ("Content-Type", "Cache-Control", "Retry-After", "X-Queue-Position", "X-Cache")
+
+app = Quart(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class Backend:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.health = {}
+        self.inflight = 0  # 路由器正在转发到该实例的请求数
+        self.checked_at = 0
+
+    def load(self):
+        """占用率：按/health中的忙碌标签页+排队数，与本路由器在途请求数取较大者（两次轮询之间也能反映新分配的请求）"""
+        capacity = max(self.health.get("total_tabs", 0) + self.health.get("starting_tabs", 0), 1)
+        reported = self.health.get("busy_tabs", 0) + self.health.get("queue_length", 0)
+        return max(reported, self.inflight) / capacity
+
+    def summary(self):
+        return {"url": self.url, "healthy": self.healthy, "inflight": self.inflight, "load": round(self.load(), 3),
+                **{k: self.health.get(k) for k in ("total_tabs", "idle_tabs", "busy_tabs", "starting_tabs", "queue_length")}}
+
+class PinTable:
+    """会话 -> 所在后端，与后端的续接索引相同的LRU + TTL"""
+    def __init__(self, max_size=1000, ttl=86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if not entry:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, backend):
+        self.entries[key] = (backend, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+backends = [Backend(url) for url in ROUTER_BACKENDS]
+pins = PinTable(CONVERSATION_INDEX_SIZE, CONVERSATION_TTL)  # 路由器只在事件循环中访问，无需加锁
+client = None
+health_task = None
+
+async def poll_health():
+    while True:
+        await asyncio.gather(*(check_backend(backend) for backend in backends))
+        await asyncio.sleep(ROUTER_HEALTH_INTERVAL)
+
+async def check_backend(backend):
+    try:
+        response = await client.get(f"{backend.url}/health", params={"brief": "1"}, timeout=5)
+        response.raise_for_status()
+        backend.health = response.json()
+        if not backend.healthy:
+            logging.info(f"后端 {backend.url} 恢复")
+        backend.healthy = True
+    except Exception as e:
+        if backend.healthy:
+            logging.warning(f"后端 {backend.url} 不可用: {str(e)}")
+        backend.healthy = False
+    backend.checked_at = time.time()
+
+def candidates(pinned=None, exclude=()):
+    """按占用率从低到高排列的后端；固定会话的后端排在最前"""
+    available = [b for b in backends if b.healthy and b not in exclude] or [b for b in backends if b not in exclude]
+    random.shuffle(available)
+    available.sort(key=lambda b: b.load())
+    if pinned in available:
+        available.remove(pinned)
+        available.insert(0, pinned)
+    return available
+
+def find_backend(url):
+    return next((b for b in backends if b.url == url), None)
+
+def route_info(path, body):
+    """返回(固定的后端, 是否只能发往该后端, 记录会话归属的函数)"""
+    if not isinstance(body, dict):
+        return None, False, None
+    if path == "/hunyuan":
+        sequence = body.get("sequence", "new")
+        if sequence and sequence != "new":
+            # 续接dt-cid会话只能由打开过它的实例处理
+            return find_backend(pins.get(("sequence", sequence))), True, None
+
+        def remember_sequence(backend, response_body):
+            session_id = str(response_body.get("id", "")).replace("chatcmpl-", "", 1)
+            if session_id and session_id != "new":
+                pins.put(("sequence", session_id), backend.url)
+        return None, False, remember_sequence
+
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return None, False, None
+    model = body.get("model", "hunyuan")
+    pinned = None
+    if len(messages) > 1:
+        # 多轮对话发往保存了之前会话的实例，由其只发送新消息；该实例不可用时其他实例也能处理完整历史
+        pinned = find_backend(pins.get(("messages", messages_key(model, messages[:-1]))))
+
+    def remember_messages(backend, response_text):
+        pins.put(("messages", messages_key(model, messages + [{"role": "assistant", "content": response_text}])), backend.url)
+    return pinned, False, remember_messages
+
+def forward_headers():
+    return {name: request.headers[name] for name in FORWARD_REQUEST_HEADERS if name in request.headers}
+
+def client_response(backend, upstream, body):
+    headers = {name: upstream.headers[name] for name in FORWARD_RESPONSE_HEADERS if name in upstream.headers}
+    headers["X-Backend"] = backend.url
+    return Response(body, status=upstream.status_code, headers=headers)
+
+def relay_stream(backend, upstream, remember):
+    """逐块转发SSE，同时从中拼出回复文本以记录会话归属"""
+    async def generate():
+        buffer = ""
+        parts = []
+        completed = False
+        try:
+            async for chunk in upstream.aiter_text():
+                yield chunk
+                buffer += chunk
+                lines = buffer.split("\n")
+                buffer = lines.pop()
+                for line in lines:
+                    if not line.startswith("data: ") or line == "data: [DONE]":
+                        completed = completed or line == "data: [DONE]"
+                        continue
+                    try:
+                        choice = json.loads(line[6:])["choices"][0]
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        continue
+                    parts.append(choice.get("delta", {}).get("content") or "")
+            if remember and completed:
+                remember(backend, "".join(parts))
+        finally:
+            backend.inflight -= 1
+            await upstream.aclose()
+    return generate()
+
+async def proxy(path):
+    raw = await request.get_data()
+    try:
+        body = json.loads(raw) if raw else None
+    except ValueError:
+        body = None
+    pinned, pinned_only, remember = route_info(path, body)
+    if pinned_only and not pinned:
+        logging.warning(f"会话 {body.get('sequence')} 没有已知的所属实例，按普通请求分配")
+        pinned_only = False
+    stream = isinstance(body, dict) and bool(body.get("stream"))
+
+    tried = []
+    last = None
+    while True:
+        order = [pinned] if pinned_only and pinned else candidates(pinned, tried)
+        order = [b for b in order if b not in tried]
+        if not order:
+            break
+        backend = order[0]
+        tried.append(backend)
+        backend.inflight += 1
+        try:
+            upstream = await client.send(
+                client.build_request("POST", f"{backend.url}{path}", content=raw, headers=forward_headers()),
+                stream=True)
+        except httpx.HTTPError as e:
+            backend.inflight -= 1
+            backend.healthy = False
+            logging.warning(f"转发到 {backend.url} 失败，尝试其他实例: {str(e)}")
+            continue
+
+        if upstream.status_code == 503 and not pinned_only:
+            # 该实例已满，换下一个；全部已满时返回最后一个503（含Retry-After）
+            last = (backend, upstream, await upstream.aread())
+            backend.inflight -= 1
+            await upstream.aclose()
+            logging.info(f"后端 {backend.url} 繁忙，尝试其他实例")
+            continue
+
+        if stream and upstream.headers.get("Content-Type", "").startswith("text/event-stream"):
+            return client_response(backend, upstream, relay_stream(backend, upstream, remember))
+
+        try:
+            content = await upstream.aread()
+        finally:
+            backend.inflight -= 1
+            await upstream.aclose()
+        if upstream.status_code == 200 and remember:
+            try:
+                response_body = json.loads(content)
+                if path == "/hunyuan":
+                    remember(backend, response_body)
+                else:
+                    remember(backend, response_body["choices"][0]["message"]["content"])
+            except (ValueError, KeyError, IndexError, TypeError):
+                pass
+        return client_response(backend, upstream, content)
+
+    if last:
+        return client_response(*last)
+    return jsonify({
+        "error": {
+            "message": "没有可用的后端实例",
+            "type": "server_error",
+            "code": "server_error"
+        }
+    }), 503
+
+@app.route('/v1/chat/completions', methods=['POST'])
+async def openai_chat_completions():
+    return await proxy('/v1/chat/completions')
+
+@app.route('/hunyuan', methods=['POST'])
+async def handle_request():
+    return await proxy('/hunyuan')
+
+@app.route('/v1/models', methods=['GET'])
+async def list_models():
+    for backend in candidates():
+        try:
+            response = await client.get(f"{backend.url}/v1/models", timeout=5)
+            return Response(response.content, status=response.status_code, content_type=response.headers.get("Content-Type"))
+        except httpx.HTTPError:
+            continue
+    return jsonify({"object": "list", "data": []})
+
+@app.route('/health', methods=['GET'])
+async def health_check():
+    """汇总各后端状态，字段与aiapi的/health一致，便于再上一级路由器或监控使用"""
+    healthy = [b for b in backends if b.healthy]
+    total = lambda key: sum(b.health.get(key, 0) for b in healthy)
+    return jsonify({
+        "total_tabs": total("total_tabs"),
+        "idle_tabs": total("idle_tabs"),
+        "busy_tabs": total("busy_tabs"),
+        "starting_tabs": total("starting_tabs"),
+        "queue_length": total("queue_length"),
+        "max_tabs": total("max_tabs"),
+        "backends": [b.summary() for b in backends]
+    })
+
+@app.before_serving
+async def start_router():
+    global client, health_task
+    # 超时由后端的排队期限控制，这里只限制连接时间
+    client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5), limits=httpx.Limits(max_connections=None))
+    await asyncio.gather(*(check_backend(backend) for backend in backends))
+    health_task = asyncio.create_task(poll_health())
+    logging.info(f"路由器启动，后端: {[b.url for b in backends]}")
+
+@app.after_serving
+async def stop_router():
+    health_task.cancel()
+    await client.aclose()
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    if len(sys.argv) > 1:
+        backends[:] = [Backend(url) for url in sys.argv[1:]]
+    config = Config()
+    config.bind = [f"0.0.0.0:{ROUTER_PORT}"]
+    asyncio.run(serve(app, config))
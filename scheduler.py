@@ -0,0 +1,239 @@
+# scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+# 请求优先级：数值越小越优先
+PRIORITIES = {
+    "interactive": 0,
+    "bulk": 1
+}
+
+class QueueRejected(Exception):
+    """请求未能进入或在队列中被丢弃（对应503）"""
+    def __init__(self, message, retry_after=1, position=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.position = position
+
+class Waiter:
+    def __init__(self, rank, deadline, latest_start, seq, client=None, tag=0.0):
+        self.rank = rank
+        self.deadline = deadline
+        self.latest_start = latest_start
+        self.seq = seq
+        self.client = client
+        self.tag = tag
+        self.future = Future()
+
+    def __lt__(self, other):
+        # 先按优先级，再按客户端之间的公平份额（虚拟开始时间），再按截止时间（EDF），最后按到达顺序
+        return (self.rank, self.tag, self.deadline, self.seq) < (other.rank, other.tag, other.deadline, other.seq)
+
+class TabScheduler:
+    """标签页池前的准入队列：有界、分优先级、按截止时间排序，并对无法按时完成的请求降载
+    
+    传入client（clients.Client）时按权重在客户端之间公平分配标签页（start-time fair queuing），
+    并限制每个客户端同时占用的标签页数量；超出并发上限的请求留在队列中，不会被拒绝"""
+    def __init__(self, try_acquire, spawn, capacity, max_queue=50, default_timeout=180):
+        # try_acquire(model): 立即返回一个已加锁的空闲标签页或None（不得阻塞），优先已处于model的标签页
+        # spawn(): 请求在后台新建标签页（不得阻塞），新标签页就绪后通过offer()交给调度器
+        # capacity(): 当前标签页数量，用于估算等待时间
+        self.try_acquire = try_acquire
+        self.spawn = spawn
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.lock = threading.Lock()
+        self.waiters = []
+        self.seq = itertools.count()
+        self.started = {}
+        self.holders = {}  # 标签页ID -> 占用它的客户端
+        self.virtual_time = 0.0  # 最近分配出去的请求的虚拟开始时间
+        self.finish_tags = {}  # 客户端名称 -> 该客户端最后一个请求的虚拟结束时间
+        self.avg_service = None  # 单次请求占用标签页时间的滑动平均（秒）
+
+    def estimate_service(self):
+        return self.avg_service or 0
+
+    def retry_after(self, ahead):
+        """按当前排队长度估算客户端应在多少秒后重试"""
+        service = self.estimate_service() or 1
+        tabs = max(self.capacity(), 1)
+        return max(1, math.ceil(service * (ahead // tabs + 1)))
+
+    def position_of(self, waiter):
+        return sum(1 for w in self.waiters if w < waiter) + 1
+
+    def acquire(self, priority="interactive", timeout=None, model=None, client=None):
+        """获取一个已加锁的标签页，必要时排队等待；无法在期限内开始时抛出QueueRejected"""
+        tab, waiter = self._admit(priority, timeout, model, client)
+        if tab:
+            return tab
+        try:
+            return waiter.future.result(timeout=max(waiter.latest_start - time.time(), 0))
+        except QueueRejected:
+            raise
+        except Exception:
+            return self._abandon(waiter)
+
+    async def acquire_async(self, priority="interactive", timeout=None, model=None, client=None):
+        """同acquire，但在事件循环中等待，排队期间不占用线程"""
+        tab, waiter = self._admit(priority, timeout, model, client)
+        if tab:
+            return tab
+        try:
+            # shield: 超时或取消时不取消waiter本身，由_abandon判断是否已分配到标签页
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(waiter.future)),
+                                          timeout=max(waiter.latest_start - time.time(), 0))
+        except QueueRejected:
+            raise
+        except asyncio.CancelledError:
+            # 客户端断开：已分配的标签页交还给下一个等待者
+            try:
+                self.release(self._abandon(waiter))
+            except QueueRejected:
+                pass
+            raise
+        except Exception:
+            return self._abandon(waiter)
+
+    def _admit(self, priority, timeout, model, client=None):
+        """有空闲标签页时返回(tab, None)，否则排队并返回(None, waiter)"""
+        rank = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        now = time.time()
+        deadline = now + (timeout or self.default_timeout)
+        latest_start = deadline - self.estimate_service()
+
+        with self.lock:
+            # 客户端已达并发上限时即使有空闲标签页也要排队，等它自己的请求结束
+            capped = client is not None and client.at_capacity()
+            tab = None if capped else self.try_acquire(model)
+            if tab:
+                return self._start(tab, client), None
+
+            # 没有空闲标签页：请求后台扩容，同时排队等待任意标签页空出
+            if not capped:
+                self.spawn()
+
+            if latest_start <= now:
+                raise QueueRejected("请求期限过短，无法按时完成", self.retry_after(len(self.waiters)), len(self.waiters) + 1)
+            if len(self.waiters) >= self.max_queue:
+                logging.warning(f"等待队列已满 ({self.max_queue})，拒绝请求")
+                raise QueueRejected("等待队列已满，请稍后再试", self.retry_after(len(self.waiters)), len(self.waiters) + 1)
+
+            waiter = Waiter(rank, deadline, latest_start, next(self.seq), client, self._tag(client))
+            heapq.heappush(self.waiters, waiter)
+            if client is not None:
+                self._reorder(client)
+            position = self.position_of(waiter)
+            logging.info(f"请求进入等待队列: 优先级={priority}, 位置={position}, 队列长度={len(self.waiters)}")
+        return None, waiter
+
+    def _tag(self, client):
+        """虚拟开始时间：客户端上一个请求的虚拟结束时间与当前虚拟时间取大者，每个请求按1/权重推进"""
+        if client is None:
+            return self.virtual_time
+        start = max(self.virtual_time, self.finish_tags.get(client.name, 0.0))
+        self.finish_tags[client.name] = start + 1 / client.weight
+        return start
+
+    def _reorder(self, client):
+        """同一客户端的请求之间仍按优先级、截止时间、到达顺序排：把它已分到的虚拟开始时间按这个顺序重新分给各请求，
+        客户端之间的份额不变（虚拟开始时间只用于在客户端之间分配）"""
+        own = [w for w in self.waiters if w.client is client and not w.future.done()]
+        if len(own) < 2:
+            return
+        tags = sorted(w.tag for w in own)
+        for waiter, tag in zip(sorted(own, key=lambda w: (w.rank, w.deadline, w.seq)), tags):
+            waiter.tag = tag
+        heapq.heapify(self.waiters)
+
+    def _abandon(self, waiter):
+        """等待超时：已被分配标签页时直接使用，否则移出队列并降载"""
+        with self.lock:
+            if waiter.future.done():
+                # 超时的同时被分配了标签页，直接使用
+                return waiter.future.result()
+            position = self.position_of(waiter)
+            self.waiters.remove(waiter)
+            heapq.heapify(self.waiters)
+            waiter.future.cancel()
+        logging.warning(f"请求在队列中等待超时，已降载: 位置={position}")
+        raise QueueRejected("系统繁忙，无法在期限内处理请求", self.retry_after(position), position)
+
+    def release(self, tab):
+        """释放标签页：有等待者时直接移交（保持加锁），否则解锁"""
+        with self.lock:
+            self._record(tab)
+            if self._handoff(tab):
+                return
+            tab.lock.release()
+
+    def offer(self, tab):
+        """新的已加锁标签页可用（如新建完成）时调用，效果同release"""
+        self.release(tab)
+
+    def _handoff(self, tab):
+        now = time.time()
+        capped = []
+        try:
+            while self.waiters:
+                waiter = heapq.heappop(self.waiters)
+                if waiter.future.done():
+                    continue
+                if waiter.latest_start <= now:
+                    # 已无法按时完成，降载
+                    waiter.future.set_exception(QueueRejected(
+                        "系统繁忙，无法在期限内处理请求", self.retry_after(len(self.waiters)), 1))
+                    continue
+                if waiter.client is not None and waiter.client.at_capacity():
+                    capped.append(waiter)
+                    continue
+                self.virtual_time = max(self.virtual_time, waiter.tag)
+                self._start(tab, waiter.client)
+                waiter.future.set_result(tab)
+                return True
+            return False
+        finally:
+            for waiter in capped:
+                heapq.heappush(self.waiters, waiter)
+
+    def _start(self, tab, client=None):
+        self.started[tab.tab_id] = time.time()
+        if client is not None:
+            self.holders[tab.tab_id] = client
+            client.active += 1
+        return tab
+
+    def _record(self, tab):
+        started = self.started.pop(tab.tab_id, None)
+        if started is None:
+            return
+        duration = time.time() - started
+        client = self.holders.pop(tab.tab_id, None)
+        if client is not None:
+            client.active -= 1
+            client.tab_seconds += duration
+        if self.avg_service is None:
+            self.avg_service = duration
+        else:
+            self.avg_service = 0.8 * self.avg_service + 0.2 * duration
+
+    def queue_length(self):
+        with self.lock:
+            return len(self.waiters)
+
+    def queued_by_client(self):
+        """客户端名称 -> 排队中的请求数"""
+        with self.lock:
+            counts = {}
+            for waiter in self.waiters:
+                if waiter.client is not None and not waiter.future.done():
+                    counts[waiter.client.name] = counts.get(waiter.client.name, 0) + 1
+            return counts
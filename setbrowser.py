@@ -3,68 +3,288 @@ from selenium.webdriver.edge.service import Service
 from selenium.webdriver.edge.service import Service as EdgeService
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
 from selenium.webdriver.edge.options import Options
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.switch_to import SwitchTo
+from selenium.webdriver.remote.mobile import Mobile
+import threading
 import time
 import json
 import os
 
 #aiapi.py配置
 MAX_TABS = 5  # 最大标签页数量，即最大线程数量
+MIN_TABS = 2  # 启动时并行预热的标签页数量
+SPAWN_WORKERS = 2  # 运行中后台并行新建标签页的线程数
+SHARED_BROWSER = False  # True时所有标签页共用一个浏览器进程，每个标签页占用其中一个窗口句柄
 PORT_RUNNING = 8000  # 运行端口
-def autoh(url):
-    
-    # 配置浏览器选项
-    options = Options()
-    options.add_argument("--start-maximized")
+MAX_QUEUE = 50  # 所有标签页都忙时的最大排队请求数
+DEFAULT_REQUEST_TIMEOUT = 180  # 客户端未指定超时（X-Request-Timeout）时的默认期限（秒）
+MODEL_MIX_WINDOW = 50  # 按最近多少个请求的模型比例预切换空闲标签页
+MODEL_PRESWITCH_INTERVAL = 10  # 空闲标签页模型预切换的检查间隔（秒）
+CONVERSATION_INDEX_SIZE = 1000  # 多轮对话续接索引最多记录的会话数
+CONVERSATION_TTL = 86400  # 续接索引条目有效期（秒）
+RESPONSE_CACHE_SIZE = 1000  # 内存中缓存的回复数量，0表示关闭回复缓存
+RESPONSE_CACHE_TTL = 3600  # 回复缓存有效期（秒）
+RESPONSE_CACHE_FILE = None  # 设为文件路径（如"response_cache.sqlite3"）时缓存同时保存到磁盘，重启后仍可命中
+UPLOAD_STAGING_DIR = None  # 待上传附件的暂存目录，None时优先使用/dev/shm，否则为系统临时目录；各实例使用其中以端口命名的子目录
+UPLOAD_STAGING_MAX_MB = 512  # 暂存目录总大小上限（MB），超出时清理最久未使用的附件
+UPLOAD_STAGING_MAX_AGE = 3600  # 附件闲置超过此时间（秒）后清理
+MAINTENANCE_INTERVAL = 30  # 标签页维护检查间隔（秒），每次最多刷新一个标签页，错开刷新时间
+MAINTENANCE_IDLE_SECONDS = 60  # 最近这么多秒内处理过请求的标签页不做维护
+REFRESH_MAX_DOM_NODES = 20000  # 页面DOM节点数超过此值时刷新
+REFRESH_MAX_HEAP_MB = 300  # 页面JS堆占用超过此值（MB）时刷新
+REFRESH_MAX_AGE = 3600  # 各项指标正常时，距上次刷新超过此时间（秒）也会刷新
+BATCH_DIR = "batches"  # 批量任务（/v1/files、/v1/batches）的输入、输出文件与进度保存目录
+IDEMPOTENCY_TTL = 600  # 带Idempotency-Key的请求完成后，相同键的重试在此时间内（秒）直接返回原结果
+ANSWER_SOURCE = "dom"  # dom: 轮询页面上渲染的回答; network: 从页面收到的聊天流中读取回答（首字更早、结束判定准确，需Edge/Chrome），没有收到聊天流时退回dom
+CHAT_STREAM_PATTERNS = ["/api/chat/"]  # network模式下识别聊天请求的URL片段
+NETWORK_STREAM_START_TIMEOUT = 10  # 发送后这么多秒内没有出现聊天流时改从页面读取（秒）
+ANSWER_MARKDOWN = True  # 非流式回复按Markdown提取（保留代码块、列表、表格和链接），并返回思考过程与搜索引用；False时为合并空白后的纯文本
+
+#API Key与各客户端的限额
+# API Key -> 限额: name 指标与日志中显示的名称; weight 标签页不足时按权重分配; rate 每秒补充的请求数（令牌桶）;
+# burst 令牌桶容量，即可突发的请求数; max_concurrency 同时占用的最多标签页数，超出的请求排队等待
+# 例如 {"sk-batch": {"name": "batch", "weight": 1, "rate": 2, "burst": 20, "max_concurrency": 2},
+#       "sk-chat": {"name": "chat", "weight": 3}}
+API_KEYS = {}
+REQUIRE_API_KEY = False  # True时拒绝未在API_KEYS中配置的Key（401）；False时未配置或未携带Key的请求共用anonymous的限额
+DEFAULT_CLIENT_LIMITS = {"weight": 1, "rate": None, "burst": None, "max_concurrency": None}  # anonymous的限额，None为不限
+
+#router.py配置（多个aiapi实例时使用）
+ROUTER_BACKENDS = ["http://127.0.0.1:8000"]  # 后端aiapi实例地址
+ROUTER_PORT = 8080  # 路由器运行端口
+ROUTER_HEALTH_INTERVAL = 2  # 轮询各后端/health的间隔（秒）
+
+#浏览器配置
+YUANBAO_URL = "https://yuanbao.tencent.com"  # 元宝网址；本地测试时可改为standin.py模拟页面的地址，如"http://127.0.0.1:8300"
+AUTOMATION_BACKEND = "selenium"  # 页面操作方式: selenium 经WebDriver驱动进程转发; cdp 直接通过DevTools协议发给浏览器（浏览器仍由Selenium启动和登录，见cdp.py）
+BROWSER = "edge"  # 使用的浏览器: edge 或 chrome（Linux下可用Chromium/Chrome）
+BROWSER_PROFILE = "desktop"  # desktop: 可见窗口，适合首次登录; server: Linux服务器无头精简模式（需先用desktop登录生成storage_state.json或cookies.json）
+STORAGE_STATE_FILE = "storage_state.json"  # 登录状态快照（cookies与localStorage），新浏览器在打开第一个页面前恢复，一次加载即进入对话页；None为关闭，只回放cookies.json
+BROWSER_PROFILE_DIR = None  # 浏览器用户数据目录，设置后登录状态与页面缓存保存在其中；同一目录同时只能被一个浏览器使用，适合SHARED_BROWSER = True
+SERVER_CACHE_SIZE = 32 * 1024 * 1024  # server模式下磁盘/媒体缓存上限（字节）
+# server模式下屏蔽的资源（只读取文本，不需要图片、字体和音视频）
+SERVER_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.mp3", "*.m4a", "*.ogg"
+]
+
+def build_options():
+    """按BROWSER与BROWSER_PROFILE生成浏览器启动参数"""
+    options = webdriver.ChromeOptions() if BROWSER == "chrome" else Options()
     options.add_argument('--ignore-certificate-errors')
     options.add_argument('--allow-insecure-localhost')
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option('useAutomationExtension', False)
+    if BROWSER_PROFILE_DIR:
+        options.add_argument(f"--user-data-dir={os.path.abspath(BROWSER_PROFILE_DIR)}")
     
-    # 创建浏览器实例
-    service = Service()
-    options = webdriver.EdgeOptions()
-    driver = webdriver.Edge(service=service, options=options)
+    if BROWSER_PROFILE != "server":
+        options.add_argument("--start-maximized")
+        return options
     
-    # 尝试加载保存的 cookies
-    cookie_file = "cookies.json"
-    if os.path.exists(cookie_file):
-        driver.get("https://yuanbao.tencent.com/login")  # 先访问一个页面以设置域
-        with open(cookie_file, "r") as f:
-            cookies = json.load(f)
+    # 无头运行，不需要X server和GPU合成
+    options.add_argument("--headless=new")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--window-size=1280,900")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    # 不加载图片
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    # 后台窗口不降频，空闲标签页保持响应
+    options.add_argument("--disable-background-timer-throttling")
+    options.add_argument("--disable-backgrounding-occluded-windows")
+    options.add_argument("--disable-renderer-backgrounding")
+    # 限制缓存并关闭用不到的功能
+    options.add_argument(f"--disk-cache-size={SERVER_CACHE_SIZE}")
+    options.add_argument(f"--media-cache-size={SERVER_CACHE_SIZE}")
+    options.add_argument("--aggressive-cache-discard")
+    options.add_argument("--mute-audio")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-features=Translate,MediaRouter,OptimizationHints")
+    return options
+
+def apply_profile(driver):
+    """server模式下通过CDP屏蔽字体、图片和音视频请求（每个窗口各自生效）"""
+    if BROWSER_PROFILE != "server":
+        return
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": SERVER_BLOCKED_URLS})
+    except Exception as e:
+        print(f"设置资源屏蔽失败: {e}")
+
+# 参数: 来源, {键: 值}；每个标签页只在第一次打开该来源的页面时写入，已有的键不覆盖
+LOCAL_STORAGE_SCRIPT = """(function(origin, items) {
+    try {
+        if (location.origin !== origin || sessionStorage.getItem('__ybStorageRestored')) {
+            return;
+        }
+        for (const [key, value] of Object.entries(items)) {
+            if (localStorage.getItem(key) === null) {
+                localStorage.setItem(key, value);
+            }
+        }
+        sessionStorage.setItem('__ybStorageRestored', '1');
+    } catch (e) {}
+})(%s, %s);"""
+
+LOCAL_STORAGE_DUMP_SCRIPT = """
+const items = {};
+for (let i = 0; i < localStorage.length; i++) {
+    const key = localStorage.key(i);
+    items[key] = localStorage.getItem(key);
+}
+return {origin: location.origin, items: items};
+"""
+
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite")
+
+_storage_state = None
+_storage_state_lock = threading.Lock()
+
+def cookie_param(cookie):
+    """把保存的cookie（Network.getAllCookies或Selenium get_cookies的格式）转换为Network.setCookies的参数"""
+    param = {key: cookie[key] for key in COOKIE_FIELDS if cookie.get(key) is not None}
+    if "domain" not in param:
+        param["url"] = YUANBAO_URL
+    expires = cookie.get("expires", cookie.get("expiry"))
+    if expires is not None and expires > 0 and not cookie.get("session"):
+        param["expires"] = expires
+    return param
+
+def load_storage_state():
+    """读取登录状态快照，进程内所有浏览器共用一份；没有快照时退回cookies.json（只有cookies），都没有时返回None"""
+    global _storage_state
+    with _storage_state_lock:
+        if _storage_state is None:
+            try:
+                if STORAGE_STATE_FILE and os.path.exists(STORAGE_STATE_FILE):
+                    with open(STORAGE_STATE_FILE, "r", encoding="utf-8") as f:
+                        _storage_state = json.load(f)
+                elif os.path.exists("cookies.json"):
+                    with open("cookies.json", "r") as f:
+                        _storage_state = {"cookies": json.load(f), "origins": []}
+            except (OSError, ValueError) as e:
+                print(f"读取登录状态失败: {e}")
+        return _storage_state
+
+def restore_storage_state(driver, state):
+    """在打开第一个页面之前恢复cookies，并注入在页面脚本之前写入localStorage的脚本；浏览器不支持CDP时返回False"""
+    cookies = [cookie_param(cookie) for cookie in state.get("cookies", [])]
+    try:
+        try:
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+        except Exception:
+            # 整批设置时一个无效的cookie会导致全部失败，改为逐个设置；全部失败说明浏览器不支持
+            errors = []
             for cookie in cookies:
-                # 跳过无效的cookie属性
-                if 'expiry' in cookie and isinstance(cookie['expiry'], float):
-                    cookie['expiry'] = int(cookie['expiry'])
-                # 添加cookie到浏览器
                 try:
-                    driver.add_cookie(cookie)
+                    driver.execute_cdp_cmd("Network.setCookie", cookie)
                 except Exception as e:
-                    print(f"添加cookie失败: {e}")
-        # 刷新页面以应用cookie
-        driver.refresh()
+                    errors.append(e)
+            if errors and len(errors) == len(cookies):
+                raise errors[0]
+            for e in errors:
+                print(f"添加cookie失败: {e}")
+        for origin in state.get("origins", []):
+            if origin.get("localStorage"):
+                source = LOCAL_STORAGE_SCRIPT % (json.dumps(origin["origin"]), json.dumps(origin["localStorage"]))
+                driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": source})
+        return True
+    except Exception as e:
+        print(f"恢复登录状态失败: {e}")
+        return False
+
+def save_storage_state(driver):
+    """保存浏览器的全部cookies与当前页面来源的localStorage，之后启动的浏览器直接恢复；先写临时文件再替换，读到的总是完整快照"""
+    global _storage_state
+    if not STORAGE_STATE_FILE:
+        return
+    try:
+        try:
+            cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        except Exception:
+            cookies = driver.get_cookies()
+        if not cookies:
+            return
+        local = driver.execute_script(LOCAL_STORAGE_DUMP_SCRIPT)
+        with _storage_state_lock:
+            origins = [o for o in (_storage_state or {}).get("origins", []) if o.get("origin") != local["origin"]]
+            origins.append({"origin": local["origin"], "localStorage": local["items"]})
+            state = {"cookies": cookies, "origins": origins, "saved_at": time.time()}
+            temp_file = f"{STORAGE_STATE_FILE}.{os.getpid()}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, STORAGE_STATE_FILE)
+            _storage_state = state
+    except Exception as e:
+        print(f"保存登录状态失败: {e}")
+
+def is_logged_in(driver):
+    """检查是否已经登录成功"""
+    try:
+        # 检查是否存在登录后才会显示的元素
+        # 例如：检查是否存在聊天输入框、用户头像等登录后才有的元素
+        # 或者检查URL是否已经跳转到登录后的页面
+        current_url = driver.current_url
+        if "login" not in current_url.lower():
+            # 检查页面中是否存在聊天相关元素
+            driver.find_element(by="css selector", value=".agent-chat__bubble__content")
+            return True
+        return False
+    except Exception as e:
+        print(f"检查登录状态失败: {e}")
+        return False
+
+def autoh(url, prepare=None):
+    """启动浏览器并登录，返回停在url页面的驱动；prepare(driver)在打开第一个页面之前调用"""
     
-    # 访问目标 URL
-    driver.get(url)
+    # 配置浏览器选项
+    options = build_options()
     
-    # 检查是否需要登录
-    def is_logged_in():
-        """检查是否已经登录成功"""
-        try:
-            # 检查是否存在登录后才会显示的元素
-            # 例如：检查是否存在聊天输入框、用户头像等登录后才有的元素
-            # 或者检查URL是否已经跳转到登录后的页面
-            current_url = driver.current_url
-            if "login" not in current_url.lower():
-                # 检查页面中是否存在聊天相关元素
-                driver.find_element(by="css selector", value=".agent-chat__bubble__content")
-                return True
-            return False
-        except Exception as e:
-            print(f"检查登录状态失败: {e}")
-            return False
+    # 创建浏览器实例
+    if BROWSER == "chrome":
+        driver = webdriver.Chrome(options=options)
+    else:
+        service = Service()
+        driver = webdriver.Edge(service=service, options=options)
+    apply_profile(driver)
+    if prepare:
+        prepare(driver)
+    
+    cookie_file = "cookies.json"
+    state = load_storage_state()
+    if state and restore_storage_state(driver, state):
+        # 登录状态已在打开页面之前恢复，一次加载即可进入对话页
+        driver.get(url)
+    else:
+        # 不支持CDP的浏览器：先访问页面设置域，再逐个添加cookies并刷新
+        if os.path.exists(cookie_file):
+            driver.get(f"{YUANBAO_URL}/login")  # 先访问一个页面以设置域
+            with open(cookie_file, "r") as f:
+                cookies = json.load(f)
+                for cookie in cookies:
+                    # 跳过无效的cookie属性
+                    if 'expiry' in cookie and isinstance(cookie['expiry'], float):
+                        cookie['expiry'] = int(cookie['expiry'])
+                    # 添加cookie到浏览器
+                    try:
+                        driver.add_cookie(cookie)
+                    except Exception as e:
+                        print(f"添加cookie失败: {e}")
+            # 刷新页面以应用cookie
+            driver.refresh()
+        
+        # 访问目标 URL
+        driver.get(url)
     
     # 检查登录状态
-    if not is_logged_in():
+    if not is_logged_in(driver):
+        if BROWSER_PROFILE == "server":
+            print("无头模式下无法手动登录，请先将BROWSER_PROFILE设为desktop运行一次以生成storage_state.json或cookies.json")
         print("需要登录，请手动完成登录...")
         input("登录完成后按回车键继续...")
         
@@ -77,6 +297,90 @@ def autoh(url):
         else:
             print("未获取到有效的cookies")
     else:
-        print("已登录，使用保存的cookies")
+        print("已登录，使用保存的登录状态")
+    # 每次登录成功后更新快照，服务端续期的cookies也能带给之后启动的浏览器
+    save_storage_state(driver)
     
     return driver
+
+class WindowDriverMixin:
+    """共享浏览器中单个窗口的驱动：每条命令执行前切换到自己的窗口句柄，并与其他窗口串行执行"""
+    def execute(self, driver_command, params=None):
+        with self._shared_browser.lock:
+            if self._shared_browser.current_handle != self._window_handle:
+                super().execute(Command.SWITCH_TO_WINDOW, {"handle": self._window_handle})
+                self._shared_browser.current_handle = self._window_handle
+            return super().execute(driver_command, params)
+
+    def quit(self):
+        """只关闭自己的窗口，不结束整个浏览器"""
+        self._shared_browser.close_window(self)
+
+class SharedBrowser:
+    """一个浏览器/驱动进程承载多个窗口，供多个标签页复用"""
+    def __init__(self, url, prepare=None):
+        self.url = url
+        self.lock = threading.RLock()
+        self.driver = autoh(url, prepare)
+        self.current_handle = self.driver.current_window_handle
+        # autoh打开的第一个窗口留给第一个标签页使用
+        self.free_handles = [self.current_handle]
+        self.windows = 0
+        self.window_driver_cls = type('WindowDriver', (WindowDriverMixin, type(self.driver)), {})
+
+    def is_alive(self):
+        try:
+            with self.lock:
+                self.driver.window_handles
+            return True
+        except Exception:
+            return False
+
+    def open_window(self, prepare=None):
+        """返回一个绑定到新窗口的驱动对象，接口与普通WebDriver一致；prepare(driver)在新窗口打开页面之前调用"""
+        with self.lock:
+            if self.free_handles:
+                handle = self.free_handles.pop()
+                self.driver.switch_to.window(handle)
+            else:
+                self.driver.switch_to.new_window('tab')
+                handle = self.driver.current_window_handle
+                apply_profile(self.driver)
+                if prepare:
+                    prepare(self.driver)
+                self.driver.get(self.url)
+            self.current_handle = handle
+            self.windows += 1
+
+            window_driver = object.__new__(self.window_driver_cls)
+            window_driver.__dict__.update(self.driver.__dict__)
+            # 这些辅助对象持有驱动引用，需要重新绑定到窗口驱动上
+            window_driver._switch_to = SwitchTo(window_driver)
+            window_driver._mobile = Mobile(window_driver)
+            window_driver._shared_browser = self
+            window_driver._window_handle = handle
+            return window_driver
+
+    def close_window(self, window_driver):
+        with self.lock:
+            self.windows -= 1
+            try:
+                if self.windows <= 0:
+                    # 最后一个窗口关闭时结束整个浏览器
+                    self.driver.quit()
+                    return
+                self.driver.switch_to.window(window_driver._window_handle)
+                self.driver.close()
+            finally:
+                self.current_handle = None
+
+_shared_browser = None
+_shared_browser_lock = threading.Lock()
+
+def open_shared_window(url, prepare=None):
+    """SHARED_BROWSER模式下获取共享浏览器中的一个新窗口，浏览器不可用时重新启动；prepare见autoh"""
+    global _shared_browser
+    with _shared_browser_lock:
+        if _shared_browser is None or not _shared_browser.is_alive():
+            _shared_browser = SharedBrowser(url, prepare)
+        return _shared_browser.open_window(prepare)
@@ -0,0 +1,155 @@
+# staging.py
+import base64
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# data URL的MIME类型 -> 扩展名，用于没有文件名的图片
+MIME_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp"
+}
+
+def default_root():
+    """优先放在内存文件系统(/dev/shm)上，没有时用系统临时目录"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "yuanbao_uploads")
+
+def sanitize_filename(filename, default="file"):
+    """只保留文件名本身，去掉路径和不安全字符"""
+    name = os.path.basename(str(filename or "").replace("\\", "/"))
+    name = re.sub(r'[^\w.\- ]', '_', name).strip(' .')
+    if not name:
+        return default
+    stem, ext = os.path.splitext(name)
+    return stem[:100] + ext[:20]
+
+class UploadStaging:
+    """按内容哈希存放待上传的附件：相同内容只解码写盘一次，跨请求复用，按总大小和闲置时间清理
+
+    同一台机器上的多个实例按instance（端口）各用root下的一个子目录，扫描和清理都只涉及自己的子目录，
+    不会删掉其他实例正在上传的附件"""
+    def __init__(self, root=None, max_bytes=512 * 1024 * 1024, max_age=3600, instance=None):
+        self.root = root or default_root()
+        if instance is not None:
+            self.root = os.path.join(self.root, str(instance))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = {}  # 路径 -> [大小, 最近使用时间]
+        self.pinned = {}  # 路径 -> 正在上传的引用数，清理时跳过
+        self.last_collect = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    @contextmanager
+    def staged(self, data, filename=None):
+        """返回附件的本地路径，with块内不会被清理"""
+        path = self.stage(data, filename)
+        try:
+            yield path
+        finally:
+            with self.lock:
+                self.pinned[path] -= 1
+                if not self.pinned[path]:
+                    del self.pinned[path]
+
+    def stage(self, data, filename=None):
+        """data为base64字符串或data URL；返回已加引用的路径，调用方需配合staged()释放"""
+        mime = None
+        if isinstance(data, str) and data.startswith('data:') and ',' in data:
+            header, data = data.split(',', 1)
+            mime = header[5:].split(';', 1)[0].lower()
+        # 直接对编码后的内容取哈希，已存在时无需再解码
+        digest = hashlib.sha256(data.encode('utf-8') if isinstance(data, str) else data).hexdigest()
+        name = sanitize_filename(filename, "file" + MIME_EXTENSIONS.get(mime, ""))
+        path = os.path.join(self.root, digest[:32], name)
+
+        with self.lock:
+            self.pinned[path] = self.pinned.get(path, 0) + 1
+            entry = self.entries.get(path)
+            if entry and os.path.exists(path):
+                entry[1] = time.time()
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+
+        try:
+            content = base64.b64decode(data)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，并发写入同一内容时也不会读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".staging-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            with self.lock:
+                self.pinned[path] -= 1
+                if not self.pinned[path]:
+                    del self.pinned[path]
+            raise
+
+        with self.lock:
+            self.entries[path] = [len(content), time.time()]
+            if self._total() > self.max_bytes or time.time() - self.last_collect > 60:
+                self._collect()
+        return path
+
+    def collect(self):
+        with self.lock:
+            self._collect()
+
+    def stats(self):
+        with self.lock:
+            return {"files": len(self.entries), "bytes": self._total(), "in_use": len(self.pinned)}
+
+    def _total(self):
+        return sum(size for size, _ in self.entries.values())
+
+    def _collect(self):
+        now = time.time()
+        self.last_collect = now
+        # 先清理闲置过久的，再按最近使用时间从旧到新清理到总大小以内
+        candidates = sorted((used, path) for path, (size, used) in self.entries.items() if path not in self.pinned)
+        total = self._total()
+        for used, path in candidates:
+            if now - used <= self.max_age and total <= self.max_bytes:
+                break
+            total -= self.entries[path][0]
+            self._remove(path)
+
+    def _remove(self, path):
+        del self.entries[path]
+        try:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            # 目录里还有同内容的其他文件名
+            pass
+
+    def _scan(self):
+        """重启后接管目录中已有的文件"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if filename.startswith(".staging-"):
+                        os.remove(path)
+                        continue
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                self.entries[path] = [st.st_size, st.st_mtime]
+        if self.entries:
+            logging.info(f"上传暂存目录 {self.root} 已有 {len(self.entries)} 个文件")
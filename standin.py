@@ -0,0 +1,507 @@
+# standin.py
+"""本地模拟的元宝页面，用于在不访问真实网站的情况下测试和压测
+
+页面实现了aiapi.py依赖的DOM约定：.ql-editor输入框（带Quill接口）、#yuanbao-send-btn发送按钮（生成中带stop类）、
+.agent-chat__bubble__content消息气泡（回答与元宝一样由fetch以SSE流式返回，按设定速率逐字输出）、回答工具栏、模型下拉框、带dt-cid的会话列表和上传输入框。
+会话内容保存在服务端内存中，多个标签页之间可以续接同一会话。
+
+用法: python standin.py [--port 8300] [--token-rate 30] [--answer-tokens 300] [--first-token-delay 0.8]
+然后在setbrowser.py中把YUANBAO_URL设为 http://127.0.0.1:8300 再启动aiapi.py
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+DEFAULT_CONFIG = {
+    "token_rate": 30,  # 每秒输出的词数
+    "answer_tokens": 300,  # 每个回答的词数（不含开头对问题的复述）
+    "first_token_delay": 0.8,  # 发送后到第一个字出现的时间（秒）
+    "upload_delay": 0.3  # 附件处于上传中状态的时间（秒）
+}
+
+PAGE_HTML = r"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>元宝（本地模拟）</title>
+<style>
+body { margin: 0; display: flex; height: 100vh; font-family: sans-serif; }
+.sidebar { width: 220px; border-right: 1px solid #ddd; overflow: auto; }
+.yb-tencent-yuanbao-list__item { padding: 10px; cursor: pointer; border-bottom: 1px solid #eee; }
+.yb-recent-conv-list__item { padding: 6px 10px; cursor: pointer; white-space: nowrap; overflow: hidden; }
+.yb-recent-conv-list__item.active { background: #e0ecff; }
+.main { flex: 1; display: flex; flex-direction: column; min-width: 0; }
+.header { padding: 8px; border-bottom: 1px solid #eee; position: relative; }
+[dt-button-id='model_switch'] { display: inline-block; cursor: pointer; padding: 4px 8px; border: 1px solid #ccc; }
+.model-dropdown { display: none; position: absolute; background: #fff; border: 1px solid #ccc; z-index: 1; }
+.model-dropdown.open { display: block; }
+.ybc-model-select-dropdown-item-name { padding: 6px 12px; cursor: pointer; }
+.chat { flex: 1; overflow: auto; padding: 12px; }
+.agent-chat__bubble__content { margin: 8px 0; padding: 8px; border-radius: 6px; background: #f4f4f4; }
+.bubble-user .agent-chat__bubble__content { background: #dbeafe; }
+.hyc-component-reasoner__think { color: #888; border-left: 3px solid #ccc; padding-left: 8px; }
+.agent-chat__toolbar { font-size: 12px; color: #888; }
+.input-area { border-top: 1px solid #ddd; padding: 8px; }
+.ql-editor { min-height: 40px; border: 1px solid #ccc; padding: 6px; }
+.ql-editor p { margin: 0; }
+.upload-icon { cursor: pointer; margin-right: 8px; }
+.upload-file-item, .upload-image-item { display: inline-block; margin: 2px; padding: 2px 6px; background: #eee; }
+</style>
+</head>
+<body>
+<div class="sidebar">
+    <div class="yb-tencent-yuanbao-list__item"><span class="yb-tencent-yuanbao-list__logo">新建对话</span></div>
+    <div class="yb-recent-conv-list" id="conv-list"></div>
+</div>
+<div class="main">
+    <div class="header">
+        <div dt-button-id="model_switch" dt-mod-id="main_mod" id="model-switch">Hunyuan</div>
+        <div class="model-dropdown" id="model-dropdown">
+            <div class="ybc-model-select-dropdown-item-name" data-model="hunyuan">Hunyuan T1</div>
+            <div class="ybc-model-select-dropdown-item-name" data-model="deepseek">DeepSeek R1</div>
+        </div>
+    </div>
+    <div class="chat" id="chat"></div>
+    <div class="input-area">
+        <div id="upload-list"></div>
+        <div class="ql-container" id="editor-container">
+            <div class="ql-editor ql-blank" contenteditable="true"></div>
+        </div>
+        <span class="upload-icon">上传</span>
+        <input type="file" id="image-input" multiple style="display: none" accept="capture=filesystem,.jpg,.jpeg,.png,.webp,.bmp,.gif">
+        <input type="file" id="file-input" multiple style="display: none" accept="capture=filesystem,,.pdf,.xls,.xlsx,.ppt,.pptx,.doc,.docx,.txt,.csv,.text,.bat,.c,.cpp,.cs,.css,.go,.h,.hpp,.ini,.java,.js,.json,.log,.lua,.md,.php,.pl,.py,.rb,.sh,.sql,.swift,.tex,.toml,.vue,.yaml,.yml,.xml,.html">
+        <button id="yuanbao-send-btn">发送</button>
+    </div>
+</div>
+<script>
+const CONFIG = __CONFIG__;
+const chat = document.getElementById('chat');
+const editor = document.querySelector('.ql-editor');
+const sendButton = document.getElementById('yuanbao-send-btn');
+const modelSwitch = document.getElementById('model-switch');
+const modelDropdown = document.getElementById('model-dropdown');
+const convList = document.getElementById('conv-list');
+const uploadList = document.getElementById('upload-list');
+let model = 'hunyuan';
+let currentCid = null;
+let messages = [];
+let generating = false;
+
+function updateBlank() {
+    editor.classList.toggle('ql-blank', !editor.textContent.trim());
+}
+editor.addEventListener('input', updateBlank);
+
+// 与Quill编辑器相同的接口，供aiapi的快速输入使用
+document.getElementById('editor-container').__quill = {
+    setText(text) {
+        editor.textContent = '';
+        for (const line of text.replace(/\n$/, '').split('\n')) {
+            const p = document.createElement('p');
+            if (line) {
+                p.textContent = line;
+            } else {
+                p.appendChild(document.createElement('br'));
+            }
+            editor.appendChild(p);
+        }
+        updateBlank();
+    },
+    getText() {
+        return editorText() + '\n';
+    },
+    getLength() {
+        return this.getText().length;
+    },
+    setSelection() {}
+};
+
+function editorText() {
+    const lines = Array.from(editor.children);
+    if (lines.length && lines.every(line => line.tagName === 'P')) {
+        return lines.map(line => line.textContent).join('\n');
+    }
+    return editor.innerText.replace(/\n$/, '');
+}
+
+function showGreeting() {
+    chat.innerHTML = '<div class="agent-chat__conv--agent-homepage-v2__greeting">' +
+        '<div class="agent-chat__bubble__content">你好，我是元宝（本地模拟页面）</div></div>';
+}
+
+function addBubble(role, text) {
+    const wrapper = document.createElement('div');
+    wrapper.className = 'bubble-' + role;
+    const bubble = document.createElement('div');
+    bubble.className = 'agent-chat__bubble__content';
+    if (role === 'user') {
+        bubble.textContent = text;
+    } else {
+        const markdown = document.createElement('div');
+        markdown.className = 'hyc-common-markdown';
+        for (const paragraph of text.split('\n\n')) {
+            const p = document.createElement('p');
+            p.textContent = paragraph;
+            markdown.appendChild(p);
+        }
+        bubble.appendChild(markdown);
+    }
+    wrapper.appendChild(bubble);
+    chat.appendChild(wrapper);
+    chat.scrollTop = chat.scrollHeight;
+    return wrapper;
+}
+
+function addToolbar(wrapper) {
+    const toolbar = document.createElement('div');
+    toolbar.className = 'agent-chat__toolbar';
+    toolbar.innerHTML = '<span class="agent-chat__toolbar__copy" dt-button-id="copy_answer">复制</span>';
+    wrapper.appendChild(toolbar);
+}
+
+function setActive(cid) {
+    for (const item of convList.children) {
+        item.classList.toggle('active', item.getAttribute('dt-cid') === cid);
+    }
+}
+
+function addConversationItem(cid, title) {
+    const item = document.createElement('div');
+    item.className = 'yb-recent-conv-list__item';
+    item.setAttribute('dt-cid', cid);
+    item.textContent = title;
+    item.addEventListener('click', () => openConversation(cid));
+    convList.prepend(item);
+}
+
+function loadConversations() {
+    // 只补充列表中还没有的会话（可能由其他标签页创建），不重建已有元素
+    return fetch('/api/conversations').then(r => r.json()).then(list => {
+        const known = new Set(Array.from(convList.children, item => item.getAttribute('dt-cid')));
+        for (const conv of list.reverse()) {
+            if (!known.has(conv.cid)) {
+                addConversationItem(conv.cid, conv.title);
+            }
+        }
+        setActive(currentCid);
+    });
+}
+
+function openConversation(cid) {
+    if (generating) {
+        return;
+    }
+    fetch('/api/conversations/' + cid).then(r => r.json()).then(conv => {
+        chat.innerHTML = '';
+        messages = conv.messages;
+        for (const message of messages) {
+            const wrapper = addBubble(message.role, message.text);
+            if (message.role === 'ai') {
+                addToolbar(wrapper);
+            }
+        }
+        currentCid = cid;
+        setActive(cid);
+    });
+}
+
+// 与元宝相同，回答通过fetch以SSE流式返回：data: {"type": "text", "msg": ...}，深度思考为 {"type": "think", "content": ...}
+function generate(prompt) {
+    generating = true;
+    sendButton.classList.add('send-btn--stop', 'stop');
+    const wrapper = addBubble('ai', '');
+    const bubble = wrapper.querySelector('.agent-chat__bubble__content');
+    const markdown = bubble.querySelector('.hyc-common-markdown');
+    let paragraph = markdown.lastChild;
+    let think = null;
+    let text = '';
+
+    function handle(data) {
+        let chunk;
+        try {
+            chunk = JSON.parse(data);
+        } catch (e) {
+            return;  // [DONE]、[plugin: ...]等非JSON行
+        }
+        if (chunk.type === 'think') {
+            if (!think) {
+                think = document.createElement('div');
+                think.className = 'hyc-component-reasoner__think';
+                bubble.insertBefore(think, markdown);
+            }
+            think.textContent += chunk.content;
+        } else if (chunk.type === 'text') {
+            chunk.msg.split('\n\n').forEach((part, i) => {
+                if (i > 0) {
+                    paragraph = document.createElement('p');
+                    markdown.appendChild(paragraph);
+                }
+                paragraph.textContent += part;
+            });
+            text += chunk.msg;
+            chat.scrollTop = chat.scrollHeight;
+        }
+    }
+
+    fetch('/api/chat/' + currentCid, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({prompt: prompt, model: model})
+    }).then(response => {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        const pump = () => reader.read().then(({done, value}) => {
+            buffer += done ? decoder.decode() : decoder.decode(value, {stream: true});
+            const lines = buffer.split('\n');
+            buffer = done ? '' : lines.pop();
+            for (const line of lines) {
+                if (line.startsWith('data: ')) {
+                    handle(line.slice(6));
+                }
+            }
+            if (done) {
+                finish(wrapper, text);
+                return;
+            }
+            return pump();
+        });
+        return pump();
+    }).catch(() => finish(wrapper, text));
+}
+
+function finish(wrapper, text) {
+    generating = false;
+    sendButton.classList.remove('send-btn--stop', 'stop');
+    addToolbar(wrapper);
+    messages.push({role: 'ai', text: text});
+    fetch('/api/conversations/' + currentCid, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({title: messages[0].text.slice(0, 20), messages: messages})
+    });
+}
+
+sendButton.addEventListener('click', () => {
+    const text = editorText().trim();
+    if (generating || !text) {
+        return;
+    }
+    document.getElementById('editor-container').__quill.setText('');
+    uploadList.innerHTML = '';
+    const greeting = chat.querySelector('.agent-chat__conv--agent-homepage-v2__greeting');
+    if (greeting) {
+        greeting.remove();
+    }
+    if (!currentCid) {
+        currentCid = Array.from(crypto.getRandomValues(new Uint8Array(8)), b => b.toString(16).padStart(2, '0')).join('');
+        messages = [];
+        addConversationItem(currentCid, text.slice(0, 20));
+    }
+    setActive(currentCid);
+    messages.push({role: 'user', text: text});
+    addBubble('user', text);
+    generate(text);
+});
+
+document.querySelector('.yb-tencent-yuanbao-list__logo').addEventListener('click', () => {
+    if (generating) {
+        return;
+    }
+    currentCid = null;
+    messages = [];
+    showGreeting();
+    setActive(null);
+});
+
+modelSwitch.addEventListener('click', () => modelDropdown.classList.toggle('open'));
+for (const option of modelDropdown.children) {
+    option.addEventListener('click', () => {
+        model = option.dataset.model;
+        modelSwitch.textContent = model === 'deepseek' ? 'DeepSeek' : 'Hunyuan';
+        modelDropdown.classList.remove('open');
+    });
+}
+
+for (const input of [document.getElementById('image-input'), document.getElementById('file-input')]) {
+    input.addEventListener('change', () => {
+        for (const file of input.files) {
+            const item = document.createElement('span');
+            item.className = (input.id === 'image-input' ? 'upload-image-item' : 'upload-file-item') + ' uploading';
+            item.textContent = file.name;
+            uploadList.appendChild(item);
+            setTimeout(() => item.classList.remove('uploading'), CONFIG.upload_delay * 1000);
+        }
+        input.value = '';
+    });
+}
+
+showGreeting();
+loadConversations();
+setInterval(loadConversations, 3000);
+</script>
+</body>
+</html>
+"""
+
+WORDS = ["我们", "可以", "这个", "问题", "首先", "然后", "因此", "需要", "考虑", "方法", "结果", "数据",
+         "分析", "模型", "系统", "用户", "性能", "优化", "the", "answer", "is", "simple", "，", "。"]
+THINKING = ["先", "理解", "问题", "，", "再", "组织", "回答", "。"]
+
+def answer_tokens(prompt, count):
+    """模拟回答：开头复述问题（便于压测时核对回答对应的请求），其后为按问题确定的随机词，每60词分一段"""
+    tokens = ["收到：", re.sub(r"\s+", " ", prompt)[:40], "。", "\n\n"]
+    rng = random.Random(prompt)
+    for i in range(count):
+        tokens.append(rng.choice(WORDS))
+        if i % 60 == 59:
+            tokens.append("\n\n")
+    return tokens
+
+class Conversations:
+    """会话ID -> {"title", "messages", "updated"}，所有标签页共用"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def list(self):
+        with self.lock:
+            items = sorted(self.items.items(), key=lambda item: item[1]["updated"], reverse=True)
+            return [{"cid": cid, "title": conv["title"]} for cid, conv in items[:200]]
+
+    def get(self, cid):
+        with self.lock:
+            return self.items.get(cid)
+
+    def put(self, cid, title, messages):
+        with self.lock:
+            self.items[cid] = {"title": title, "messages": messages, "updated": time.time()}
+
+def make_handler(config, conversations):
+    page = PAGE_HTML.replace("__CONFIG__", json.dumps(config)).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/login":
+                # 模拟已登录：登录页直接跳转到对话页
+                self.send_response(302)
+                self.send_header("Location", "/chat")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            elif path == "/" or path.startswith("/chat"):
+                self.reply(200, page, "text/html; charset=utf-8")
+            elif path == "/api/conversations":
+                self.reply_json(200, conversations.list())
+            elif path.startswith("/api/conversations/"):
+                conv = conversations.get(path.rsplit("/", 1)[1])
+                self.reply_json(200 if conv else 404, conv or {"messages": []})
+            else:
+                self.reply_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            if not path.startswith(("/api/conversations/", "/api/chat/")):
+                self.reply_json(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self.reply_json(400, {"error": "invalid json"})
+                return
+            if path.startswith("/api/chat/"):
+                try:
+                    self.stream_answer(body.get("prompt", ""), body.get("model", "hunyuan"))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 页面刷新或关闭时中断
+                return
+            conversations.put(path.rsplit("/", 1)[1], body.get("title", ""), body.get("messages", []))
+            self.reply_json(200, {"ok": True})
+
+        def stream_answer(self, prompt, model):
+            """按设定的首字延迟和速率以SSE逐词输出，格式与元宝的聊天流相同"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(*events):
+                data = "".join(f"data: {event}\n\n" for event in events).encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            # 与元宝一样，流中夹有非JSON的插件行，解析方需要忽略
+            write("[plugin: ]")
+            time.sleep(config["first_token_delay"])
+            events = []
+            if model == "deepseek":
+                events += [json.dumps({"type": "think", "content": token}, ensure_ascii=False) for token in THINKING]
+            events += [json.dumps({"type": "text", "msg": token}, ensure_ascii=False)
+                       for token in answer_tokens(prompt, config["answer_tokens"])]
+            # 每50毫秒写出一批，累计数量跟随设定速率
+            start = time.monotonic()
+            sent = 0
+            while sent < len(events):
+                target = min(len(events), int((time.monotonic() - start) * config["token_rate"]) + 1)
+                write(*events[sent:target])
+                sent = target
+                time.sleep(0.05)
+            write("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def reply_json(self, status, data):
+            self.reply(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+        def reply(self, status, content, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            logging.debug("standin: " + format % args)
+
+    return Handler
+
+def make_server(host="127.0.0.1", port=8300, **config):
+    """返回未启动的服务器，config覆盖DEFAULT_CONFIG中的项"""
+    server = ThreadingHTTPServer((host, port), make_handler(dict(DEFAULT_CONFIG, **config), Conversations()))
+    server.daemon_threads = True
+    return server
+
+def serve_in_thread(host="127.0.0.1", port=0, **config):
+    """在后台线程中运行，返回(server, 页面地址)；port为0时自动选择空闲端口"""
+    server = make_server(host, port, **config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地模拟的元宝页面")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--token-rate", type=float, default=DEFAULT_CONFIG["token_rate"], help="每秒输出的词数")
+    parser.add_argument("--answer-tokens", type=int, default=DEFAULT_CONFIG["answer_tokens"], help="每个回答的词数")
+    parser.add_argument("--first-token-delay", type=float, default=DEFAULT_CONFIG["first_token_delay"], help="首字延迟（秒）")
+    parser.add_argument("--upload-delay", type=float, default=DEFAULT_CONFIG["upload_delay"], help="附件上传耗时（秒）")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = make_server(args.host, args.port, token_rate=args.token_rate, answer_tokens=args.answer_tokens,
+                         first_token_delay=args.first_token_delay, upload_delay=args.upload_delay)
+    print(f"模拟页面: http://{args.host}:{args.port}/chat （setbrowser.py中设置 YUANBAO_URL = \"http://{args.host}:{args.port}\"）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
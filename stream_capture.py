@@ -0,0 +1,191 @@
+# stream_capture.py
+"""从页面收到的聊天流中读取回答：在每个文档加载前注入脚本，复制页面自己发出的聊天请求（fetch/EventSource）的响应流，
+按元宝的SSE格式解析出回答与思考过程。得到的是模型输出的原文，流结束即回答结束，首字也比等DOM渲染更早"""
+import json
+import time
+
+# 参数: 聊天请求URL中包含的片段列表
+# 每条匹配的请求记为一个流 {id, text, thinking, done: 收到[DONE], closed: 响应已结束, error}，只保留最近20条
+CAPTURE_FUNCTION = r"""function(patterns) {
+    if (window.__ybCapture) {
+        return;
+    }
+    const capture = window.__ybCapture = {seq: 0, streams: []};
+    const matches = url => patterns.some(pattern => String(url).indexOf(pattern) !== -1);
+
+    function open(url) {
+        const stream = {id: ++capture.seq, url: String(url), text: '', thinking: '', done: false, closed: false, error: null, buffer: ''};
+        capture.streams.push(stream);
+        if (capture.streams.length > 20) {
+            capture.streams.shift();
+        }
+        return stream;
+    }
+
+    // 元宝的聊天流: data: {"type": "text", "msg": ...}、{"type": "think", "content": ...}，以data: [DONE]结束，夹有非JSON的插件行
+    function payload(stream, data) {
+        if (data === '[DONE]') {
+            stream.done = true;
+            return;
+        }
+        let chunk;
+        try {
+            chunk = JSON.parse(data);
+        } catch (e) {
+            return;
+        }
+        if (!chunk || typeof chunk !== 'object') {
+            return;
+        }
+        if (chunk.type === 'text' && typeof chunk.msg === 'string') {
+            stream.text += chunk.msg;
+        } else if (chunk.type === 'think' && typeof chunk.content === 'string') {
+            stream.thinking += chunk.content;
+        }
+    }
+
+    function feed(stream, text, end) {
+        stream.buffer += text;
+        const lines = stream.buffer.split(/\r?\n/);
+        stream.buffer = end ? '' : lines.pop();
+        for (const line of lines) {
+            if (line.startsWith('data:')) {
+                payload(stream, line.slice(5).replace(/^ /, ''));
+            }
+        }
+    }
+
+    const originalFetch = window.fetch;
+    window.fetch = function(input, init) {
+        const promise = originalFetch.apply(this, arguments);
+        const url = input && input.url ? input.url : input;
+        if (!matches(url)) {
+            return promise;
+        }
+        const stream = open(url);
+        // 在页面读取响应之前复制一份，页面拿到的仍是原响应
+        promise.then(response => {
+            if (!response.ok || !response.body) {
+                stream.error = 'HTTP ' + response.status;
+                stream.closed = true;
+                return;
+            }
+            const reader = response.clone().body.getReader();
+            const decoder = new TextDecoder();
+            const pump = () => reader.read().then(({done, value}) => {
+                if (done) {
+                    feed(stream, decoder.decode(), true);
+                    stream.closed = true;
+                    return;
+                }
+                feed(stream, decoder.decode(value, {stream: true}), false);
+                return pump();
+            });
+            return pump();
+        }).catch(error => {
+            stream.error = String(error);
+            stream.closed = true;
+        });
+        return promise;
+    };
+
+    const OriginalEventSource = window.EventSource;
+    if (OriginalEventSource) {
+        const CapturingEventSource = function(url, options) {
+            const source = new OriginalEventSource(url, options);
+            if (matches(url)) {
+                const stream = open(url);
+                source.addEventListener('message', event => payload(stream, event.data));
+                source.addEventListener('error', () => {
+                    stream.closed = true;
+                });
+            }
+            return source;
+        };
+        CapturingEventSource.prototype = OriginalEventSource.prototype;
+        for (const name of ['CONNECTING', 'OPEN', 'CLOSED']) {
+            CapturingEventSource[name] = OriginalEventSource[name];
+        }
+        window.EventSource = CapturingEventSource;
+    }
+}"""
+
+# 参数: 发送前的流序号, 已读取的回答长度, 已读取的思考过程长度（均为页面中的字符串长度）
+# 返回发送后第一条聊天流的新增部分与状态；页面中没有捕获脚本时返回null
+# 只有收到[DONE]才算完整结束，响应在此之前关闭视为中断
+POLL_SCRIPT = """
+const [baseline, textOffset, thinkingOffset] = arguments;
+const capture = window.__ybCapture;
+if (!capture) {
+    return null;
+}
+const stream = capture.streams.find(s => s.id > baseline);
+if (!stream) {
+    return {started: false};
+}
+return {
+    started: true,
+    text: stream.text.slice(textOffset),
+    text_length: stream.text.length,
+    thinking: stream.thinking.slice(thinkingOffset),
+    thinking_length: stream.thinking.length,
+    finished: stream.done,
+    error: stream.error || (stream.closed && !stream.done ? '聊天流在[DONE]之前结束' : null)
+};
+"""
+
+BASELINE_SCRIPT = "return window.__ybCapture ? window.__ybCapture.seq : null;"
+
+def install_capture(driver, patterns):
+    """让该标签页之后加载的每个文档都先注入捕获脚本（需要Chromium内核的execute_cdp_cmd），当前文档在下次刷新后生效"""
+    source = f"({CAPTURE_FUNCTION})({json.dumps(patterns)});"
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": source})
+
+def capture_baseline(driver):
+    """发送前调用：返回当前的流序号，页面中没有捕获脚本时返回None"""
+    return driver.execute_script(BASELINE_SCRIPT)
+
+class CapturedAnswer:
+    """发送后页面收到的一条聊天流：text/thinking为已读取的内容，complete表示收到了[DONE]，error为失败原因，timed_out表示等待超时"""
+    def __init__(self, driver, baseline):
+        self.driver = driver
+        self.baseline = baseline
+        self.text = ""
+        self.thinking = ""
+        self.text_offset = 0
+        self.thinking_offset = 0
+        self.started = False
+        self.complete = False
+        self.error = None
+        self.timed_out = False
+
+    def deltas(self, start_timeout=10, timeout=180, poll_interval=0.1):
+        """逐步产出新增的回答文本；start_timeout秒内没有出现聊天流、流出错或超时时停止，由调用方决定是否改用DOM"""
+        start_time = time.time()
+        while True:
+            state = self.driver.execute_script(POLL_SCRIPT, self.baseline, self.text_offset, self.thinking_offset)
+            if state is None:
+                self.error = "页面中没有聊天流捕获脚本"
+                return
+            if state["started"]:
+                self.started = True
+                self.thinking += state["thinking"]
+                self.thinking_offset = state["thinking_length"]
+                self.text_offset = state["text_length"]
+                if state["text"]:
+                    self.text += state["text"]
+                    yield state["text"]
+                if state["error"]:
+                    self.error = state["error"]
+                    return
+                if state["finished"]:
+                    self.complete = True
+                    return
+            elif time.time() - start_time >= start_timeout:
+                self.error = f"{start_timeout}秒内没有收到聊天流"
+                return
+            if time.time() - start_time >= timeout:
+                self.error = f"等待聊天流结束超时（{timeout}秒）"
+                self.timed_out = True
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,168 @@
+import asyncio
+import importlib
+import io
+import json
+import os
+import threading
+import types
+import pytest
+
+@pytest.fixture(scope="module")
+def aiapi(tmp_path_factory):
+    # 导入时会在当前目录创建app.log和批量任务目录
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("aiapi"))
+    try:
+        module = importlib.import_module("aiapi")
+    finally:
+        os.chdir(cwd)
+    return module
+
+class FakeTab:
+    """只实现OpenAI端点非流式路径用到的方法"""
+    tab_id = 9001
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lock.acquire()
+        self.last_used = 0
+
+    def handle_session(self, session_id):
+        return True
+
+    def change_model(self, model):
+        return True
+
+    def send_message(self, request_data):
+        return {"id": "cid-1", "text": f"回答: {request_data['text']}", "thinking": None, "citations": []}
+
+    def send_message_stream(self, request_data):
+        yield "- 第一项 "
+        yield "- 第二项"
+
+    def stream_answer(self, streamed_text):
+        return {"text": "- 第一项\n- 第二项", "thinking": None, "citations": []}
+
+    def get_current_session_id(self):
+        return "cid-1"
+
+async def post_until_disconnect(app, path, body, disconnect):
+    """经ASGI发送请求，disconnect被设置时模拟客户端断开（服务器随即取消处理函数）"""
+    data = json.dumps(body).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"host", b"test")],
+        "client": ("127.0.0.1", 1), "server": ("test", 80), "extensions": {}
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": data, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+def chat_body(text):
+    return {"model": "hunyuan", "messages": [{"role": "user", "content": text}]}
+
+def test_cancelled_leader_does_not_block_identical_requests(aiapi, monkeypatch):
+    queued = asyncio.Event()
+
+    async def acquire_never(*args, **kwargs):
+        queued.set()
+        await asyncio.Event().wait()
+
+    async def acquire_fake(*args, **kwargs):
+        return FakeTab()
+
+    async def main():
+        client = aiapi.app.test_client()
+        monkeypatch.setattr(aiapi, "acquire_tab", acquire_never)
+        body = chat_body("取消测试")
+        disconnect = asyncio.Event()
+        leader = asyncio.ensure_future(post_until_disconnect(aiapi.app, "/v1/chat/completions", body, disconnect))
+        await asyncio.wait_for(queued.wait(), 5)
+        assert aiapi.inflight_requests.stats()["inflight"] == 1
+        # 排队时客户端断开
+        disconnect.set()
+        await asyncio.wait_for(leader, 5)
+        assert aiapi.inflight_requests.stats()["inflight"] == 0
+
+        monkeypatch.setattr(aiapi, "acquire_tab", acquire_fake)
+        monkeypatch.setattr(aiapi, "release_tab", lambda tab, used=True: tab.lock.release())
+        response = await asyncio.wait_for(client.post("/v1/chat/completions", json=body), 10)
+        assert response.status_code == 200
+        assert "取消测试" in (await response.get_json())["choices"][0]["message"]["content"]
+
+    asyncio.run(main())
+
+def test_streamed_answer_is_cached_in_full_format(aiapi, monkeypatch):
+    async def acquire_fake(*args, **kwargs):
+        return FakeTab()
+
+    async def main():
+        client = aiapi.app.test_client()
+        monkeypatch.setattr(aiapi, "acquire_tab", acquire_fake)
+        monkeypatch.setattr(aiapi, "release_tab", lambda tab, used=True: tab.lock.release())
+        body = chat_body("流式缓存测试")
+        response = await client.post("/v1/chat/completions", json={**body, "stream": True})
+        streamed = (await response.get_data()).decode("utf-8")
+        assert "第二项" in streamed and "[DONE]" in streamed
+        # 非流式请求命中缓存时拿到的是保留了换行的完整回答，而不是流式输出的纯文本
+        response = await client.post("/v1/chat/completions", json=body)
+        assert response.headers.get("X-Cache") == "HIT"
+        assert (await response.get_json())["choices"][0]["message"]["content"] == "- 第一项\n- 第二项"
+
+    asyncio.run(main())
+
+class ReplayDriver:
+    """按顺序回放页面文本，模拟POLL_SCRIPT的回传（每次都整段重传）"""
+
+    def __init__(self, texts):
+        self.texts = list(texts)
+
+    def execute_script(self, script, *args):
+        text = self.texts.pop(0) if len(self.texts) > 1 else self.texts[0]
+        return {"count": 1, "append": False, "suffix": text, "length": len(text), "hash": 0,
+                "generating": False, "toolbars": 0}
+
+def test_stream_skips_status_text(aiapi):
+    page = types.SimpleNamespace(driver=ReplayDriver(["正在分析…", "正在分析…", "最终回答"]), tab_id=9001)
+    chunks = list(aiapi.YuanbaoAutomation.stream_response(page, "问题", wait_time=0, poll_interval=0))
+    assert "".join(chunks) == "最终回答"
+
+def test_batches_are_visible_only_to_their_owner(aiapi, monkeypatch, tmp_path):
+    from batch import BatchStore
+    from clients import ClientRegistry
+
+    monkeypatch.setattr(aiapi, "client_registry", ClientRegistry({"key-a": {"name": "a"}, "key-b": {"name": "b"}}))
+    monkeypatch.setattr(aiapi, "batch_store", BatchStore(str(tmp_path), send=lambda url, body, owner: (200, {}, {})))
+    key_a = {"Authorization": "Bearer key-a"}
+    key_b = {"Authorization": "Bearer key-b"}
+
+    async def main():
+        client = aiapi.app.test_client()
+        line = json.dumps({"custom_id": "1", "method": "POST", "url": "/v1/chat/completions", "body": chat_body("批量")})
+        input_file = aiapi.batch_store.save_file(io.BytesIO(line.encode("utf-8")), "input.jsonl", owner="a")
+        response = await client.post("/v1/batches", json={"input_file_id": input_file["id"]}, headers=key_b)
+        assert response.status_code == 400
+        response = await client.post("/v1/batches", json={"input_file_id": input_file["id"]}, headers=key_a)
+        batch = await response.get_json()
+        assert batch["owner"] == "a"
+
+        for file_id in (input_file["id"], batch["output_file_id"]):
+            assert (await client.get(f"/v1/files/{file_id}/content", headers=key_b)).status_code == 404
+        assert (await client.get(f"/v1/batches/{batch['id']}", headers=key_b)).status_code == 404
+        assert (await client.post(f"/v1/batches/{batch['id']}/cancel", headers=key_b)).status_code == 404
+        assert (await client.get(f"/v1/batches/{batch['id']}", headers=key_a)).status_code == 200
+        assert (await client.get(f"/v1/files/{input_file['id']}/content", headers=key_a)).status_code == 200
+
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+import pytest
+import cache
+from cache import ResponseCache, SingleFlight, FlightFailed, response_key
+
+class Clock:
+    """替换cache模块中的time.time"""
+    def __init__(self, monkeypatch, now=1000.0):
+        self.now = now
+        monkeypatch.setattr(cache.time, "time", lambda: self.now)
+
+def test_response_key_ignores_whitespace_and_data_url_prefix():
+    assert response_key("hunyuan", "你好  世界\n") == response_key("hunyuan", " 你好 世界")
+    assert response_key("hunyuan", "a") != response_key("deepseek", "a")
+    assert response_key("hunyuan", "a", ["data:image/png;base64,QUJD"]) == response_key("hunyuan", "a", ["data:image/jpeg;base64,QUJD"])
+    assert response_key("hunyuan", "a", ["QUJD"]) != response_key("hunyuan", "a", ["QUJE"])
+
+def test_least_recently_used_entry_is_evicted():
+    responses = ResponseCache(max_size=2)
+    responses.put("a", {"text": "A"})
+    responses.put("b", {"text": "B"})
+    assert responses.get("a") == {"text": "A"}
+    responses.put("c", {"text": "C"})
+    assert responses.get("b") is None
+    assert responses.get("a") == {"text": "A"}
+    assert responses.get("c") == {"text": "C"}
+    assert responses.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock(monkeypatch)
+    responses = ResponseCache(ttl=60)
+    responses.put("a", {"text": "A"})
+    clock.now += 59
+    assert responses.get("a") == {"text": "A"}
+    clock.now += 2
+    assert responses.get("a") is None
+    assert responses.stats()["size"] == 0
+
+def test_disabled_cache():
+    assert not ResponseCache(max_size=0).enabled
+
+def test_disk_store_survives_restart_and_respects_ttl(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    path = str(tmp_path / "cache.sqlite3")
+    ResponseCache(path=path, ttl=60).put("a", {"text": "持久", "citations": []})
+    restarted = ResponseCache(path=path, ttl=60)
+    assert restarted.get("a") == {"text": "持久", "citations": []}
+    clock.now += 61
+    assert ResponseCache(path=path, ttl=60).get("a") is None
+
+def test_identical_requests_share_one_execution():
+    flights = SingleFlight()
+    flight, leader = flights.begin("k")
+    joined, joined_leader = flights.begin("k")
+    assert leader and not joined_leader and joined is flight
+    flights.finish(flight, result={"text": "A"})
+    assert joined.wait(timeout=1) == {"text": "A"}
+    assert flights.stats() == {"inflight": 0, "idempotency_keys": 0}
+    # 结束后相同内容重新执行
+    assert flights.begin("k")[1]
+
+def test_requests_without_key_are_not_coalesced():
+    assert SingleFlight().begin(None) == (None, True)
+
+def test_failure_reaches_waiters_and_allows_retry():
+    flights = SingleFlight()
+    flight, _ = flights.begin("k", "idem")
+    joined, _ = flights.begin("k")
+    flights.finish(flight, error=FlightFailed(500, {"error": {}}))
+    with pytest.raises(FlightFailed):
+        joined.wait(timeout=1)
+    # 失败的执行不保留幂等记录，重试会重新执行
+    retry, leader = flights.begin("k", "idem")
+    assert leader and retry is not flight
+
+def test_finish_is_idempotent():
+    flights = SingleFlight()
+    flight, _ = flights.begin("k")
+    flights.finish(flight, result={"text": "A"})
+    flights.finish(flight, error=FlightFailed(500, None))
+    assert flight.wait(timeout=1) == {"text": "A"}
+
+def test_idempotency_key_replays_result_until_ttl(monkeypatch):
+    clock = Clock(monkeypatch)
+    flights = SingleFlight(idempotency_ttl=600)
+    flight, _ = flights.begin("k", "idem", "body-1")
+    flights.finish(flight, result={"text": "A"})
+    replay, leader = flights.begin("other", "idem", "body-1")
+    assert not leader and replay.wait(timeout=1) == {"text": "A"}
+    clock.now += 601
+    assert flights.begin("k", "idem", "body-1")[1]
+
+def test_idempotency_key_reused_for_different_body_is_rejected():
+    flights = SingleFlight()
+    flights.begin("k", "idem", "body-1")
+    with pytest.raises(ValueError):
+        flights.begin("k", "idem", "body-2")
+
+def test_idempotency_records_are_bounded():
+    flights = SingleFlight(max_size=2)
+    for i in range(4):
+        flight, _ = flights.begin(f"k{i}", f"idem{i}")
+        flights.finish(flight, result={"text": str(i)})
+    flights.begin("k9")
+    assert flights.stats()["idempotency_keys"] == 2
+
+def test_wait_times_out():
+    flight, _ = SingleFlight().begin("k")
+    with pytest.raises(TimeoutError):
+        flight.wait(timeout=0.05)
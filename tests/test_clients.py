@@ -0,0 +1,60 @@
+import pytest
+import clients
+from clients import ClientRegistry, Client, RateLimited
+
+class Clock:
+    """替换clients模块中的time.monotonic"""
+    def __init__(self, monkeypatch, now=100.0):
+        self.now = now
+        monkeypatch.setattr(clients.time, "monotonic", lambda: self.now)
+
+def test_known_unknown_and_missing_keys():
+    registry = ClientRegistry({"sk-a": {"name": "a"}})
+    assert registry.identify("sk-a").name == "a"
+    assert registry.identify("sk-unknown") is registry.anonymous
+    assert registry.identify(None) is registry.anonymous
+
+def test_required_key_rejects_unknown_keys():
+    registry = ClientRegistry({"sk-a": {"name": "a"}}, require_key=True)
+    assert registry.identify("sk-unknown") is None
+    assert registry.identify(None) is None
+    assert registry.identify("sk-a").name == "a"
+
+def test_unnamed_key_is_not_exposed():
+    registry = ClientRegistry({"sk-secret": {}})
+    name = registry.identify("sk-secret").name
+    assert name.startswith("key-") and "sk-secret" not in name
+    assert registry.key_for(name) == "sk-secret"
+
+def test_token_bucket_limits_rate_and_refills(monkeypatch):
+    clock = Clock(monkeypatch)
+    registry = ClientRegistry({"sk-a": {"name": "a", "rate": 1, "burst": 2}})
+    client = registry.identify("sk-a")
+    registry.admit(client)
+    registry.admit(client)
+    with pytest.raises(RateLimited) as excinfo:
+        registry.admit(client)
+    assert excinfo.value.retry_after == 1
+    clock.now += 1
+    registry.admit(client)
+    assert client.usage == {"accepted": 3, "rate_limited": 1, "rejected": 0}
+
+def test_clients_without_rate_are_never_limited():
+    registry = ClientRegistry()
+    for _ in range(100):
+        registry.admit(registry.anonymous)
+    assert registry.anonymous.usage["accepted"] == 100
+
+def test_concurrency_cap():
+    client = Client("a", max_concurrency=2)
+    client.active = 1
+    assert not client.at_capacity()
+    client.active = 2
+    assert client.at_capacity()
+    assert not Client("b").at_capacity()
+
+def test_default_limits_apply_to_anonymous():
+    registry = ClientRegistry(default_limits={"weight": 2, "rate": None, "burst": None, "max_concurrency": 1})
+    assert registry.anonymous.weight == 2
+    assert registry.anonymous.max_concurrency == 1
+    assert [c.name for c in registry.clients()] == ["anonymous"]
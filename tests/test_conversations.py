@@ -0,0 +1,21 @@
+from conversations import ConversationIndex
+
+def test_prefix_is_used_only_once():
+    index = ConversationIndex()
+    history = [{"role": "user", "content": "u1"}, {"role": "assistant", "content": "a1"}]
+    index.put("hunyuan", history, "cid-1")
+    assert index.pop("hunyuan", history) == "cid-1"
+    # 重新生成同一轮时，会话cid-1里已经有了上一次的u2/a2，不能再续接
+    assert index.pop("hunyuan", history) is None
+
+def test_prefix_ignores_whitespace_and_model():
+    index = ConversationIndex()
+    index.put("hunyuan", [{"role": "user", "content": "你好  世界"}], "cid-1")
+    assert index.pop("deepseek", [{"role": "user", "content": "你好 世界"}]) is None
+    assert index.pop("hunyuan", [{"role": "user", "content": " 你好 世界 "}]) == "cid-1"
+
+def test_expired_prefix_is_not_continued(monkeypatch):
+    index = ConversationIndex(ttl=10)
+    index.put("hunyuan", [{"role": "user", "content": "u1"}], "cid-1")
+    monkeypatch.setattr("conversations.time.time", lambda: 1e12)
+    assert index.pop("hunyuan", [{"role": "user", "content": "u1"}]) is None
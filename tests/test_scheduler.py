@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+import pytest
+from scheduler import TabScheduler, QueueRejected
+from clients import Client
+
+class FakeTab:
+    def __init__(self, tab_id):
+        self.tab_id = tab_id
+        self.lock = threading.Lock()
+
+class Pool:
+    """模拟标签页池：try_acquire取第一个能加锁的标签页，spawn只计数"""
+    def __init__(self, count):
+        self.tabs = [FakeTab(i) for i in range(count)]
+        self.spawns = 0
+
+    def try_acquire(self, model=None):
+        for tab in self.tabs:
+            if tab.lock.acquire(blocking=False):
+                return tab
+        return None
+
+    def spawn(self):
+        self.spawns += 1
+
+def make_scheduler(tabs=1, **kwargs):
+    pool = Pool(tabs)
+    scheduler = TabScheduler(pool.try_acquire, pool.spawn, lambda: len(pool.tabs), **kwargs)
+    return scheduler, pool
+
+def test_idle_tab_is_returned_locked():
+    scheduler, pool = make_scheduler()
+    tab = scheduler.acquire()
+    assert tab is pool.tabs[0]
+    assert tab.lock.locked()
+    assert pool.spawns == 0
+
+def test_release_hands_tab_to_waiter_without_unlocking():
+    scheduler, pool = make_scheduler()
+    tab = scheduler.acquire()
+    _, waiter = scheduler._admit("interactive", 10, None)
+    assert pool.spawns == 1
+    scheduler.release(tab)
+    assert waiter.future.result(timeout=1) is tab
+    assert tab.lock.locked()
+    assert scheduler.queue_length() == 0
+    scheduler.release(tab)
+    assert not tab.lock.locked()
+
+def test_interactive_requests_are_served_before_bulk():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+    _, bulk = scheduler._admit("bulk", 10, None)
+    _, interactive = scheduler._admit("interactive", 10, None)
+    scheduler.release(tab)
+    assert interactive.future.result(timeout=1) is tab
+    assert not bulk.future.done()
+
+def test_earlier_deadline_is_served_first_within_a_priority():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+    _, late = scheduler._admit("interactive", 60, None)
+    _, early = scheduler._admit("interactive", 10, None)
+    scheduler.release(tab)
+    assert early.future.result(timeout=1) is tab
+    assert not late.future.done()
+
+def test_full_queue_rejects_with_position():
+    scheduler, _ = make_scheduler(max_queue=1)
+    scheduler.acquire()
+    scheduler._admit("interactive", 10, None)
+    with pytest.raises(QueueRejected) as excinfo:
+        scheduler._admit("interactive", 10, None)
+    assert excinfo.value.position == 2
+    assert excinfo.value.retry_after >= 1
+
+def test_request_that_cannot_start_in_time_is_rejected_immediately():
+    scheduler, _ = make_scheduler()
+    scheduler.avg_service = 30
+    scheduler.acquire()
+    with pytest.raises(QueueRejected):
+        scheduler._admit("interactive", 10, None)
+    assert scheduler.queue_length() == 0
+
+def test_waiter_past_its_latest_start_is_shed_on_handoff():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+    _, stale = scheduler._admit("interactive", 10, None)
+    _, fresh = scheduler._admit("interactive", 20, None)
+    stale.latest_start = time.time() - 1
+    scheduler.release(tab)
+    with pytest.raises(QueueRejected):
+        stale.future.result(timeout=1)
+    assert fresh.future.result(timeout=1) is tab
+
+def test_acquire_timeout_removes_waiter_and_raises():
+    scheduler, _ = make_scheduler()
+    scheduler.acquire()
+    with pytest.raises(QueueRejected):
+        scheduler.acquire(timeout=0.2)
+    assert scheduler.queue_length() == 0
+
+def test_blocking_acquire_receives_released_tab():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("tab", scheduler.acquire(timeout=5)))
+    thread.start()
+    while scheduler.queue_length() == 0:
+        time.sleep(0.01)
+    scheduler.release(tab)
+    thread.join(timeout=2)
+    assert result["tab"] is tab
+
+def test_cancelled_async_waiter_passes_tab_on():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+
+    async def main():
+        first = asyncio.ensure_future(scheduler.acquire_async(timeout=10))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(scheduler.acquire_async(timeout=10))
+        await asyncio.sleep(0.05)
+        # 第一个等待者在被分配到标签页的同时断开
+        scheduler.release(tab)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.wait_for(second, 1)
+
+    assert asyncio.run(main()) is tab
+    assert tab.lock.locked()
+
+def test_service_time_estimate_tracks_releases():
+    scheduler, _ = make_scheduler()
+    tab = scheduler.acquire()
+    scheduler.started[tab.tab_id] -= 2
+    scheduler.release(tab)
+    assert scheduler.estimate_service() == pytest.approx(2, abs=0.1)
+
+def test_client_at_concurrency_cap_queues_even_with_idle_tab():
+    scheduler, pool = make_scheduler(tabs=2)
+    capped = Client("capped", max_concurrency=1)
+    first = scheduler.acquire(client=capped)
+    tab, waiter = scheduler._admit("interactive", 10, None, capped)
+    assert tab is None and not pool.tabs[1].lock.locked()
+    # 上限内的其他客户端不受影响
+    assert scheduler.acquire(client=Client("other")) is pool.tabs[1]
+    scheduler.release(first)
+    assert waiter.future.result(timeout=1) is first
+    assert capped.active == 1
+
+def test_handoff_skips_capped_client():
+    scheduler, _ = make_scheduler(tabs=2)
+    capped = Client("capped", max_concurrency=1)
+    held = scheduler.acquire(client=capped)
+    other_tab = scheduler.acquire()
+    _, capped_waiter = scheduler._admit("interactive", 10, None, capped)
+    _, other_waiter = scheduler._admit("interactive", 20, None, Client("other"))
+    scheduler.release(other_tab)
+    assert other_waiter.future.result(timeout=1) is other_tab
+    assert not capped_waiter.future.done()
+    scheduler.release(held)
+    assert capped_waiter.future.result(timeout=1) is held
+
+def test_tabs_are_shared_by_weight():
+    scheduler, _ = make_scheduler()
+    heavy, light = Client("heavy", weight=3), Client("light", weight=1)
+    tab = scheduler.acquire()
+    waiters = []
+    for _ in range(6):
+        waiters.append(("heavy", scheduler._admit("bulk", 60, None, heavy)[1]))
+        waiters.append(("light", scheduler._admit("bulk", 60, None, light)[1]))
+    served = []
+    for _ in range(8):
+        scheduler.release(tab)
+        name, waiter = next((name, w) for name, w in waiters if w.future.done() and (name, w) not in served)
+        served.append((name, waiter))
+    names = [name for name, _ in served]
+    assert names.count("heavy") == 6 and names.count("light") == 2
+
+def test_tab_time_is_charged_to_client():
+    scheduler, _ = make_scheduler()
+    client = Client("a")
+    tab = scheduler.acquire(client=client)
+    scheduler.started[tab.tab_id] -= 1
+    scheduler.release(tab)
+    assert client.active == 0
+    assert client.tab_seconds == pytest.approx(1, abs=0.1)
+    assert scheduler.queued_by_client() == {}
+
+def test_same_client_is_served_earliest_deadline_first():
+    scheduler, _ = make_scheduler()
+    client = Client("anonymous")
+    tab = scheduler.acquire(client=client)
+    _, late = scheduler._admit("interactive", 60, None, client)
+    _, early = scheduler._admit("interactive", 10, None, client)
+    scheduler.release(tab)
+    assert early.future.result(timeout=1) is tab
+    assert not late.future.done()
+
+def test_deadline_reordering_keeps_shares_between_clients():
+    scheduler, _ = make_scheduler()
+    heavy, light = Client("heavy", weight=3), Client("light", weight=1)
+    tab = scheduler.acquire()
+    light_waiters = [scheduler._admit("bulk", 60 - i, None, light)[1] for i in range(3)]
+    heavy_waiters = [scheduler._admit("bulk", 60, None, heavy)[1] for i in range(3)]
+    served = []
+    for _ in range(4):
+        scheduler.release(tab)
+        served.append(next(w for w in light_waiters + heavy_waiters if w.future.done() and w not in served))
+    assert sum(w in light_waiters for w in served) == 1
+    # light内部按截止时间：最后到达、期限最早的先执行
+    assert light_waiters[2] in served
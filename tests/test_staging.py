@@ -0,0 +1,25 @@
+import base64
+import os
+
+from staging import UploadStaging
+
+def encoded(text):
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+def test_same_content_is_staged_once(tmp_path):
+    staging = UploadStaging(root=str(tmp_path), instance=8000)
+    with staging.staged(encoded("图片"), "a.png") as first:
+        with staging.staged(encoded("图片"), "a.png") as second:
+            assert first == second
+    assert staging.stats() == {"files": 1, "bytes": len("图片".encode("utf-8")), "in_use": 0}
+
+def test_instances_do_not_collect_each_others_files(tmp_path):
+    first = UploadStaging(root=str(tmp_path), max_age=0, instance=8000)
+    second = UploadStaging(root=str(tmp_path), max_age=0, instance=8001)
+    with second.staged(encoded("上传中"), "b.png") as path:
+        with first.staged(encoded("其他"), "c.png"):
+            pass
+        first.collect()
+        assert os.path.exists(path)
+        # 启动时只接管自己子目录中的文件
+        assert UploadStaging(root=str(tmp_path), instance=8002).stats()["files"] == 0